@@ -2,7 +2,6 @@
 
 """Send query to multiple FHIR endpoints, consume all pages, write results to stdout."""
 
-import json
 import logging
 import os
 import urllib.parse as urlparse
@@ -13,6 +12,7 @@ from fhirclient.server import FHIRJSONMimeType
 
 from anvil.clients.fhir_client import DispatchingFHIRClient
 from anvil.clients.smart_auth import GoogleFHIRAuth
+from anvil.etl.utilities import serializer
 from anvil.etl.anvil_etl import LOG_FORMAT
 
 logging.basicConfig(
@@ -57,7 +57,7 @@ def worker(server, path=None, no_sign=False, headers={}):
     _url = initial_url
     while _url:
         (_json, _url) = fetch(_url, _headers=headers)
-        print(json.dumps(_json, separators=(',', ':')), flush=True)
+        print(serializer.dumps(_json, ensure_ascii=True), flush=True)
 
 
 def _dispatch(project, location, dataset, all_data_stores, requested_data_store, path, token):
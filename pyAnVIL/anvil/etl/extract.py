@@ -8,6 +8,7 @@ from anvil.etl.extractors.data_ingestion_tracker import write as write_projects
 from anvil.etl.extractors.gen3 import drs_extractor
 from anvil.etl.extractors.google import extract_buckets
 from anvil.etl.extractors.terra import cli as terra_cli, logger as terra_logger
+from anvil.etl.utilities.entities import DEFAULT_BATCH_SIZE
 
 
 logger = logging.getLogger(__name__)
@@ -23,10 +24,13 @@ def extract(ctx):
 
 @extract.command('google')
 @click.option('--user_project', default=DEFAULT_FHIR_PROJECT, help="AnVIL buckets use the `Requester Pays` feature. Please include a billing project. Defaults to FHIR_PROJECT")
+@click.option('--batch_size', default=DEFAULT_BATCH_SIZE, help='Rows written per database transaction.', show_default=True)
+@click.option('--workers', default=1, help='Number of buckets listed concurrently.', show_default=True)
+@click.option('--restart', default=False, is_flag=True, help='Ignore checkpoints from an interrupted run, list all buckets.', show_default=True)
 @click.pass_context
-def _google(ctx, user_project):
-    """Extract bucket data, write to db."""
-    extract_buckets(ctx.obj['output_path'], user_project)
+def _google(ctx, user_project, batch_size, workers, restart):
+    """Extract bucket data, write to db. Resumes an interrupted run."""
+    extract_buckets(ctx.obj['output_path'], user_project, batch_size=batch_size, workers=workers, restart=restart)
 
 
 @extract.command('spreadsheet')
@@ -40,10 +44,11 @@ def _spreadsheet(ctx):
 @click.option('--gen3_credentials_path', default=DEFAULT_GEN3_CREDENTIALS_PATH, help='Gen3 credentials. https://anvilproject.org/learn/introduction/getting-started-with-gen3#profile-page---api-keys-and-project-access', show_default=True)
 @click.option('--use_terra_credentials', is_flag=True, default=True, help='Running in terra VM, use terra authenticator to access gen3.', show_default=True)
 @click.option('--expected_row_count', default=175000, help="Minimum number of file records expected.", show_default=True)
+@click.option('--batch_size', default=DEFAULT_BATCH_SIZE, help='Rows written per database transaction.', show_default=True)
 @click.pass_context
-def _gen3(ctx, gen3_credentials_path, use_terra_credentials, expected_row_count):
+def _gen3(ctx, gen3_credentials_path, use_terra_credentials, expected_row_count, batch_size):
     """Extract meta data from gen3, including drs identifiers."""
-    drs_extractor(output_path=ctx.obj['output_path'], expected_row_count=expected_row_count, gen3_credentials_path=gen3_credentials_path, use_terra_credentials=use_terra_credentials)
+    drs_extractor(output_path=ctx.obj['output_path'], expected_row_count=expected_row_count, gen3_credentials_path=gen3_credentials_path, use_terra_credentials=use_terra_credentials, batch_size=batch_size)
 
 
 @extract.command('clean')
@@ -1,17 +1,124 @@
 import json
 import logging
 import sqlite3
+import time
 from gen3.auth import Gen3Auth
 from anvil.clients.gen3_auth import Gen3TerraAuth
 from anvil.clients.gen3_auth import TERRA_TOKEN_URL
 from gen3.query import Gen3Query
 from tabulate import tabulate
 
-from anvil.etl.utilities.entities import dict_factory
+from anvil.etl.utilities.entities import dict_factory, batches, DEFAULT_BATCH_SIZE
 
 
-def drs_extractor(gen3_credentials_path, output_path, use_terra_credentials, expected_row_count):
-    """Retrieve DRS url from Gen3's flat file index."""
+FILE_FIELDS = 'node_id,project_id,anvil_project_id,subject_submitter_id,sample_submitter_id,sequencing_assay_submitter_id,file_name,file_size,md5sum,submitter_id,drs_id,_subject_id'.split(',')
+
+
+def _first(_array):
+    """Return first element in array, or none if empty."""
+    if not _array or len(_array) == 0:
+        return None
+    return _array[0]
+
+
+def _drs_row(row):
+    """Create a drs_file row from a gen3 file record."""
+    return (
+        row['md5sum'],
+        row['node_id'],
+        row['file_name'],
+        row['drs_id'],
+        _first(row['sample_submitter_id']),
+        _first(row['subject_submitter_id']),
+        _first(row['_subject_id']),
+        row['project_id'],
+        _first(row['anvil_project_id']),
+    )
+
+
+def _project_ids(query_client):
+    """Return {project_id: file_count} from guppy's aggregation endpoint."""
+    response = query_client.graphql_query("""
+    query {
+        _aggregation {
+            file {
+                project_id { histogram { key count } }
+            }
+        }
+    }
+    """)
+    histogram = response['data']['_aggregation']['file']['project_id']['histogram']
+    return {bucket['key']: bucket['count'] for bucket in histogram}
+
+
+def _file_records(query_client, project_ids):
+    """Download file records one project at a time, so only one project is held in memory."""
+    for project_id in project_ids:
+        yield from query_client.raw_data_download(
+            data_type='file',
+            fields=FILE_FIELDS,
+            filter_object={'=': {'project_id': project_id}},
+        )
+
+
+def _load(conn, records, batch_size, logger, table='drs_file'):
+    """Write records to table in executemany batches, rows that fail go to {table}_reject.
+
+    Returns:
+        (int, int): rows written, rows rejected
+
+    """
+    row_count = reject_count = 0
+    start = time.time()
+    for batch in batches(records, batch_size):
+        rows = []
+        rejects = []
+        for record in batch:
+            try:
+                rows.append((record, _drs_row(record)))
+            except Exception as e:
+                rejects.append((json.dumps(record), f"{type(e).__name__}: {e}"))
+        try:
+            with conn:
+                conn.executemany(f"INSERT into {table} values (?, ?, ?, ?, ?, ?, ?, ?, ?);", [row for _, row in rows])
+        except sqlite3.Error:
+            # batch rolled back, retry row by row to isolate the bad ones
+            with conn:
+                for record, row in rows:
+                    try:
+                        conn.execute(f"INSERT into {table} values (?, ?, ?, ?, ?, ?, ?, ?, ?);", row)
+                    except sqlite3.Error as e:
+                        rejects.append((json.dumps(record), f"{type(e).__name__}: {e}"))
+        if rejects:
+            with conn:
+                conn.executemany(f"INSERT into {table}_reject values (?, ?);", rejects)
+        reject_count += len(rejects)
+        row_count += len(batch) - len(rejects)
+        elapsed = time.time() - start
+        logger.info(f"{row_count} rows written, {reject_count} rejected, {int(row_count / elapsed) if elapsed else row_count} rows/sec")
+    return row_count, reject_count
+
+
+def _replace_tables(conn):
+    """Replace drs_file and drs_file_reject with the loaded drs_file_new tables, index, in one transaction."""
+    conn.executescript("""
+    BEGIN;
+    DROP TABLE IF EXISTS drs_file;
+    DROP TABLE IF EXISTS drs_file_reject;
+    ALTER TABLE drs_file_new RENAME TO drs_file;
+    ALTER TABLE drs_file_new_reject RENAME TO drs_file_reject;
+    CREATE INDEX IF NOT EXISTS drs_file_md5sum ON drs_file(md5sum);
+    CREATE  INDEX IF NOT EXISTS drs_file_file_name ON drs_file(file_name);
+    COMMIT;
+    """)
+
+
+def drs_extractor(gen3_credentials_path, output_path, use_terra_credentials, expected_row_count, batch_size=DEFAULT_BATCH_SIZE):
+    """Retrieve DRS url from Gen3's flat file index.
+
+    File records are downloaded project by project and written in batches of `batch_size`,
+    records that cannot be written are saved in drs_file_reject.
+    """
     # TODO - consider wrapping this using the Entities class
     gen3_endpoint = "https://gen3.theanvil.io"
 
@@ -26,18 +133,17 @@ def drs_extractor(gen3_credentials_path, output_path, use_terra_credentials, exp
     logger = logging.getLogger(__name__)
 
     query_client = Gen3Query(auth)
-    logger.info('Starting export of data from gen3.')
-    raw_data = query_client.raw_data_download(data_type='file', fields='node_id,project_id,anvil_project_id,subject_submitter_id,sample_submitter_id,sequencing_assay_submitter_id,file_name,file_size,md5sum,submitter_id,md5sum,drs_id,_subject_id'.split(','))
-
-    assert len(raw_data) > expected_row_count, f"Expected over {expected_row_count} file records, got {len(raw_data)} instead.  Projects {set(sorted([(r['project_id']) for r in raw_data]))}"
-
-    logger.info(f"retrieved {len(raw_data)} file records from gen3.")
+    project_ids = _project_ids(query_client)
+    logger.info(f'Starting export of {sum(project_ids.values())} file records in {len(project_ids)} projects from gen3.')
 
     sqlite_path = f'{output_path}/drs_file.sqlite'
     _conn = sqlite3.connect(sqlite_path)
     cur = _conn.cursor()
+    # each export is a full refresh, loaded beside the previous tables, which are kept if the export fails or is short
     cur.executescript("""
-    CREATE TABLE IF NOT EXISTS drs_file (
+    DROP TABLE IF EXISTS drs_file_new;
+    DROP TABLE IF EXISTS drs_file_new_reject;
+    CREATE TABLE drs_file_new (
         md5sum text,
         sequencing_id text PRIMARY KEY,
         file_name text,
@@ -48,6 +154,10 @@ def drs_extractor(gen3_credentials_path, output_path, use_terra_credentials, exp
         project_id text,
         anvil_project_id text
     );
+    CREATE TABLE drs_file_new_reject (
+        json text NOT NULL,
+        error text NOT NULL
+    );
     """)
     _conn.commit()
     # optimize for single thread speed
@@ -57,48 +167,16 @@ def drs_extractor(gen3_credentials_path, output_path, use_terra_credentials, exp
     _conn.close()
 
     _conn = sqlite3.connect(sqlite_path, check_same_thread=False, isolation_level='DEFERRED')
-    cur = _conn.cursor()
     logger.info(f'Starting import of data into sqlite {sqlite_path}.')
 
-    def _first(_array):
-        """Return first element in array, or none if empty."""
-        if not _array or len(_array) == 0:
-            return None
-        return _array[0]
+    row_count, reject_count = _load(_conn, _file_records(query_client, project_ids), batch_size, logger, table='drs_file_new')
 
-    commit_threshold = 1000
-    c = 0
-    for row in raw_data:
-        try:
-            cur.execute(
-                "INSERT into drs_file values (?, ?, ?, ?, ?, ?, ?, ?, ?);", (
-                    row['md5sum'],
-                    row['node_id'],
-                    row['file_name'],
-                    row['drs_id'],
-                    _first(row['sample_submitter_id']),
-                    _first(row['subject_submitter_id']),
-                    _first(row['_subject_id']),
-                    row['project_id'],
-                    _first(row['anvil_project_id']),
-                )
-            )
-        except Exception:
-            logger.error(row)
-            logger.error("Fatal error writing row above to sqlite.", exc_info=True)
-            break
-        c += 1
-        if c > commit_threshold:
-            _conn.commit()
-            c = 0
-    _conn.commit()
+    assert row_count > expected_row_count, f"Expected over {expected_row_count} file records, got {row_count} instead, {reject_count} rejected.  Projects {sorted(project_ids)}"
 
     logger.info('Indexing')
-    cur.executescript("""
-    CREATE INDEX IF NOT EXISTS drs_file_md5sum ON drs_file(md5sum);
-    CREATE  INDEX IF NOT EXISTS drs_file_file_name ON drs_file(file_name);
-    """)
-    _conn.commit()
+    _replace_tables(_conn)
+    if reject_count:
+        logger.error(f"{reject_count} file records rejected, see drs_file_reject in {sqlite_path}")
     logger.info(f'Created {sqlite_path}')
 
     def _dict_factory(cursor, row):
@@ -121,16 +199,73 @@ def drs_extractor(gen3_credentials_path, output_path, use_terra_credentials, exp
 class DRSReader:
     """Read items in sqlite."""
 
-    def __init__(self, output_path):
-        """Set up sqlite db."""
+    def __init__(self, output_path, preload=False):
+        """Set up sqlite db.
+
+        If preload, read drs_file once and answer lookups from memory.
+        """
         self._path = f'{output_path}/drs_file.sqlite'
         self._conn = sqlite3.connect(self._path, check_same_thread=True)
         self._conn.row_factory = dict_factory
+        self._columns = None
+        self._rows = None
+        self._by_file_name = None
+        self._by_md5sum = None
+        if preload:
+            self._preload()
+
+    def _preload(self):
+        """Load rows as tuples, index them by file_name and md5sum, first row wins as in get(), NULLs are not indexed."""
+        cur = self._conn.cursor()
+        cur.row_factory = None
+        cur.execute("SELECT * FROM drs_file ORDER BY rowid")
+        self._columns = [col[0] for col in cur.description]
+        self._rows = cur.fetchall()
+        cur.close()
+        file_name_index = self._columns.index('file_name')
+        md5sum_index = self._columns.index('md5sum')
+        self._by_file_name = {}
+        self._by_md5sum = {}
+        for i, row in enumerate(self._rows):
+            if row[file_name_index] is not None:
+                self._by_file_name.setdefault(row[file_name_index], i)
+            if row[md5sum_index] is not None:
+                self._by_md5sum.setdefault(row[md5sum_index], i)
+
+    def _row(self, i):
+        if i is None:
+            return None
+        return dict(zip(self._columns, self._rows[i]))
 
     def get(self, file_name=None, md5sum=None):
         """Retrieve an item."""
         assert file_name or md5sum, "Please provide either file_name or md5sum"
+        if self._rows is not None:
+            # None is not indexed, as in sql it matches nothing
+            matches = [i for i in (self._by_file_name.get(file_name), self._by_md5sum.get(md5sum)) if i is not None]
+            return self._row(min(matches) if matches else None)
         cur = self._conn.cursor()
         data = cur.execute("SELECT * FROM drs_file where file_name=? or md5sum=?", (file_name, md5sum, )).fetchone()
         cur.close()
         return data
+
+    def get_many(self, file_names):
+        """Retrieve items for many file_names.
+
+        Returns:
+            dict: {file_name: item or None}
+
+        """
+        file_names = set(file_names)
+        if self._rows is not None:
+            return {file_name: self._row(self._by_file_name.get(file_name)) for file_name in file_names}
+        items = {file_name: None for file_name in file_names}
+        cur = self._conn.cursor()
+        # stay under sqlite's host parameter limit
+        for batch in batches(file_names, 500):
+            sql = f"SELECT * FROM drs_file where file_name in ({', '.join('?' * len(batch))}) ORDER BY rowid"
+            for item in cur.execute(sql, batch):
+                if not items[item['file_name']]:
+                    items[item['file_name']] = item
+        cur.close()
+        return items
@@ -1,11 +1,19 @@
 import logging
-from anvil.etl.utilities.entities import Entities
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from anvil.etl.utilities.entities import Entities, EntitiesWriter, DEFAULT_BATCH_SIZE
 from google.cloud.storage import Client
 from .terra import extract_bucket_fields
 
 
 logger = logging.getLogger(__name__)
 
+# blobs per list request
+DEFAULT_PAGE_SIZE = 1000
+# only request the attributes we keep, see Entities.put_blobs
+BLOB_FIELDS = 'items(bucket,name,size,md5Hash,crc32c,updated),nextPageToken'
+
 
 # @cli.command('clean')
 # @click.option('--output_path', default=DEFAULT_OUTPUT_PATH, help=f'output path default={DEFAULT_OUTPUT_PATH}')
@@ -19,25 +27,91 @@ logger = logging.getLogger(__name__)
 #         logger.warning((e, path))
 
 
-def extract_buckets(output_path, user_project):
-    """Get all gs:// bucket references in all workspaces from terra, retrieve blob info from google, write to db."""
-    entities = Entities(path=f"{output_path}/google_entities.sqlite")
+def _blob_rows(blobs):
+    """Create rows for Entities.put_blobs from a bucket listing."""
+    for blob in blobs:
+        _properties = blob._properties
+        size = _properties.get('size', None)
+        yield (
+            f"gs://{_properties['bucket']}/{_properties['name']}",
+            _properties['bucket'],
+            _properties['name'],
+            int(size) if size is not None else None,
+            _properties.get('md5Hash', None),
+            _properties.get('crc32c', None),
+            _properties.get('updated', None),
+        )
+
+
+def _list_bucket(client, writer, bucket, page_token, page_size):
+    """List blobs page by page, write each page then checkpoint the next page token.
+
+    Returns:
+        int: number of blobs written
+
+    """
+    blobs = client().list_blobs(bucket, page_token=page_token, page_size=page_size, fields=BLOB_FIELDS)
+    blob_count = 0
+    for page in blobs.pages:
+        rows = list(_blob_rows(page))
+        writer.put_blobs(rows)
+        blob_count += len(rows)
+        # the writer is FIFO, so the checkpoint lands after the page it follows
+        writer.submit(Entities.put_checkpoint, bucket, blobs.next_page_token, blobs.next_page_token is None)
+    return blob_count
+
+
+def extract_buckets(output_path, user_project, batch_size=DEFAULT_BATCH_SIZE, workers=1, page_size=DEFAULT_PAGE_SIZE, restart=False):
+    """Get all gs:// bucket references in all workspaces from terra, retrieve blob info from google, write to db.
+
+    Buckets are listed concurrently by `workers` threads; completed buckets and page tokens are checkpointed,
+    so an interrupted run resumes where it stopped unless `restart`.
+    """
+    path = f"{output_path}/google_entities.sqlite"
     logger.info(('user_project', user_project))
-    client = Client(project=user_project)
-    bucket_fields = [bf for bf in extract_bucket_fields(output_path)]
-    already_done = set()
-    for bucket_field in bucket_fields:
+
+    # bucket -> first (consortium_name, workspace_name) that references it
+    buckets = {}
+    for bucket_field in extract_bucket_fields(output_path):
         for bucket in bucket_field['buckets']:
-            if bucket in already_done:
+            buckets.setdefault(bucket, (bucket_field['consortium_name'], bucket_field['workspace_name']))
+
+    entities = Entities(path=path)
+    if restart:
+        entities.clear_checkpoints()
+    # bucket -> (page_token, done)
+    checkpoints = entities.get_checkpoints()
+    if checkpoints:
+        logger.info(f"Resuming, {len([c for c in checkpoints.values() if c[1]])} of {len(buckets)} buckets already listed.")
+
+    # google clients are not thread safe, one per thread
+    local = threading.local()
+
+    def _client():
+        if not hasattr(local, 'client'):
+            local.client = Client(project=user_project)
+        return local.client
+
+    with EntitiesWriter(path=path, batch_size=batch_size, max_pending=workers * 2) as writer, \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for bucket, (consortium_name, workspace_name) in buckets.items():
+            page_token, done = checkpoints.get(bucket, (None, False))
+            if done:
                 continue
-            logger.info((bucket_field['consortium_name'], bucket_field['workspace_name'], bucket))
-            already_done.add(bucket)
-            blobs = client.list_blobs(bucket)
-            for blob in blobs:
-                _properties = dict(blob._properties)
-                _properties['path'] = blob.path
-                _properties['public_url'] = blob.public_url
-                _properties['url'] = f"gs://{_properties['bucket']}/{_properties['name']}"
-                entities.put(key=_properties['url'], label='Blob', data=_properties)
-            entities.commit()
-    entities.index()
+            logger.info((consortium_name, workspace_name, bucket, 'resume' if page_token else 'start'))
+            futures[executor.submit(_list_bucket, _client, writer, bucket, page_token, page_size)] = bucket
+        for count, future in enumerate(as_completed(futures), start=1):
+            bucket = futures[future]
+            try:
+                blob_count = future.result()
+                logger.info(f"{count}/{len(futures)} buckets, {writer.blob_count} blobs written. {bucket} {blob_count} blobs")
+            except Exception as e:
+                # left unfinished in checkpoint, retried on the next run
+                logger.error(('bucket.list.failed', bucket, str(e)))
+        failed = [bucket for future, bucket in futures.items() if future.exception()]
+        if not failed:
+            # complete, next run starts over
+            writer.submit(Entities.clear_checkpoints)
+        else:
+            logger.error(f"{len(failed)} buckets not listed, re-run to resume: {failed}")
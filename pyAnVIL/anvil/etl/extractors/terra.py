@@ -4,15 +4,16 @@
 
 import logging
 import re
-from attrdict import AttrDict
 import firecloud.api as FAPI
 import json
 import click
 import os
 from urllib.parse import urlparse
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-from anvil.etl.utilities.entities import Entities
+from anvil.etl.utilities.entities import Entities, EntitiesWriter, DEFAULT_BATCH_SIZE
+from anvil.etl.utilities.node import Node
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(filename)s %(levelname)-8s %(message)s')
 logger = logging.getLogger('anvil.etl_old.extractors.terra')
@@ -21,6 +22,9 @@ logger = logging.getLogger('anvil.etl_old.extractors.terra')
 # where all workspaces are kept w/in terra
 DEFAULT_NAMESPACE = 'anvil-datastorage'
 
+# entities per request to terra's entityQuery endpoint
+DEFAULT_PAGE_SIZE = 1000
+
 # workspace patterns named tuple:  name, workspace_pattern
 DEFAULT_CONSORTIUMS = (
     ('CMG', 'AnVIL_CMG_.*'),
@@ -55,13 +59,13 @@ def get_workspaces(namespaces=None, name_pattern=None):
     logger.debug(f"get_entities {namespaces} {name_pattern}")
 
     workspaces = FAPI.list_workspaces()
-    workspaces = workspaces.json()
+    workspaces = [Node(w) for w in workspaces.json()]
 
     if namespaces:
-        workspaces = [AttrDict(w) for w in workspaces if w['workspace']['namespace'] in namespaces]
+        workspaces = [w for w in workspaces if w['workspace']['namespace'] in namespaces]
 
     if name_pattern:
-        workspaces = [AttrDict(w) for w in workspaces if re.match(name_pattern, w['workspace']['name'], re.IGNORECASE)]
+        workspaces = [w for w in workspaces if re.match(name_pattern, w['workspace']['name'], re.IGNORECASE)]
 
     # normalize fields
     for w in workspaces:
@@ -74,13 +78,27 @@ def get_entities(namespace='anvil-datastorage', workspace=None, entity_name=None
     """Return all entities in a workspace."""
     logger.debug(f"get_entities {namespace} {workspace} {entity_name}")
     try:
-        entities = [AttrDict(e) for e in FAPI.get_entities(namespace, workspace, entity_name).json()]
+        entities = [Node(e) for e in FAPI.get_entities(namespace, workspace, entity_name).json()]
         return entities
     except Exception as e:
         logger.error(f"{workspace} {entity_name} {e}")
         return []
 
 
+def iter_entity_pages(namespace, workspace, entity_name, page_size=DEFAULT_PAGE_SIZE):
+    """Yield lists of at most page_size entities, uses the paginated entityQuery endpoint."""
+    page = 1
+    while True:
+        logger.debug(f"get_entities_query {namespace} {workspace} {entity_name} {page}")
+        response = FAPI.get_entities_query(namespace, workspace, entity_name, page=page, page_size=page_size).json()
+        if not isinstance(response, dict) or 'results' not in response:
+            raise Exception(('no.results', workspace, entity_name, page, response))
+        yield response['results']
+        if page >= response['resultMetadata']['filteredPageCount']:
+            return
+        page += 1
+
+
 def get_schema(namespace, workspace):
     """Fetch all entity types."""
     logger.debug(f"get_schema {namespace} {workspace}")
@@ -95,11 +113,9 @@ def extract_bucket_fields(output_path=None, entities=None, workspace_name=None):
     if not entities:
         assert output_path
         entities = Entities(path=f"{output_path}/terra_entities.sqlite")
-    for workspace in entities.get_by_label('workspace'):
-        workspace = AttrDict(workspace)
-        if workspace_name and workspace.workspace.name != workspace_name:
-            continue
-        schema = AttrDict(entities.get_edges_by_label(src=workspace.workspace.name, src_name='workspace', dst_name='schema'))
+    for workspace in entities.get_workspaces(workspace_name=workspace_name):
+        workspace = Node(workspace)
+        schema = Node(entities.get_edges_by_label(src=workspace.workspace.name, src_name='workspace', dst_name='schema'))
         for entity_name in schema.schema.keys():
             if entity_name == 'schema':
                 continue
@@ -129,6 +145,51 @@ def make_entity_key(workspace_name, entity):
     return f"{entity['entityType']}/{workspace_name}/{entity['name']}"
 
 
+def _entity_rows(workspace_name, entity_name, terra_entities):
+    """Create (vertices, edges) rows for Entities.put_many/put_edges_many from a terra entity listing."""
+    vertices = []
+    edges = []
+    for entity in terra_entities:
+        if not isinstance(entity, dict):
+            # write a problem record
+            key = f"problem/{workspace_name}/{entity_name}"
+            vertices.append((key, 'problem', {'error': f'no.entity.returned {entity_name}'}))
+            edges.append((workspace_name, key, 'workspace', 'problem'))
+            break
+        # entity['name'] aka 'id'
+        id = make_entity_key(workspace_name, entity)
+        vertices.append((id, entity_name, entity))
+        edges.append((workspace_name, id, 'workspace', entity_name))
+    return vertices, edges
+
+
+def _extract_entities(writer, namespace, workspace_name, entity_name, page_size, staged):
+    """Fetch an entity type page by page, writing each page as it arrives.
+
+    Returns:
+        bool: True if a problem record was written
+
+    """
+    def _write(vertices, edges):
+        if staged:
+            writer.stage(workspace_name, vertices=vertices, edges=edges)
+        else:
+            writer.put(vertices=vertices, edges=edges)
+
+    try:
+        for page in iter_entity_pages(namespace, workspace_name, entity_name, page_size=page_size):
+            vertices, edges = _entity_rows(workspace_name, entity_name, page)
+            _write(vertices, edges)
+            if any(label == 'problem' for _, label, _ in vertices):
+                return True
+    except Exception as e:
+        logger.error(('no.entities', workspace_name, entity_name, str(e)))
+        # recorded as a problem
+        _write(*_entity_rows(workspace_name, entity_name, [None]))
+        return True
+    return False
+
+
 @click.group()
 @click.pass_context
 def cli(ctx):
@@ -153,8 +214,12 @@ def clean(ctx):
 @cli.command('extract')
 @click.option('--namespace', default=DEFAULT_NAMESPACE, help=f'Terra namespace default={DEFAULT_NAMESPACE}')
 @click.option('--consortium', default=None, help='Filter, only this consortium.')
+@click.option('--batch_size', default=DEFAULT_BATCH_SIZE, help='Rows written per database transaction.', show_default=True)
+@click.option('--page_size', default=DEFAULT_PAGE_SIZE, help='Entities per request to terra, bounds memory use.', show_default=True)
+@click.option('--workers', default=1, help='Number of concurrent requests to terra.', show_default=True)
+@click.option('--incremental', default=False, is_flag=True, help='Skip workspaces unchanged since last extract, replace changed ones.', show_default=True)
 @click.pass_context
-def extract_workspaces(ctx, namespace, consortium):
+def extract_workspaces(ctx, namespace, consortium, batch_size, page_size, workers, incremental):
     """Read workspaces from terra, write to database. Do this first! May take several minutes."""
     output_path = ctx.obj['output_path']
     consortiums = ctx.obj['config']['consortiums']
@@ -162,47 +227,93 @@ def extract_workspaces(ctx, namespace, consortium):
     if consortium:
         number_of_consortiums = 1
     logger.info(f"Extracting metadata for {number_of_consortiums} consortiums, this may take several minutes.")
-    entities = Entities(path=f"{output_path}/terra_entities.sqlite")
+    workspaces = []
     for consortium_name, config in consortiums.items():
         if consortium and consortium != consortium_name:
             continue
-        projects = get_workspaces(namespace, name_pattern=config['workspaces'])
-        for workspace in projects:
-            logger.info((consortium_name, workspace.workspace.name))
+        for workspace in get_workspaces(namespace, name_pattern=config['workspaces']):
             workspace.consortium_name = consortium_name
-            schema = FAPI.list_entity_types(namespace=namespace, workspace=workspace.workspace.name).json()
-            if 'statusCode' in schema:
-                logger.error(('no.schema', consortium_name, workspace.workspace.name, schema))
-                continue
-            entities.put(key=workspace.workspace.name, label='workspace', data=workspace)
-            entities.put(key=f"schema/{workspace.workspace.name}", label='schema', data=schema)
-            entities.put_edge(
-                src=workspace.workspace.name, src_name='workspace',
-                dst=f"schema/{workspace.workspace.name}", dst_name='schema',
-            )
-            for entity_name in schema.keys():
-                problem_occurred = False
-                for entity in FAPI.get_entities(namespace, workspace.workspace.name, entity_name).json():
-                    if problem_occurred:
-                        break
-                    if not isinstance(entity, dict):
-                        # write a problem record
-                        entities.put(key=f"problem/{workspace.workspace.name}/{entity_name}", label='problem', data={'error': f'no.entity.returned {entity_name}'})
-                        entities.put_edge(
-                            src=workspace.workspace.name, src_name='workspace',
-                            dst=f"problem/{workspace.workspace.name}/{entity_name}", dst_name='problem',
-                        )
-                        problem_occurred = True
+            workspaces.append(workspace)
+    logger.info(f"Extracting {len(workspaces)} workspaces with {workers} workers.")
+
+    path = f"{output_path}/terra_entities.sqlite"
+    # workspace_name -> (last_modified, entity_counts) from the last extract
+    previous_states = Entities(path=path).get_workspace_states() if incremental else {}
+
+    with EntitiesWriter(path=path, batch_size=batch_size, max_pending=workers * 2) as writer, \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+
+        # workspace_name -> entity types outstanding, problem flag and state to record when done
+        extracts = {}
+
+        def _finish(workspace_name):
+            """Swap in a changed workspace, record its state."""
+            extract = extracts.pop(workspace_name)
+            if incremental:
+                writer.submit(Entities.replace_edges, workspace_name, 'workspace')
+            if extract['problem']:
+                logger.warning(('workspace.state.not.recorded', workspace_name))
+            else:
+                writer.submit(Entities.put_workspace_state, workspace_name, *extract['state'])
+
+        # future -> (workspace, entity_name), entity_name is None for schema requests
+        pending = {
+            executor.submit(FAPI.list_entity_types, namespace=namespace, workspace=workspace.workspace.name): (workspace, None)
+            for workspace in workspaces
+        }
+        entity_type_count = 0
+        entity_types_done = 0
+        unchanged_count = 0
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                workspace, entity_name = pending.pop(future)
+                workspace_name = workspace.workspace.name
+                if entity_name is None:
+                    try:
+                        schema = future.result().json()
+                    except Exception as e:
+                        schema = {'statusCode': None, 'message': str(e)}
+                    if 'statusCode' in schema:
+                        logger.error(('no.schema', workspace.consortium_name, workspace_name, schema))
                         continue
-                    # entity['name'] aka 'id'
-                    id = make_entity_key(workspace.workspace.name, entity)
-                    entities.put(key=id, label=entity_name, data=entity)
-                    entities.put_edge(
-                        src=workspace.workspace.name, src_name='workspace',
-                        dst=id, dst_name=entity_name
-                    )
-    entities.commit(True)
-    entities.index()
+                    state = (workspace.workspace.get('lastModified', None), {k: v.get('count', None) for k, v in schema.items()})
+                    if incremental and previous_states.get(workspace_name, None) == state:
+                        logger.info(('unchanged', workspace.consortium_name, workspace_name))
+                        unchanged_count += 1
+                        continue
+                    logger.info((workspace.consortium_name, workspace_name))
+                    vertices = [
+                        (workspace_name, 'workspace', workspace),
+                        (f"schema/{workspace_name}", 'schema', schema),
+                    ]
+                    edges = [(workspace_name, f"schema/{workspace_name}", 'workspace', 'schema')]
+                    if incremental:
+                        # changed workspaces are staged, then replaced in one transaction
+                        writer.submit(Entities.clear_staging, workspace_name)
+                        writer.stage(workspace_name, vertices=vertices, edges=edges)
+                    else:
+                        writer.put(vertices=vertices, edges=edges)
+                    writer.put(catalog=[(workspace_name, workspace.consortium_name)])
+                    extracts[workspace_name] = {'remaining': len(schema), 'problem': False, 'state': state}
+                    for _entity_name in schema.keys():
+                        future = executor.submit(_extract_entities, writer, namespace, workspace_name, _entity_name, page_size, incremental)
+                        pending[future] = (workspace, _entity_name)
+                        entity_type_count += 1
+                    if len(schema) == 0:
+                        _finish(workspace_name)
+                    continue
+
+                extract = extracts[workspace_name]
+                extract['problem'] = future.result() or extract['problem']
+                extract['remaining'] -= 1
+                if extract['remaining'] == 0:
+                    _finish(workspace_name)
+                entity_types_done += 1
+                logger.info(f"{entity_types_done}/{entity_type_count} entity types, {writer.vertex_count} vertices written. {workspace_name}/{entity_name}")
+
+    if incremental:
+        logger.info(f"{unchanged_count} of {len(workspaces)} workspaces unchanged since last extract.")
 
 
 @cli.command('cat')
@@ -213,11 +324,11 @@ def cat(ctx, workspace):
     output_path = ctx.obj['output_path']
     name_pattern = workspace
     entities = Entities(path=f"{output_path}/terra_entities.sqlite")
-    for workspace in entities.get_by_label('workspace'):
+    for _consortium_name, workspace_name in entities.get_catalog():
         if name_pattern:
-            if not re.match(name_pattern, workspace['workspace']['name'], re.IGNORECASE):
+            if not re.match(name_pattern, workspace_name, re.IGNORECASE):
                 continue
-        workspace = AttrDict(workspace)
+        workspace = Node(entities.get(workspace_name))
         children = entities.get_edges(src=workspace.workspace.name, src_name='workspace')
         workspace.children = children
         print(json.dumps(workspace))
@@ -271,10 +382,8 @@ def schema(ctx, workspace):
     entities = Entities(path=f"{output_path}/terra_entities.sqlite")
 
     G = recursive_default_dict()
-    for workspace in entities.get_by_label('workspace'):
-        workspace = AttrDict(workspace)
-        if workspace_name and workspace.workspace.name != workspace_name:
-            continue
+    for workspace in entities.get_workspaces(workspace_name=workspace_name):
+        workspace = Node(workspace)
         schema = entities.get_edges_by_label(src=workspace.workspace.name, src_name='workspace', dst_name='schema')
         for entity_name in schema['schema']:
             assert 'attributeNames' in schema['schema'][entity_name], (entity_name, schema)
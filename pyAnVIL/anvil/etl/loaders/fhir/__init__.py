@@ -1,3 +1,4 @@
+import gzip
 import json
 import os
 from collections import defaultdict
@@ -5,14 +6,15 @@ from anvil.etl.utilities.shell_helper import run_cmd
 
 
 def _extract_workspace_mapping(output_path):
-    """Read ResearchStudy identifiers to retrieve the consortium, data_store and id."""
+    """Read ResearchStudy identifiers to retrieve the consortium, data_store, id and suffix of ndjson files, .ndjson or .ndjson.gz."""
     list_script = f"""
-        find {output_path} -name ResearchStudy.ndjson -print
+        find {output_path}/fhir -name 'ResearchStudy.ndjson*' -print
     """
     mapping = {'consortium': defaultdict(list), 'data_store': defaultdict(list), 'workspace_name': defaultdict(list)}
-    for path in [line for line in run_cmd(list_script).split('\n')]:
+    for path in [line for line in run_cmd(list_script).split('\n') if line]:
         research_studies = []
-        with open(path) as input_stream:
+        suffix = path[path.index('.ndjson'):]
+        with (gzip.open(path, 'rt') if suffix.endswith('.gz') else open(path)) as input_stream:
             research_studies.append(json.load(input_stream))
         for research_study in research_studies:
             identifiers = research_study['identifier']
@@ -20,7 +22,7 @@ def _extract_workspace_mapping(output_path):
             workspace = next(iter([identifier['value'] for identifier in identifiers if identifier['system'] == "https://anvil.terra.bio/#workspaces/anvil-datastorage/"]), None)
             data_store = next(iter([identifier['value'] for identifier in identifiers if identifier['system'] == "https://anvil.terra.bio/#FHIR/data-store"]), None)
             _id = research_study['id']
-            obj = {'name': workspace, 'id': _id, 'consortium': consortium, 'data_store': data_store}
+            obj = {'name': workspace, 'id': _id, 'consortium': consortium, 'data_store': data_store, 'suffix': suffix}
             mapping['consortium'][consortium].append(obj)
             mapping['data_store'][data_store].append(obj)
             mapping['workspace_name'][workspace].append(obj)
@@ -102,11 +102,12 @@ def upload(ctx, consortium, workspace, drop, check, go_fast):
         for dir_name in uploaded_workspaces:
             run_cmd(f"gsutil rm -r gs://$GOOGLE_BUCKET/{dir_name}")
 
+    # gzip in transit, except files that are gzipped already
     if go_fast:
-        run_cmd(f"gsutil -m cp -J -r {output_path}/fhir/ gs://$GOOGLE_BUCKET")
+        run_cmd(f"gsutil -m cp -j ndjson,json -r {output_path}/fhir/ gs://$GOOGLE_BUCKET")
     else:
         for group in chunker(uploaded_workspaces, 20):
-            cmds = [f"gsutil -m cp -J -r {output_path}/{dir_name}/ gs://$GOOGLE_BUCKET" for dir_name in group]
+            cmds = [f"gsutil -m cp -j ndjson,json -r {output_path}/{dir_name}/ gs://$GOOGLE_BUCKET" for dir_name in group]
             run_cmd('\n'.join(cmds))
 
     if check:
@@ -131,7 +132,7 @@ def load_data_stores(ctx, data_store):
                 continue
             object_path = f"fhir/{mapping['data_store']}/{mapping['consortium']}/{mapping['name']}"
             cmds.append(
-                f"gcloud healthcare fhir-stores import gcs {data_store} --location=$GOOGLE_LOCATION --dataset=$GOOGLE_DATASET --content-structure=resource --async --gcs-uri=gs://$GOOGLE_BUCKET/{object_path}/**.ndjson"
+                f"gcloud healthcare fhir-stores import gcs {data_store} --location=$GOOGLE_LOCATION --dataset=$GOOGLE_DATASET --content-structure=resource --async --gcs-uri=gs://$GOOGLE_BUCKET/{object_path}/**{mapping['suffix']}"
             )
             # for subdir in ['public', 'protected']:
             #     cmds.append(f"gcloud healthcare fhir-stores import gcs {data_store} --location=$GOOGLE_LOCATION --dataset=$GOOGLE_DATASET --content-structure=resource --async --gcs-uri=gs://$GOOGLE_BUCKET/{object_path}/{subdir}/*.ndjson"
@@ -144,7 +145,18 @@ def load_data_stores(ctx, data_store):
 @click.pass_context
 def load_public_data_stores(ctx):
     """Load public resources from bucket into 'public' data store."""
-    run_cmd("gcloud healthcare fhir-stores import gcs public --location=$GOOGLE_LOCATION --dataset=$GOOGLE_DATASET --content-structure=resource --async --gcs-uri=gs://$GOOGLE_BUCKET/fhir/*/*/*/public/*.ndjson")
+    output_path = ctx.obj["output_path"]
+    suffixes = set()
+    if os.path.isdir(f"{output_path}/fhir"):
+        workspaces = _extract_workspace_mapping(output_path)['workspace_name'].values()
+        suffixes = {mapping['suffix'] for mappings in workspaces for mapping in mappings}
+    if not suffixes:
+        # nothing written here to tell, the bucket may have been uploaded elsewhere
+        logger.warning(('no.local.fhir.output', output_path, 'importing *.ndjson'))
+        suffixes = {'.ndjson'}
+    # one import per suffix written, .ndjson and/or .ndjson.gz
+    for suffix in sorted(suffixes):
+        run_cmd(f"gcloud healthcare fhir-stores import gcs public --location=$GOOGLE_LOCATION --dataset=$GOOGLE_DATASET --content-structure=resource --async --gcs-uri=gs://$GOOGLE_BUCKET/fhir/*/*/*/public/*{suffix}")
     _log_console_link(logger)
 
 
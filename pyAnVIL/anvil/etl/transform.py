@@ -1,13 +1,20 @@
 import os
 import click
 from anvil.etl.transformers.normalizer import ontologies, _recursive_default_dict, fetch_workspace_names, \
-    write_workspace
-
-from anvil.etl.transformers.normalizer import normalize, analyze
-from anvil.etl.transformers.fhir_writer import write
-import json
+    fetch_workspace_sizes, write_workspace
+
+from anvil.etl.transformers.normalizer import normalize, analyze, write_analysis_shard, merge_analysis
+from anvil.etl.transformers.fhir_writer import write, workspace_dir_path
+from anvil.etl.transformers.fingerprint import is_fresh, remove_record, workspace_fingerprint, workspace_urls, write_record
+from anvil.etl.transformers.normalizer_methods import command_timings, reset_command_timings
+from anvil.etl.utilities.ndjson import DEFAULT_COMPRESS_LEVEL
+import shutil
+import time
+from collections import defaultdict
 from multiprocessing import Pool
 
+from tabulate import tabulate
+
 import logging 
 logger = logging.getLogger(__name__)
 
@@ -20,35 +27,95 @@ def transform(ctx):
     logger.setLevel(ctx.obj['log_level'])
 
 
+def _timed_worker(task):
+    """Process worker, run fn(output_path, consortium_name, workspace_name, *args), return timing and normalizer command timings."""
+    fn, output_path, consortium_name, workspace_name, args = task
+    reset_command_timings()
+    start = time.time()
+    result = error = None
+    try:
+        result = fn(output_path, consortium_name, workspace_name, *args)
+    except Exception as e:
+        logger.error((f"{fn.__name__}.failed", consortium_name, workspace_name, str(e)), exc_info=True)
+        error = str(e)
+    return consortium_name, workspace_name, time.time() - start, result, error, command_timings()
+
+
+def _command_summary(timings):
+    """Tabulate calls and seconds per normalizer command and consortium, slowest first."""
+    rows = sorted(([consortium_name, cmd, calls, round(seconds, 2)] for (consortium_name, cmd), (calls, seconds) in timings.items()),
+                  key=lambda row: row[3], reverse=True)
+    return tabulate(rows, ['consortium', 'command', 'calls', 'seconds'])
+
+
+def _run_workspaces(fn, output_path, workspace_names, args, jobs):
+    """Run fn for all workspaces in a process pool, largest workspaces first.
+
+    Returns:
+        (dict, list): {(consortium_name, workspace_name): fn result} of those that succeeded,
+        (consortium_name, workspace_name) that failed
+
+    """
+    sizes = fetch_workspace_sizes(output_path)
+    workspace_names = sorted(workspace_names, key=lambda w: sizes.get(w[1], 0), reverse=True)
+    tasks = [(fn, output_path, consortium_name, workspace_name, args) for consortium_name, workspace_name in workspace_names]
+    results = {}
+    failed = []
+    timings = defaultdict(lambda: [0, 0.0])
+    start = time.time()
+    with Pool(processes=jobs, maxtasksperchild=1) as pool:
+        for count, (consortium_name, workspace_name, elapsed, result, error, command_timing) in enumerate(pool.imap_unordered(_timed_worker, tasks), start=1):
+            for key, (calls, seconds) in command_timing.items():
+                timings[key][0] += calls
+                timings[key][1] += seconds
+            logger.info(f"{count}/{len(tasks)} {consortium_name} {workspace_name} {sizes.get(workspace_name, 0)} entities {elapsed:.1f}s{' FAILED' if error else ''}")
+            if error:
+                failed.append((consortium_name, workspace_name))
+            else:
+                results[(consortium_name, workspace_name)] = result
+    logger.info(f"{len(tasks)} workspaces in {time.time() - start:.1f}s, {len(failed)} failed")
+    if timings:
+        logger.info(f"\nNormalizer commands\n{_command_summary(timings)}")
+    if failed:
+        logger.error(('failed.workspaces', sorted(failed)))
+    return results, failed
+
+
+def _raise_if_failed(failed):
+    """Exit with an error listing the workspaces that failed, if any."""
+    if failed:
+        raise click.ClickException(f"{len(failed)} workspaces failed: {', '.join(f'{c}/{w}' for c, w in sorted(failed))}")
+
+
 @transform.command(name='normalize')
 @click.option('--consortium', default=None, help='Filter, only this consortium.')
 @click.option('--workspace', default=None, help='Filter, only this workspace.')
 @click.option('--validate_buckets/--no-validate_buckets', default=True, help='Check gs:// urls against bucket contents.', show_default=True)
+@click.option('--jobs', default=os.cpu_count(), help='Number of workspaces processed in parallel.', show_default=True)
+@click.option('--force', default=False, is_flag=True, help='Normalize workspaces even if their inputs are unchanged.', show_default=True)
 @click.pass_context
-def _normalize(ctx, consortium, workspace, validate_buckets):
+def _normalize(ctx, consortium, workspace, validate_buckets, jobs, force):
     """Normalize workspace and write summary to stdout."""
-    if not consortium:
-        consortium = _consortium_from_workspace(ctx.obj['config'], workspace)
+    if workspace:
+        if not consortium:
+            consortium = _consortium_from_workspace(ctx.obj['config'], workspace)
         workspace_names = [(consortium, workspace)]
     else:
         workspace_names = fetch_workspace_names(ctx.obj['output_path'], requested_consortium_name=consortium, workspace_name=workspace)
 
-    with Pool(maxtasksperchild=1) as pool:
-        for consortium_name, workspace_name in workspace_names:
-            pool.starmap(write_workspace, [(ctx.obj['output_path'], consortium, workspace_name, validate_buckets, ctx.obj['config'])])
+    results, failed = _run_workspaces(write_workspace, ctx.obj['output_path'], workspace_names, (validate_buckets, ctx.obj['config'], force), jobs)
+    logger.info(f"{len([r for r in results.values() if r])} workspaces normalized, {len([r for r in results.values() if not r])} unchanged")
+    _raise_if_failed(failed)
 
 
-def _print_analysis(output_path, consortium, workspace, details, validate_buckets, config, file_name):
-    """Process worker."""
+def _print_analysis(output_path, consortium, workspace, details, validate_buckets, config):
+    """Process worker, write the workspace's analysis shard."""
     analysis = analyze(output_path, consortium, workspace, details, validate_buckets, config)
     if analysis == {}:
         logger.error(('no.analysis', workspace))
         return
     logger.info(f"working on {workspace}")
-    _json = json.dumps(analysis[consortium][workspace], separators=(',', ':'))
-    with open(file_name, "a") as output_stream:
-        output_stream.write(_json)    
-        output_stream.write('\n')    
+    write_analysis_shard(output_path, consortium, workspace, analysis[consortium][workspace])
 
 
 def _consortium_from_workspace(config, workspace_name):    
@@ -66,9 +133,10 @@ def _consortium_from_workspace(config, workspace_name):
 @click.option('--workspace', default=None, help='Filter, only this workspace.')
 @click.option('--details', default=True, help='Include error details.', show_default=True, is_flag=True)
 @click.option('--validate_buckets/--no-validate_buckets', default=True, help='Check gs:// urls against bucket contents.', show_default=True)
+@click.option('--jobs', default=os.cpu_count(), help='Number of workspaces processed in parallel.', show_default=True)
 @click.pass_context
-def _analyze(ctx, consortium, workspace, details, validate_buckets):
-    """Retrieve workspace and write summary <data>/analysis.ndjson."""
+def _analyze(ctx, consortium, workspace, details, validate_buckets, jobs):
+    """Retrieve workspace and write summary <data>/analysis/<consortium>/<workspace>.json, merged into <data>/analysis.ndjson."""
     if workspace:
         if not consortium:
             consortium = _consortium_from_workspace(ctx.obj['config'], workspace)
@@ -76,24 +144,59 @@ def _analyze(ctx, consortium, workspace, details, validate_buckets):
     else:
         workspace_names = fetch_workspace_names(ctx.obj['output_path'], requested_consortium_name=consortium, workspace_name=workspace)
 
-    import os
-    import contextlib
-    with contextlib.suppress(FileNotFoundError):
-        os.remove(f"{ctx.obj['output_path']}/analysis.ndjson")
-
-    file_name = f"{ctx.obj['output_path']}/analysis.ndjson"
-    logging.info(f"writing to {file_name}")
-    with Pool(maxtasksperchild=1) as pool:
-        for consortium_name, workspace_name in workspace_names:
-            pool.starmap(_print_analysis, [(ctx.obj['output_path'], consortium_name, workspace_name, details, validate_buckets, ctx.obj['config'], file_name)])
+    if not consortium and not workspace:
+        # full run, drop shards of workspaces that no longer exist
+        shutil.rmtree(f"{ctx.obj['output_path']}/analysis", ignore_errors=True)
 
+    _, failed = _run_workspaces(_print_analysis, ctx.obj['output_path'], workspace_names, (details, validate_buckets, ctx.obj['config']), jobs)
+    # a failed workspace has no shard, don't merge an analysis that silently omits it
+    _raise_if_failed(failed)
 
-def _fhir_transform(workspace_name, output_path, config, validate_buckets, details):
+    file_name = f"{ctx.obj['output_path']}/analysis.ndjson"
+    count = merge_analysis(ctx.obj['output_path'])
+    logger.info(f"wrote {count} workspaces to {file_name}")
+
+
+def _fhir_transform(output_path, consortium_name, workspace_name, validate_buckets, details, config, force=False, strict=False,
+                    compress=None, compress_level=DEFAULT_COMPRESS_LEVEL):
+    """Process worker, return {resource_type: count} written, skip if inputs are unchanged since the last write."""
+    # fingerprint inputs once, for the fhir and normalize freshness checks and the new record
+    fingerprints = {}
+    if not force:
+        record = is_fresh(output_path, consortium_name, workspace_name, validate_buckets, config, 'fhir', fingerprints=fingerprints, details=details, compress=compress)
+        if record and os.path.isdir(record['dir_path']):
+            logger.info(('fhir.unchanged', consortium_name, workspace_name))
+            return record['counts']
+    remove_record(output_path, consortium_name, workspace_name, 'fhir')
+    counts = defaultdict(int)
     for consortium_name, _workspace in normalize(
             output_path, workspace_name=workspace_name,
-            requested_consortium_name=None,
-            validate_buckets=validate_buckets, config=config):
-        write(consortium_name, _workspace, output_path, details, config)
+            requested_consortium_name=consortium_name,
+            validate_buckets=validate_buckets, config=config, fingerprints=fingerprints):
+        for resource_type, count in write(consortium_name, _workspace, output_path, details, config, strict=strict,
+                                          compress=compress, compress_level=compress_level).items():
+            counts[resource_type] += count
+        urls = workspace_urls(_workspace)
+        write_record(output_path, consortium_name, workspace_name, 'fhir', {
+            'fingerprint': workspace_fingerprint(output_path, consortium_name, workspace_name, validate_buckets, config, urls=urls, fingerprints=fingerprints),
+            'urls': urls,
+            'details': details,
+            'compress': compress,
+            'dir_path': workspace_dir_path(output_path, consortium_name, _workspace),
+            'counts': dict(counts),
+        })
+    return dict(counts)
+
+
+def _fhir_summary(results):
+    """Tabulate resources written per workspace and per resource type."""
+    resource_types = sorted({resource_type for counts in results.values() for resource_type in counts})
+    rows = [
+        [consortium_name, workspace_name] + [counts.get(resource_type, 0) for resource_type in resource_types]
+        for (consortium_name, workspace_name), counts in sorted(results.items())
+    ]
+    rows.append(['total', ''] + [sum(counts.get(resource_type, 0) for counts in results.values()) for resource_type in resource_types])
+    return tabulate(rows, ['consortium', 'workspace'] + resource_types)
 
 
 @transform.command(name='fhir')
@@ -101,17 +204,21 @@ def _fhir_transform(workspace_name, output_path, config, validate_buckets, detai
 @click.option('--workspace', default=None, help='Filter, only this workspace')
 @click.option('--validate_buckets/--no-validate_buckets', default=True, help='Check gs:// urls against bucket contents.', show_default=True)
 @click.option('--details', default=False, help='Include error details.', show_default=True, is_flag=True)
+@click.option('--jobs', default=os.cpu_count(), help='Number of workspaces processed in parallel.', show_default=True)
+@click.option('--force', default=False, is_flag=True, help='Write workspaces even if their inputs are unchanged.', show_default=True)
+@click.option('--strict', default=False, is_flag=True, help='Validate every resource with fhirclient models (slower), use with --force to check unchanged workspaces.', show_default=True)
+@click.option('--compress', default=None, type=click.Choice(['gzip']), help='Write <resource>.ndjson.gz, imported as is by `load fhir data-store load`.', show_default=True)
+@click.option('--compress_level', default=DEFAULT_COMPRESS_LEVEL, type=click.IntRange(1, 9), help='1 (fastest) to 9 (smallest).', show_default=True)
 @click.pass_context
-def _fhir(ctx, consortium, workspace, validate_buckets, details):
+def _fhir(ctx, consortium, workspace, validate_buckets, details, jobs, force, strict, compress, compress_level):
     """Normalize workspace and write as FHIR to file system (takes several minutes)."""
     if workspace:
-        workspace_names = [workspace]
+        if not consortium:
+            consortium = _consortium_from_workspace(ctx.obj['config'], workspace)
+        workspace_names = [(consortium, workspace)]
     else:
         workspace_names = fetch_workspace_names(ctx.obj['output_path'], requested_consortium_name=consortium, workspace_name=workspace)
 
-    # with Pool(maxtasksperchild=1) as pool:
-    #     for consortium_name, workspace_name in workspace_names:
-    #         pool.starmap(_fhir_transform, [(workspace_name, ctx.obj['output_path'], ctx.obj['config'], validate_buckets, details,)])
-
-    for consortium_name, workspace_name in workspace_names:
-        _fhir_transform(workspace_name, ctx.obj['output_path'], ctx.obj['config'], validate_buckets, details,)
+    results, failed = _run_workspaces(_fhir_transform, ctx.obj['output_path'], workspace_names, (validate_buckets, details, ctx.obj['config'], force, strict, compress, compress_level), jobs)
+    logger.info(f"\nFHIR resources written\n{_fhir_summary(results)}")
+    _raise_if_failed(failed)
@@ -5,6 +5,7 @@ import uuid
 import logging
 import re
 import itertools
+from functools import lru_cache
 
 import fhirclient.models.patient as FHIRPatient
 import fhirclient.models.organization as FHIROrganization
@@ -14,12 +15,10 @@ import fhirclient.models.specimen as FHIRSpecimen
 import fhirclient.models.task as FHIRTask
 import fhirclient.models.documentreference as FHIRDocumentReference
 import fhirclient.models.observation as FHIRObservation
-import fhirclient.models.fhirreference as FHIRReference
-import fhirclient.models.identifier as FHIRIdentifier
 import fhirclient.models.practitioner as FHIRPractitioner
 import fhirclient.models.practitionerrole as FHIRPractitionerRole
-import fhirclient.models.extension as FHIRExtension
 
+from anvil.etl.utilities.ndjson import DEFAULT_COMPRESS_LEVEL, NDJSONWriter
 from anvil.etl.utilities.disease_normalizer import ontology_text, disease_system, text_ontology
 from anvil.etl.utilities.body_site_normalizer import lookup_body_site
 
@@ -28,59 +27,80 @@ logger = logging.getLogger(__name__)
 # note coordinate with StructureDefintions /fhir/config.yaml::canonical
 CANONICAL = "https://nih-ncpi.github.io/ncpi-fhir-ig"
 
+# _id's uuid5 namespace
+ID_NAMESPACE = uuid.UUID(bytes=bytes(bytearray("pyAnVIL".ljust(16), 'utf-8')))
+ILLEGAL_ID_CHARACTERS = re.compile(r'[^A-Za-z0-9\-\.]')
+# ids are cached, a patient's id is used by each of its specimens, tasks and observations
+ID_CACHE_SIZE = 2 ** 16
+
+# resources are built as plain dicts, keys in the order fhirclient's as_json() writes them, empty values omitted
+# strict writes validate each through its fhirclient model
+MODELS = {
+    'Organization': FHIROrganization.Organization,
+    'Practitioner': FHIRPractitioner.Practitioner,
+    'PractitionerRole': FHIRPractitionerRole.PractitionerRole,
+    'ResearchStudy': FHIRResearchStudy.ResearchStudy,
+    'ResearchSubject': FHIRResearchSubject.ResearchSubject,
+    'Patient': FHIRPatient.Patient,
+    'Specimen': FHIRSpecimen.Specimen,
+    'Task': FHIRTask.Task,
+    'DocumentReference': FHIRDocumentReference.DocumentReference,
+    'Observation': FHIRObservation.Observation,
+}
+
+
+def validate(fhir_resource):
+    """Round trip resource through its fhirclient model, raise FHIRValidationError if invalid."""
+    return MODELS[fhir_resource['resourceType']](fhir_resource).as_json()
+
 
 def _ref(fhir_resource):
     """Create a local reference for a fhir resource."""
-    return FHIRReference.FHIRReference({'reference': f"{fhir_resource.resource_type}/{fhir_resource.id}"})
+    return {'reference': f"{fhir_resource['resourceType']}/{fhir_resource['id']}"}
 
 
+@lru_cache(maxsize=ID_CACHE_SIZE)
 def _id(*args):
     """Create legal fhir id, a reproducible SHA-1 hash of a workspace_name and resource_id."""
-    name = '-'.join([x for x in args])
-    namespace = bytes(bytearray("pyAnVIL".ljust(16), 'utf-8'))
-    namespace_uuid = uuid.UUID(bytes=namespace)
-    return str(uuid.uuid5(namespace_uuid, name))
+    return str(uuid.uuid5(ID_NAMESPACE, '-'.join(args)))
 
 
 def _identifier(workspace, terra_entity):
     """Create FHIR compliant identifier from terra entity"""
-    js = {
+    return {
         "system": f"https://anvil.terra.bio/#workspaces/anvil-datastorage/{workspace.workspace.name}",
         "value": f"{terra_entity['entityType']}/{terra_entity['name']}",
     }
-    return FHIRIdentifier.Identifier(js)
 
 
 def _document_reference_identifier(workspace, output_source, output_property, specimen):
     """Create FHIR compliant identifier for document reference, add the blob origination entity and property."""
-    js = {
+    return {
         "system": f"https://anvil.terra.bio/#workspaces/anvil-datastorage/{workspace.workspace.name}",
         "value": f"{specimen['entityType']}/{specimen['name']}#{output_source}/{output_property}",
     }
-    return FHIRIdentifier.Identifier(js)
 
 
 def _family_identifier(workspace, family_id):
     """Create FHIR compliant identifier for family_id."""
-    js = {
+    return {
         "system": f"https://anvil.terra.bio/#workspaces/anvil-datastorage/{workspace.workspace.name}#family_id",
         "value": family_id
     }
-    return FHIRIdentifier.Identifier(js)
 
 
 def _patient_identifier(workspace, id, label):
     """Create FHIR compliant identifier for patient id."""
-    js = {
+    return {
         "system": f"https://anvil.terra.bio/#workspaces/anvil-datastorage/{workspace.workspace.name}#{label}",
         "value": id
     }
-    return FHIRIdentifier.Identifier(js)
 
 
+@lru_cache(maxsize=ID_CACHE_SIZE)
 def _fhir_id(*args):
     """Create legal fhir id."""
-    return re.sub(r'[^A-Za-z0-9\-\.]', "-", ".".join(str(a) for a in args))[-64:]
+    return ILLEGAL_ID_CHARACTERS.sub("-", ".".join(str(a) for a in args))[-64:]
 
 
 def ensure_data_store_name(workspace):
@@ -102,66 +122,77 @@ def _create_administrative_entities(workspace, consortium_name):
     """Generate FHIR Organization, ResearchStudy, etc."""
     workspace_name = workspace.workspace.name
 
-    anvil_org = FHIROrganization.Organization({'id': 'anvil'})
-    anvil_org.identifier = [
-        FHIRIdentifier.Identifier({
+    anvil_org = {
+        'id': 'anvil',
+        'identifier': [{
             "system": "https://anvil.terra.bio/program",
             "value": 'anvil',
-        })
-    ]
+        }],
+        'resourceType': 'Organization'
+    }
 
-    consortium_org = FHIROrganization.Organization({'id': _fhir_id(consortium_name)})
-    consortium_org.partOf = _ref(anvil_org)
-    consortium_org.identifier = [
-        FHIRIdentifier.Identifier({
+    consortium_org = {
+        'id': _fhir_id(consortium_name),
+        'identifier': [{
             "system": "https://anvil.terra.bio/consortium",
             "value": consortium_name,
-        })
-    ]
+        }],
+        'partOf': _ref(anvil_org),
+        'resourceType': 'Organization'
+    }
 
-    data_store_name = ensure_data_store_name(workspace)    
-    data_store_org = FHIROrganization.Organization({'id': _fhir_id(data_store_name)})
-    data_store_org.partOf = _ref(consortium_org)
-    data_store_org.identifier = [
-        FHIRIdentifier.Identifier({
+    data_store_name = ensure_data_store_name(workspace)
+    data_store_org = {
+        'id': _fhir_id(data_store_name),
+        'identifier': [{
             "system": "https://anvil.terra.bio/#FHIR/data-store",
             "value": data_store_name,
-        })
-    ]
+        }],
+        'partOf': _ref(consortium_org),
+        'resourceType': 'Organization'
+    }
 
-    practitioner = FHIRPractitioner.Practitioner({'id': _fhir_id(workspace.practitioner)})
-    workspace_org = FHIROrganization.Organization({'id': _id('Organization', workspace_name)})
-    workspace_org.partOf = _ref(data_store_org)
-    workspace_org.identifier = [FHIRIdentifier.Identifier({
-        "system": "https://anvil.terra.bio/#workspaces/anvil-datastorage/",
-        "value": f"{workspace_name}",
-    })]
-    practitioner_role = FHIRPractitionerRole.PractitionerRole(
-        {'id': _id('PractitionerRole', workspace_name, workspace.practitioner)}
-    )
-    practitioner_role.practitioner = _ref(practitioner)
-    practitioner_role.organization = _ref(workspace_org)
-    practitioner_role.identifier = [FHIRIdentifier.Identifier({
-        "system": "https://anvil.terra.bio/#workspaces/anvil-datastorage/",
-        "value": f"{workspace_name}",
-    })]
-
-    research_study = FHIRResearchStudy.ResearchStudy({'id': _fhir_id(workspace_name), 'status': 'completed', })
-    research_study.sponsor = _ref(workspace_org)
-    research_study.identifier = [
-        FHIRIdentifier.Identifier({
+    practitioner = {'id': _fhir_id(workspace.practitioner), 'resourceType': 'Practitioner'}
+    workspace_org = {
+        'id': _id('Organization', workspace_name),
+        'identifier': [{
             "system": "https://anvil.terra.bio/#workspaces/anvil-datastorage/",
             "value": f"{workspace_name}",
-        }),
-        FHIRIdentifier.Identifier({
-            "system": "https://anvil.terra.bio/#FHIR/data-store",
-            "value": f"{data_store_name}",
-        }),
-        FHIRIdentifier.Identifier({
-            "system": "https://anvil.terra.bio/#consortium",
-            "value": consortium_name,
-        }),
-    ]
+        }],
+        'partOf': _ref(data_store_org),
+        'resourceType': 'Organization'
+    }
+    practitioner_role = {
+        'id': _id('PractitionerRole', workspace_name, workspace.practitioner),
+        'identifier': [{
+            "system": "https://anvil.terra.bio/#workspaces/anvil-datastorage/",
+            "value": f"{workspace_name}",
+        }],
+        'organization': _ref(workspace_org),
+        'practitioner': _ref(practitioner),
+        'resourceType': 'PractitionerRole'
+    }
+
+    research_study = {
+        'id': _fhir_id(workspace_name),
+        'identifier': [
+            {
+                "system": "https://anvil.terra.bio/#workspaces/anvil-datastorage/",
+                "value": f"{workspace_name}",
+            },
+            {
+                "system": "https://anvil.terra.bio/#FHIR/data-store",
+                "value": f"{data_store_name}",
+            },
+            {
+                "system": "https://anvil.terra.bio/#consortium",
+                "value": consortium_name,
+            },
+        ],
+        'sponsor': _ref(workspace_org),
+        'status': 'completed',
+        'resourceType': 'ResearchStudy'
+    }
 
     return (
         anvil_org,
@@ -174,118 +205,30 @@ def _create_administrative_entities(workspace, consortium_name):
     )
 
 
-def _make_fhir_task_NEW(fhir_patient, task, workspace, workspace_name):
-    """Generate Task, etc. TODO - see if this is faster!"""
-    for output_source, output in task['outputs'].items():
-        for output_property, blob in output.items():
-            _task_id_keys.append(blob['url'])
-    task_id = _id(*_task_id_keys)
-    identifiers = [_identifier(workspace, task)]
-    inputs = []
-    for _input in task['inputs']:
-        assert 'fhir_entity' in _input, 'missing.fhir_entity.in.task'
-        inputs.append(
-            {
-                'type': {'coding': [{'code': 'Reference'}]},
-                'valueReference': {
-                    'reference': f"{_input['fhir_entity']}/{_id(workspace_name, _input['fhir_entity'], _input['name'])}"}
-            }
-        )
-
-    task = {
-      "id": task_id,
-      "identifier": identifiers,
-      "input": inputs,
-      "intent": "unknown",
-      "output": [
-        {
-          "type": {
-            "coding": [
-              {
-                "code": "Reference"
-              }
-            ]
-          },
-          "valueReference": {
-            "reference": "DocumentReference/c07e3b64-f677-5ef7-9bb0-8a2a188592c2"
-          }
-        },
-        {
-          "type": {
-            "coding": [
-              {
-                "code": "Reference"
-              }
-            ]
-          },
-          "valueReference": {
-            "reference": "DocumentReference/f21602c9-f5ad-5863-9fa3-cef957311a5f"
-          }
-        },
-        {
-          "type": {
-            "coding": [
-              {
-                "code": "Reference"
-              }
-            ]
-          },
-          "valueReference": {
-            "reference": "DocumentReference/19162a3a-346a-54de-8587-a4aa5d7b1a5b"
-          }
-        },
-        {
-          "type": {
-            "coding": [
-              {
-                "code": "Reference"
-              }
-            ]
-          },
-          "valueReference": {
-            "reference": "DocumentReference/c07e3b64-f677-5ef7-9bb0-8a2a188592c2"
-          }
-        },
-        {
-          "type": {
-            "coding": [
-              {
-                "code": "Reference"
-              }
-            ]
-          },
-          "valueReference": {
-            "reference": "DocumentReference/f21602c9-f5ad-5863-9fa3-cef957311a5f"
-          }
-        }
-      ],
-      "status": "accepted",
-      "resourceType": "Task"
-    }
-
-
 def _generate_specimen_descendants(workspace, patient, fhir_patient, details):
     """Generate FHIR Specimen, Task and DocumentReference."""
     workspace_name = workspace.workspace.name
 
     if 'specimens' in patient:
         for specimen in patient['specimens']:
-            fhir_specimen = FHIRSpecimen.Specimen({'id': _id(workspace_name, 'Specimen', specimen['name']), 'subject': _ref(fhir_patient).as_json()})
-            fhir_specimen.identifier = [_identifier(workspace, specimen)]
+            fhir_specimen = {'id': _id(workspace_name, 'Specimen', specimen['name'])}
             if 'body_site' in specimen and specimen['body_site']:
                 system, code = lookup_body_site(specimen['body_site'])
-                fhir_specimen.collection = FHIRSpecimen.SpecimenCollection({
+                fhir_specimen['collection'] = {
                     'bodySite': {
                         'coding': [
                             {
-                                'system': system,
                                 'code': code,
-                                'display': specimen['body_site']
+                                'display': specimen['body_site'],
+                                'system': system
                             }
                         ],
                         'text': specimen['body_site']
                     }
-                })
+                }
+            fhir_specimen['identifier'] = [_identifier(workspace, specimen)]
+            fhir_specimen['subject'] = _ref(fhir_patient)
+            fhir_specimen['resourceType'] = 'Specimen'
             yield fhir_specimen
             if details:
                 yield _terra_observation(workspace, specimen, fhir_specimen)
@@ -306,44 +249,49 @@ def _make_fhir_task(fhir_patient, fhir_specimen, task, workspace, workspace_name
             _task_id_keys.append(blob['url'])
     task_id = _id(*_task_id_keys)
 
-    fhir_task = FHIRTask.Task({'id': task_id, 'input': [], 'output': [], 'status': 'accepted', 'intent': 'unknown',
-                               'for': _ref(fhir_patient).as_json(), 'focus': _ref(fhir_specimen).as_json()})
-
-    fhir_task.identifier = [_identifier(workspace, task)]
+    task_inputs = []
     for input in task['inputs']:
         assert 'fhir_entity' in input, 'missing.fhir_entity.in.task'
-        fhir_task.input.append(FHIRTask.TaskInput(
+        task_inputs.append(
             {
                 'type': {'coding': [{'code': 'Reference'}]},
                 'valueReference': {
                     'reference': f"{input['fhir_entity']}/{_id(workspace_name, input['fhir_entity'], input['name'])}"}
             }
-        ))
+        )
+    task_outputs = []
     seen_already = set()
     for output_source, output in task['outputs'].items():
         for output_property, blob in output.items():
             assert 'url' in blob, ('missing.url.in.blob', output_source, output_property)
-            document_reference = FHIRDocumentReference.DocumentReference(
-                {
-                    'id': _id(blob['url']),
-                    'status': 'current',
-                    'content': [{'attachment': {'url': blob['url']}}],
-                    'subject': _ref(fhir_patient).as_json()
-                }
-            )
-            document_reference.identifier = [
-                _document_reference_identifier(workspace, output_source, output_property, task['inputs'][0])]
-
-            # FHIRDocumentReference.DocumentReferenceContent({'attachment': {'url': blob['url']} })
-            fhir_task.output.append(
-                FHIRTask.TaskOutput(
-                    {'type': {'coding': [{'code': 'Reference'}]}, 'valueReference': _ref(document_reference).as_json()}
-                )
-            )
+            document_reference = {
+                'id': _id(blob['url']),
+                'content': [{'attachment': {'url': blob['url']}}],
+                'identifier': [_document_reference_identifier(workspace, output_source, output_property, task['inputs'][0])],
+                'status': 'current',
+                'subject': _ref(fhir_patient),
+                'resourceType': 'DocumentReference'
+            }
+            task_outputs.append({'type': {'coding': [{'code': 'Reference'}]}, 'valueReference': _ref(document_reference)})
             # multiple tasks can refer to same document, so de-duplicate
-            if document_reference.id not in seen_already:
+            if document_reference['id'] not in seen_already:
                 yield document_reference
-            seen_already.add(document_reference.id)
+            seen_already.add(document_reference['id'])
+
+    fhir_task = {
+        'id': task_id,
+        'focus': _ref(fhir_specimen),
+        'for': _ref(fhir_patient),
+        'identifier': [_identifier(workspace, task)],
+    }
+    # empty lists are omitted, as by fhirclient
+    if task_inputs:
+        fhir_task['input'] = task_inputs
+    fhir_task['intent'] = 'unknown'
+    if task_outputs:
+        fhir_task['output'] = task_outputs
+    fhir_task['status'] = 'accepted'
+    fhir_task['resourceType'] = 'Task'
     yield fhir_task
     return fhir_task
 
@@ -352,36 +300,28 @@ def _create_individual(workspace, patient, workspace_org, research_study):
     """Create FHIR resources from Patient, ResearchSubject."""
     workspace_name = workspace.workspace.name
 
-    fhir_patient = FHIRPatient.Patient(
-        {
-            'id': _id(workspace_name, 'Patient', patient['name']),
-            'managingOrganization': _ref(workspace_org).as_json()
-        }
-    )
-    if 'gender' in patient:
-        fhir_patient.gender = patient['gender']
-
+    fhir_patient = {'id': _id(workspace_name, 'Patient', patient['name'])}
     if 'age' in patient and patient['age']:
-        fhir_patient.extension = [
-            FHIRExtension.Extension(
-                {
-                    'valueInteger': int(patient['age']),
-                    'url': 'https://emerge.hgsc.bcm.edu/fhir/StructureDefinition/patient-age'
-                 }
-            )
+        fhir_patient['extension'] = [
+            {
+                'url': 'https://emerge.hgsc.bcm.edu/fhir/StructureDefinition/patient-age',
+                'valueInteger': int(patient['age'])
+            }
         ]
-
-    fhir_patient.identifier = [_identifier(workspace, patient)]
-
-    research_subject = FHIRResearchSubject.ResearchSubject(
-        {
-            'id': _id(workspace_name, 'ResearchSubject', patient['name']),
-            'status': 'on-study',
-            'individual': _ref(fhir_patient).as_json(),
-            'study': _ref(research_study).as_json()
-        }
-    )
-    research_subject.identifier = [_identifier(workspace, patient)]
+    if patient.get('gender', None) is not None:
+        fhir_patient['gender'] = patient['gender']
+    fhir_patient['identifier'] = [_identifier(workspace, patient)]
+    fhir_patient['managingOrganization'] = _ref(workspace_org)
+    fhir_patient['resourceType'] = 'Patient'
+
+    research_subject = {
+        'id': _id(workspace_name, 'ResearchSubject', patient['name']),
+        'identifier': [_identifier(workspace, patient)],
+        'individual': _ref(fhir_patient),
+        'status': 'on-study',
+        'study': _ref(research_study),
+        'resourceType': 'ResearchSubject'
+    }
     return fhir_patient, research_subject
 
 
@@ -392,11 +332,13 @@ def _disease_coding(disease):
     text = ontology_text.get(curie)
     prefix, code = curie.split(':')
     system = disease_system.get(prefix)
-    return {
+    # the model builders appended this component as a plain dict, written as is, not in as_json() order
+    coding = {
         "system": system,
         "code": code,
         "display": text
     }
+    return {k: v for k, v in coding.items() if v is not None}
 
 
 def _research_study_observation(workspace, research_study):
@@ -447,56 +389,49 @@ def _research_study_observation(workspace, research_study):
     else:
         logger.error(('workspace.tracker.missing', workspace_name))
 
-    observation = FHIRObservation.Observation(
+    components = [
         {
-            'id': _id(workspace_name, 'Observation', research_study.id),
-            "status": "final",
-            'code': {'coding': [{'code': 'Summary', "display": "Variable Summary", "system": CANONICAL}]},
-            'focus': [_ref(research_study).as_json()],
-            'component': [
-                {
-                    'code': {'coding': [{'code': 'SampleCount', 'display': 'Number of Samples', "system": CANONICAL}]},
-                    'valueInteger': sample_count
-                },
-                {
-                    'code': {'coding': [{'code': 'Participant', 'display': 'Number of Participants', "system": CANONICAL}]},
-                    'valueInteger': patient_count
-                },
-                {
-                    'code': {'coding': [{'code': 'StorageSize', 'display': 'Size on Disk', "system": CANONICAL}]},
-                    "valueQuantity": {
-                        "value": blob_size_sum,
-                        "system": "http://unitsofmeasure.org",
-                        "code": "L"
-                    }
-                },
-                {
-                    'code': {'coding': [{'code': 'TerraWorkspace', 'display': 'Terra Workspace Name', "system": CANONICAL}]},
-                    "valueString": workspace_name
-                },
-                {
-                    'code': {'coding': [{'code': 'PrimaryDisease', 'display': 'Primary Disease', "system": CANONICAL}]},
-                    "valueString": primary_disease
-                },
-                {
-                    'code': {'coding': [{'code': 'StudyDesign', 'display': 'Study Design', "system": CANONICAL}]},
-                    "valueString": study_design
-                },
-                {
-                    'code': {'coding': [{'code': 'DataType', 'display': 'Data Type', "system": CANONICAL}]},
-                    "valueString": data_type
-                },
-                {
-                    'code': {'coding': [{'code': 'ConsentCodes', 'display': 'Consent Codes', "system": CANONICAL}]},
-                    "valueString": consent_codes
-                },
-
-            ]
-        }
-    )
+            'code': {'coding': [{'code': 'SampleCount', 'display': 'Number of Samples', "system": CANONICAL}]},
+            'valueInteger': sample_count
+        },
+        {
+            'code': {'coding': [{'code': 'Participant', 'display': 'Number of Participants', "system": CANONICAL}]},
+            'valueInteger': patient_count
+        },
+        {
+            'code': {'coding': [{'code': 'StorageSize', 'display': 'Size on Disk', "system": CANONICAL}]},
+            "valueQuantity": {
+                "code": "L",
+                "system": "http://unitsofmeasure.org",
+                "value": blob_size_sum
+            }
+        },
+        {
+            'code': {'coding': [{'code': 'TerraWorkspace', 'display': 'Terra Workspace Name', "system": CANONICAL}]},
+            "valueString": workspace_name
+        },
+        {
+            'code': {'coding': [{'code': 'PrimaryDisease', 'display': 'Primary Disease', "system": CANONICAL}]},
+            "valueString": primary_disease
+        },
+        {
+            'code': {'coding': [{'code': 'StudyDesign', 'display': 'Study Design', "system": CANONICAL}]},
+            "valueString": study_design
+        },
+        {
+            'code': {'coding': [{'code': 'DataType', 'display': 'Data Type', "system": CANONICAL}]},
+            "valueString": data_type
+        },
+        {
+            'code': {'coding': [{'code': 'ConsentCodes', 'display': 'Consent Codes', "system": CANONICAL}]},
+            "valueString": consent_codes
+        },
+    ]
+    # tracker values may be missing, omitted as by fhirclient
+    components = [{k: v for k, v in component.items() if v is not None} for component in components]
 
     if primary_disease and primary_disease != "NA":
-        observation.component.append(
+        components.append(
             {
                 'code': {'coding': [{'code': 'PrimaryDiseaseOntology', 'display': 'Primary Disease Ontology', "system": CANONICAL}]},
                 "valueCodeableConcept": {
@@ -508,7 +443,14 @@ def _research_study_observation(workspace, research_study):
             }
         )
 
-    return observation
+    return {
+        'id': _id(workspace_name, 'Observation', research_study['id']),
+        'code': {'coding': [{'code': 'Summary', "display": "Variable Summary", "system": CANONICAL}]},
+        'component': components,
+        'focus': [_ref(research_study)],
+        "status": "final",
+        'resourceType': 'Observation'
+    }
 
 
 def _terra_observation(workspace, entity, fhir_resource):
@@ -522,31 +464,28 @@ def _terra_observation(workspace, entity, fhir_resource):
             return json.dumps(val)
         return str(val)
 
-    observation = FHIRObservation.Observation(
-        {
-            'id': _id(workspace_name, 'Observation', fhir_resource.id),
-            "status": "final",
-            'code': {'coding': [{'code': 'Detail', "display": f"{entity['entityType']} Detail", "system": "https://anvil.terra.bio/#workspaces/anvil-datastorage/"}]},
-            'focus': [_ref(fhir_resource).as_json()],
-            'component': [
-                {
-                    'code': {'coding': [{'code': 'Keys', "system": f"https://anvil.terra.bio/#workspaces/anvil-datastorage/{workspace_name}/{entity['entityType']}"}]},
-                    'valueString': ','.join([key for key in entity['attributes']])
-                },
-                {
-                    'code': {'coding': [{'code': 'Values', "system": f"https://anvil.terra.bio/#workspaces/anvil-datastorage/{workspace_name}/{entity['entityType']}/{entity['name']}"}]},
-                    'valueString': ','.join([_str(val) for val in entity['attributes'].values()])
-                },
-            ]
-        }
-    )
-
-    return observation
+    return {
+        'id': _id(workspace_name, 'Observation', fhir_resource['id']),
+        'code': {'coding': [{'code': 'Detail', "display": f"{entity['entityType']} Detail", "system": "https://anvil.terra.bio/#workspaces/anvil-datastorage/"}]},
+        'component': [
+            {
+                'code': {'coding': [{'code': 'Keys', "system": f"https://anvil.terra.bio/#workspaces/anvil-datastorage/{workspace_name}/{entity['entityType']}"}]},
+                'valueString': ','.join([key for key in entity['attributes']])
+            },
+            {
+                'code': {'coding': [{'code': 'Values', "system": f"https://anvil.terra.bio/#workspaces/anvil-datastorage/{workspace_name}/{entity['entityType']}/{entity['name']}"}]},
+                'valueString': ','.join([_str(val) for val in entity['attributes'].values()])
+            },
+        ],
+        'focus': [_ref(fhir_resource)],
+        "status": "final",
+        'resourceType': 'Observation'
+    }
 
 
 def _patient_reference(id):
     """Create a family member reference."""
-    return FHIRReference.FHIRReference({'reference': f"Patient/{id}"})
+    return {'reference': f"Patient/{id}"}
 
 
 def _generate_family_relationship_observations(workspace, family_id, family, config):
@@ -618,26 +557,25 @@ def _generate_family_relationship_observations(workspace, family_id, family, con
                             "https://ncpi-fhir.github.io/ncpi-fhir-ig/StructureDefinition/family-relationship"
                         ]
                     },
+                    'code': {'coding': [{'code': 'FAMMEMB', "display": "family member", "system": "http://terminology.hl7.org/CodeSystem/v3-RoleCode"}]},
+                    'focus': [_patient_reference(focus['id'])],  # the proband
                     'identifier': [
-                        _family_identifier(workspace, family_id).as_json(),
-                        _patient_identifier(workspace, subject['name'], 'subject').as_json(),
-                        _patient_identifier(workspace, focus['name'], 'focus').as_json()
+                        _family_identifier(workspace, family_id),
+                        _patient_identifier(workspace, subject['name'], 'subject'),
+                        _patient_identifier(workspace, focus['name'], 'focus')
                     ],
                     "status": "final",
-                    'code': {'coding': [{'code': 'FAMMEMB', "display": "family member", "system": "http://terminology.hl7.org/CodeSystem/v3-RoleCode"}]},
-                    'subject': _patient_reference(subject['id']).as_json(),  # this patient
-                    'focus': [_patient_reference(focus['id']).as_json()],  # the proband
+                    'subject': _patient_reference(subject['id']),  # this patient
                     "valueCodeableConcept": {
                         "coding": [
                             {
-                                "system": "http://terminology.hl7.org/CodeSystem/v3-RoleCode",
-                                "code": relationship
+                                "code": relationship,
+                                "system": "http://terminology.hl7.org/CodeSystem/v3-RoleCode"
                             }
                         ]
-                    }
+                    },
+                    'resourceType': 'Observation'
                 }
-
-                observation = FHIRObservation.Observation(observation)
                 yield observation        
         # if no relationships
         yield from []
@@ -783,26 +721,25 @@ def _generate_family_relationship_observations(workspace, family_id, family, con
                             "https://ncpi-fhir.github.io/ncpi-fhir-ig/StructureDefinition/family-relationship"
                         ]
                     },
+                    'code': {'coding': [{'code': 'FAMMEMB', "display": "family member", "system": "http://terminology.hl7.org/CodeSystem/v3-RoleCode"}]},
+                    'focus': [_patient_reference(mapped_family['ONESELF'][0]['id'])],  # the proband
                     'identifier': [
-                        _family_identifier(workspace, family_id).as_json(),
-                        _patient_identifier(workspace, detail['name'], 'subject').as_json(),
-                        _patient_identifier(workspace, mapped_family['ONESELF'][0]['name'], 'focus').as_json()
+                        _family_identifier(workspace, family_id),
+                        _patient_identifier(workspace, detail['name'], 'subject'),
+                        _patient_identifier(workspace, mapped_family['ONESELF'][0]['name'], 'focus')
                     ],
                     "status": "final",
-                    'code': {'coding': [{'code': 'FAMMEMB', "display": "family member", "system": "http://terminology.hl7.org/CodeSystem/v3-RoleCode"}]},
-                    'subject': _patient_reference(detail['id']).as_json(),  # this patient
-                    'focus': [_patient_reference(mapped_family['ONESELF'][0]['id']).as_json()],  # the proband
+                    'subject': _patient_reference(detail['id']),  # this patient
                     "valueCodeableConcept": {
                         "coding": [
                             {
-                                "system": "http://terminology.hl7.org/CodeSystem/v3-RoleCode",
-                                "code": relationship
+                                "code": relationship,
+                                "system": "http://terminology.hl7.org/CodeSystem/v3-RoleCode"
                             }
                         ]
-                    }
+                    },
+                    'resourceType': 'Observation'
                 }
-
-                observation = FHIRObservation.Observation(observation)
                 yield observation
 
     def _dispatcher():
@@ -838,7 +775,7 @@ def _discover_families(workspace, patient, fhir_patient, families):
         if relationship not in families[family_relationship['family_id']]:
             families[family_relationship['family_id']][relationship] = []
 
-        family_member = {'id': fhir_patient.id, 'name': patient['name'], 'entityType': patient['entityType']}
+        family_member = {'id': fhir_patient['id'], 'name': patient['name'], 'entityType': patient['entityType']}
         extra_fields = {k: v for k, v in family_relationship.items() if k not in ['family_id', 'family_relationship']}
         family_member.update(extra_fields)
         families[family_relationship['family_id']][relationship].append(family_member)
@@ -890,60 +827,83 @@ def generate_fhir(workspace, consortium_name, details, config):
                 yield family_relationship
 
 
-def write(consortium_name, workspace, output_path, details, config):
-    """Write normalized workspace to disk as FHIR."""
-    emitters = {}
+def workspace_dir_path(output_path, consortium_name, workspace):
+    """Directory FHIR resources for workspace are written to."""
+    return f"{output_path}/fhir/{ensure_data_store_name(workspace)}/{consortium_name}/{workspace.workspace.name}"
+
+
+def staging_dir_path(output_path, consortium_name, workspace):
+    """Directory FHIR resources are written to before they replace workspace_dir_path, outside fhir/ so never uploaded."""
+    return f"{output_path}/staging/{os.path.relpath(workspace_dir_path(output_path, consortium_name, workspace), output_path)}"
+
+
+def write(consortium_name, workspace, output_path, details, config, strict=False, compress=None, compress_level=DEFAULT_COMPRESS_LEVEL):
+    """Write normalized workspace to disk as FHIR.
+
+    Files are staged and replace the workspace's previous files once all resources are written.
+
+    Args:
+        strict: validate every resource with fhirclient, slower, same output
+        compress: None or 'gzip', write <resource>.ndjson.gz
+        compress_level: 1 (fastest) to 9 (smallest)
+
+    Returns:
+        dict: {resource_type: count} of resources written
+
+    """
+    counts = defaultdict(int)
+    dir_path = workspace_dir_path(output_path, consortium_name, workspace)
     # import cProfile, pstats
     # profiler = cProfile.Profile()
     # profiler.enable()
-    for fhir_resource in generate_fhir(workspace, consortium_name, details, config):
-        resource_type = fhir_resource.resource_type
-        data_store_name = ensure_data_store_name(workspace)
-        dir_path = f"{output_path}/fhir/{data_store_name}/{consortium_name}/{workspace.workspace.name}"
-        public_protected = 'protected'
-        if resource_type in ['ResearchStudy', 'Organization', 'Practitioner', 'PractitionerRole']:
-            public_protected = 'public'
-        file_path = None
-
-        resource_reference = None
-        if hasattr(fhir_resource, 'focus') and fhir_resource.focus:
-            if isinstance(fhir_resource.focus, list):
-                resource_reference = [foci.reference for foci in fhir_resource.focus]
-            else:
-                resource_reference = [fhir_resource.focus.reference]
-            if len(resource_reference) == 0:
-                resource_reference = None
-            else:
-                resource_reference = resource_reference[0].split('/')[0]
-            assert resource_reference
-
-        resource_code = None
-        if hasattr(fhir_resource, 'code') and fhir_resource.code:
-            resource_code = [coding.code for coding in fhir_resource.code.coding]
-            if len(resource_code) == 0:
-                resource_code = None
-            else:
-                resource_code = resource_code[0]
-
-        if resource_type == 'Observation':
-            if resource_code == 'Summary':
-                file_path = f"{dir_path}/public/{resource_reference}Observation{resource_code}.ndjson"
-            else:
-                file_path = f"{dir_path}/protected/{resource_reference}Observation{resource_code}.ndjson"
-
-        if not file_path:
-            file_path = f"{dir_path}/{public_protected}/{fhir_resource.relativeBase()}.ndjson"
-
-        emitter = emitters.get(file_path, None)
-        if emitter is None:
-            os.makedirs(f"{dir_path}/public", exist_ok=True)
-            os.makedirs(f"{dir_path}/protected", exist_ok=True)
-            emitter = open(file_path, "w")
-            logger.info(f"Writing {file_path}")
-            emitters[file_path] = emitter
-        json.dump(fhir_resource.as_json(), emitter, separators=(',', ':'))
-        emitter.write('\n')
+    staging_path = staging_dir_path(output_path, consortium_name, workspace)
+    with NDJSONWriter(dir_path, staging_path, compress=compress, compress_level=compress_level) as writer:
+        for fhir_resource in generate_fhir(workspace, consortium_name, details, config):
+            if strict:
+                # written as built, as_json() would reorder the PrimaryDiseaseOntology coding
+                validate(fhir_resource)
+            resource_type = fhir_resource['resourceType']
+            public_protected = 'protected'
+            if resource_type in ['ResearchStudy', 'Organization', 'Practitioner', 'PractitionerRole']:
+                public_protected = 'public'
+            file_path = None
+
+            resource_reference = None
+            focus = fhir_resource.get('focus', None)
+            if focus:
+                if isinstance(focus, list):
+                    resource_reference = [foci['reference'] for foci in focus]
+                else:
+                    resource_reference = [focus['reference']]
+                if len(resource_reference) == 0:
+                    resource_reference = None
+                else:
+                    resource_reference = resource_reference[0].split('/')[0]
+                assert resource_reference
+
+            resource_code = None
+            if resource_type == 'Observation':
+                resource_code = [coding['code'] for coding in fhir_resource['code']['coding']]
+                if len(resource_code) == 0:
+                    resource_code = None
+                else:
+                    resource_code = resource_code[0]
+
+            if resource_type == 'Observation':
+                if resource_code == 'Summary':
+                    file_path = f"public/{resource_reference}Observation{resource_code}.ndjson"
+                else:
+                    file_path = f"protected/{resource_reference}Observation{resource_code}.ndjson"
+
+            if not file_path:
+                file_path = f"{public_protected}/{resource_type}.ndjson"
+
+            writer.write(file_path, fhir_resource)
+            counts[resource_type] += 1
+    for file_path, count in sorted(writer.counts.items()):
+        logger.info(f"Wrote {count} resources to {dir_path}/{file_path}")
     # profiler.disable()
     # # Export profiler output to file
     # stats = pstats.Stats(profiler)
     # stats.dump_stats(f'{output_path}/program.prof')
+    return dict(counts)
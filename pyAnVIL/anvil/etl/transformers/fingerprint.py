@@ -0,0 +1,133 @@
+"""Fingerprint a workspace's inputs, so unchanged workspaces are not normalized or written again."""
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+from anvil.etl.utilities.entities import Entities
+from ..extractors.gen3 import DRSReader
+
+logger = logging.getLogger(__name__)
+
+# bump when a change to the normalizer, or to the fhir writer, changes what it writes, records of older code are stale
+NORMALIZER_VERSION = 1
+FHIR_WRITER_VERSION = 1
+# code versions recorded and checked for each step, fhir output is written from normalized workspaces
+CODE_VERSIONS = {
+    'normalize': {'normalizer_version': NORMALIZER_VERSION},
+    'fhir': {'normalizer_version': NORMALIZER_VERSION, 'fhir_writer_version': FHIR_WRITER_VERSION},
+}
+
+
+def _update(digest, *values):
+    for value in values:
+        if not isinstance(value, str):
+            value = json.dumps(value, sort_keys=True, separators=(',', ':'), default=str)
+        digest.update(value.encode('utf-8'))
+        digest.update(b'\0')
+
+
+def load_tracker_row(output_path, workspace_name):
+    """Return the data_ingestion_tracker entry for workspace_name, or None."""
+    with open(f"{output_path}/data_ingestion_tracker.json") as input_stream:
+        return next(iter([p for p in json.load(input_stream) if p['name'] == workspace_name]), None)
+
+
+def workspace_fingerprint(output_path, consortium_name, workspace_name, validate_buckets, config, urls=(), fingerprints=None):
+    """Hash everything normalization reads for a workspace.
+
+    Covers the workspace and its child vertices, its tracker row, its consortium config,
+    and the blob and DRS rows of `urls`, the task outputs recorded by the previous run.
+    Terra vertices determine those urls, so if the vertices are unchanged the recorded urls are current.
+
+    Args:
+        fingerprints: optional dict shared by the freshness checks and records of one workspace run,
+            each fingerprint is computed once per validate_buckets and set of urls
+
+    """
+    if fingerprints is not None:
+        key = (validate_buckets, tuple(sorted(urls)))
+        if key not in fingerprints:
+            fingerprints[key] = workspace_fingerprint(output_path, consortium_name, workspace_name, validate_buckets, config, urls=urls)
+        return fingerprints[key]
+    digest = hashlib.sha256()
+    _update(digest, consortium_name, workspace_name, validate_buckets)
+    entities = Entities(path=f"{output_path}/terra_entities.sqlite")
+    for key, _json in entities.iter_edge_json(workspace_name, 'workspace'):
+        _update(digest, key, _json or 'null')
+    _update(digest, load_tracker_row(output_path, workspace_name))
+    _update(digest, config['consortiums'].get(consortium_name, None))
+
+    urls = sorted(urls)
+    if validate_buckets:
+        blobs = Entities(path=f"{output_path}/google_entities.sqlite").get_blobs(urls)
+        for url in urls:
+            _update(digest, blobs[url])
+    drs_files = DRSReader(output_path).get_many(url.split('/')[-1] for url in urls)
+    for url in urls:
+        _update(digest, drs_files[url.split('/')[-1]])
+    return digest.hexdigest()
+
+
+def workspace_urls(workspace):
+    """Return the urls of all task outputs in a normalized workspace."""
+    return sorted({
+        blob['url'] if isinstance(blob, dict) else blob
+        for task_list in workspace.get('tasks', {}).values()
+        for task in task_list
+        for output in task['outputs'].values()
+        for blob in output.values()
+    })
+
+
+def _record_path(output_path, consortium_name, workspace_name, step):
+    return f"{output_path}/workspaces/{consortium_name}/{workspace_name}.{step}.json"
+
+
+def read_record(output_path, consortium_name, workspace_name, step):
+    """Return the record written by the last successful `step` ('normalize' or 'fhir'), or None."""
+    path = _record_path(output_path, consortium_name, workspace_name, step)
+    if not os.path.exists(path):
+        return None
+    with open(path) as input_stream:
+        return json.load(input_stream)
+
+
+def write_record(output_path, consortium_name, workspace_name, step, record):
+    """Save record for `step`, must include 'fingerprint' and the 'urls' it was computed with, adds the step's CODE_VERSIONS."""
+    assert 'fingerprint' in record and 'urls' in record, record.keys()
+    record = dict(record, **CODE_VERSIONS[step])
+    Path(f"{output_path}/workspaces/{consortium_name}").mkdir(parents=True, exist_ok=True)
+    path = _record_path(output_path, consortium_name, workspace_name, step)
+    with open(f"{path}.tmp", 'w') as output_stream:
+        json.dump(record, output_stream)
+    os.replace(f"{path}.tmp", path)
+
+
+def remove_record(output_path, consortium_name, workspace_name, step):
+    """Forget `step` for workspace, e.g. before rewriting its outputs."""
+    path = _record_path(output_path, consortium_name, workspace_name, step)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def is_fresh(output_path, consortium_name, workspace_name, validate_buckets, config, step, fingerprints=None, accept_validated=False, **options):
+    """Return the record of `step` if it last ran with the same options and code on the same inputs, i.e. can be skipped, else None.
+
+    fingerprints: see workspace_fingerprint
+    accept_validated: a record written with validate_buckets, a superset, also satisfies a check without
+    """
+    record = read_record(output_path, consortium_name, workspace_name, step)
+    if not record:
+        return None
+    options = dict(CODE_VERSIONS[step], **options)
+    if any(record.get(k, None) != v for k, v in options.items()):
+        return None
+    if accept_validated and record.get('validate_buckets', False):
+        validate_buckets = True
+    fingerprint = workspace_fingerprint(output_path, consortium_name, workspace_name, validate_buckets, config, urls=record['urls'], fingerprints=fingerprints)
+    if record['fingerprint'] != fingerprint:
+        return None
+    return record
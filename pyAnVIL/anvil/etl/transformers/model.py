@@ -0,0 +1,102 @@
+"""Normalized workspace model."""
+
+from anvil.etl.utilities.node import Node
+
+
+class Workspace:
+    """A terra workspace and the entities normalization derives from it.
+
+    Fields are slots, unset until a normalizer command sets them. Patients, specimens, tasks and blobs are plain dicts.
+    Read only mapping access (`workspace['tasks']`, `'tracker' in workspace`, keys(), items() ...) is kept for
+    code written against AttrDict; vertex keys that are not fields, e.g. accessLevel, are kept in `extra`.
+    """
+
+    FIELDS = ('workspace', 'consortium_name', 'children', 'practitioner', 'specimens', 'specimen_patient_ids',
+              'total_patient_count', 'tasks', 'patients', 'tracker', 'errors')
+
+    __slots__ = FIELDS + ('extra',)
+
+    def __init__(self, data=None):
+        """Set fields from a workspace vertex or a mapping written by a previous run."""
+        object.__setattr__(self, 'extra', {})
+        for key, value in (data or {}).items():
+            self[key] = value
+
+    def __setattr__(self, key, value):
+        """Set a field, or an extra key if key is not a field."""
+        if key == 'workspace' and type(value) is dict:
+            value = Node(value)
+        if key in Workspace.FIELDS:
+            object.__setattr__(self, key, value)
+        else:
+            self.extra[key] = value
+
+    def __getattr__(self, key):
+        """Return an extra key, only called for unset fields and unknown names."""
+        try:
+            return object.__getattribute__(self, 'extra')[key]
+        except KeyError:
+            raise AttributeError(key) from None
+
+    def __setitem__(self, key, value):
+        """Set an attribute."""
+        setattr(self, key, value)
+
+    def __getitem__(self, key):
+        """Return an attribute, raise KeyError if unset."""
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __delitem__(self, key):
+        """Unset a field or remove an extra key."""
+        if key in Workspace.FIELDS:
+            try:
+                object.__delattr__(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        else:
+            del self.extra[key]
+
+    def __contains__(self, key):
+        """Return True if key is a set field or an extra key."""
+        if key in Workspace.FIELDS:
+            try:
+                object.__getattribute__(self, key)
+                return True
+            except AttributeError:
+                return False
+        return key in self.extra
+
+    def get(self, key, default=None):
+        """Return self[key] if set, else default."""
+        return self[key] if key in self else default
+
+    def keys(self):
+        """Return set fields, then extra keys."""
+        return [key for key in Workspace.FIELDS if key in self] + list(self.extra)
+
+    def __iter__(self):
+        """Iterate over keys()."""
+        return iter(self.keys())
+
+    def __len__(self):
+        """Return the number of keys()."""
+        return len(self.keys())
+
+    def items(self):
+        """Return [(key, value)] of keys()."""
+        return [(key, self[key]) for key in self.keys()]
+
+    def values(self):
+        """Return values of keys()."""
+        return [self[key] for key in self.keys()]
+
+    def __reduce__(self):
+        """Pickle as the mapping of items()."""
+        return Workspace, (dict(self.items()),)
+
+    def __repr__(self):
+        """Return Workspace(<items as a dict>)."""
+        return f"Workspace({dict(self.items())!r})"
@@ -3,12 +3,14 @@
 """Read metadata from terra workspaces."""
 
 import json
+import os
 import os.path
 
 from anvil.etl.transformers import _recursive_default_dict
+from anvil.etl.utilities import serializer
 from anvil.etl.utilities.entities import Entities
+from anvil.etl.utilities.node import Node
 from pathlib import Path
-import pickle
 
 # from . import LogCapture
 # import logging
@@ -19,6 +21,9 @@ from . import logger
 
 from anvil.etl.transformers.normalizer_methods import *
 from .fhir_writer import ensure_data_store_name
+from .model import Workspace
+from .workspace_store import FORMAT_VERSION, read_workspace_store, write_workspace_store
+from .fingerprint import is_fresh, remove_record, workspace_fingerprint, workspace_urls, write_record
 
 
 def _extract_ontology_fields(output_path=None, entities=None, workspace_name=None):
@@ -26,11 +31,9 @@ def _extract_ontology_fields(output_path=None, entities=None, workspace_name=Non
     if not entities:
         assert output_path
         entities = Entities(path=f"{output_path}/terra_entities.sqlite")
-    for workspace in entities.get_by_label('workspace'):
-        workspace = AttrDict(workspace)
-        if workspace_name and workspace.workspace.name != workspace_name:
-            continue
-        schema = AttrDict(entities.get_edges_by_label(src=workspace.workspace.name, src_name='workspace', dst_name='schema'))
+    for workspace in entities.get_workspaces(workspace_name=workspace_name):
+        workspace = Node(workspace)
+        schema = Node(entities.get_edges_by_label(src=workspace.workspace.name, src_name='workspace', dst_name='schema'))
         for entity_name in schema.schema.keys():
             if entity_name == 'schema':
                 continue
@@ -68,7 +71,8 @@ def _normalize_workspace(consortium_name, workspace, config, entities, output_pa
         return None
 
     # pass context to commands
-    context = AttrDict({'logged_already': [], 'output_path': output_path, 'entities': entities})
+    context = Node({'logged_already': [], 'output_path': output_path, 'entities': entities,
+                    'plan': command_plan(consortium_name, workspace.workspace.name)})
 
     # find config
     exec_command(context, consortium_name, workspace, config, 'consortium_config')
@@ -144,25 +148,48 @@ def ontologies(output_path, consortium_name, workspace_name, details):
                _extract_ontology_fields(output_path=output_path, workspace_name=_workspace_name)]
 
 
-def get_pickled_workspace(output_path, consortium_name, workspace_name):
-    """Unpickle the normalized workspace."""
-    path = f"{output_path}/workspaces/{consortium_name}/{workspace_name}.pickle"
-    if not os.path.exists(path):
-        return None
+def _workspace_store_path(output_path, consortium_name, workspace_name):
+    return f"{output_path}/workspaces/{consortium_name}/{workspace_name}.sqlite"
+
+
+def get_normalized_workspace(output_path, consortium_name, workspace_name):
+    """Open the normalized workspace, sections are loaded when first accessed."""
+    path = _workspace_store_path(output_path, consortium_name, workspace_name)
     try:
-        with open(path, 'rb') as input_stream:
-            return pickle.load(input_stream)
+        return read_workspace_store(path)
     except Exception as e:
-        logger.warning(("no.pickle", workspace_name, str(e)))
+        logger.warning(("no.normalized.workspace", workspace_name, str(e)))
+
+
+def write_workspace(output_path, consortium_name, workspace_name, validate_buckets, config, force=False):
+    """Read workspaces from db, normalize and write to file system.
 
+    Skipped if the workspace's inputs are unchanged since it was last written, unless force.
 
-def write_workspace(output_path, consortium_name, workspace_name, validate_buckets, config):
-    """Read workspaces from db, normalize and write to file system."""
+    Returns:
+        bool: True if written, False if skipped
 
-    for consortium_name, workspace in normalize(output_path, consortium_name, workspace_name, validate_buckets, config=config):
+    """
+    # fingerprint inputs once
+    fingerprints = {}
+    if not force and os.path.exists(_workspace_store_path(output_path, consortium_name, workspace_name)) and \
+            is_fresh(output_path, consortium_name, workspace_name, validate_buckets, config, 'normalize', fingerprints=fingerprints, format_version=FORMAT_VERSION):
+        logger.info(('normalize.unchanged', consortium_name, workspace_name))
+        return False
+    remove_record(output_path, consortium_name, workspace_name, 'normalize')
+    for consortium_name, workspace in normalize(output_path, consortium_name, workspace_name, validate_buckets, config=config, use_store=False):
         Path(f"{output_path}/workspaces/{consortium_name}").mkdir(parents=True, exist_ok=True)
-        with open(f"{output_path}/workspaces/{consortium_name}/{workspace.workspace.name}.pickle", 'wb') as output_stream:
-            pickle.dump(workspace, output_stream)
+        write_workspace_store(_workspace_store_path(output_path, consortium_name, workspace.workspace.name), workspace)
+        urls = workspace_urls(workspace)
+        write_record(output_path, consortium_name, workspace.workspace.name, 'normalize', {
+            'fingerprint': workspace_fingerprint(output_path, consortium_name, workspace.workspace.name, validate_buckets, config, urls=urls, fingerprints=fingerprints),
+            'urls': urls,
+            # a store with blob attributes serves reads without, see normalize
+            'validate_buckets': validate_buckets,
+            # stores written in another format are rewritten
+            'format_version': FORMAT_VERSION,
+        })
+    return True
 
 
 def analyze(output_path, consortium_name, workspace_name, details, validate_buckets, config):
@@ -266,6 +293,50 @@ def analyze(output_path, consortium_name, workspace_name, details, validate_buck
     return G
 
 
+def write_analysis_shard(output_path, consortium_name, workspace_name, analysis):
+    """Write one workspace's analysis to <output_path>/analysis/<consortium>/<workspace>.json, atomically."""
+    Path(f"{output_path}/analysis/{consortium_name}").mkdir(parents=True, exist_ok=True)
+    path = f"{output_path}/analysis/{consortium_name}/{workspace_name}.json"
+    with open(f"{path}.tmp", 'w') as output_stream:
+        output_stream.write(serializer.dumps(analysis, ensure_ascii=True))
+    os.replace(f"{path}.tmp", path)
+
+
+def read_analysis(output_path, consortium_name=None, workspace_name=None):
+    """Read workspace analyses from shards, or from analysis.ndjson if there are none."""
+    shards = sorted(Path(f"{output_path}/analysis").glob('*/*.json'))
+    if shards:
+        for shard in shards:
+            if consortium_name and shard.parent.name != consortium_name:
+                continue
+            if workspace_name and shard.stem != workspace_name:
+                continue
+            with open(shard) as input_stream:
+                yield serializer.loads(input_stream.read())
+        return
+    with open(f"{output_path}/analysis.ndjson") as input_stream:
+        for line in input_stream:
+            analysis = serializer.loads(line)
+            if consortium_name and analysis['consortium'] != consortium_name:
+                continue
+            if workspace_name and analysis['workspace'] != workspace_name:
+                continue
+            yield analysis
+
+
+def merge_analysis(output_path):
+    """Rewrite <output_path>/analysis.ndjson from all shards, ordered by consortium and workspace."""
+    path = f"{output_path}/analysis.ndjson"
+    count = 0
+    with open(f"{path}.tmp", 'w') as output_stream:
+        for analysis in read_analysis(output_path):
+            output_stream.write(serializer.dumps(analysis, ensure_ascii=True))
+            output_stream.write('\n')
+            count += 1
+    os.replace(f"{path}.tmp", path)
+    return count
+
+
 def qa(output_path, consortium_name, workspace_name, config):
     """Produce a QA report."""
     pass
@@ -273,29 +344,30 @@ def qa(output_path, consortium_name, workspace_name, config):
 
 def fetch_workspace_names(output_path, requested_consortium_name, workspace_name):
     """Query db and return workspace names."""
-    workspace_names = []
     entities = Entities(path=f"{output_path}/terra_entities.sqlite")
-    for workspace in entities.get_by_label('workspace'):
-        workspace = AttrDict(workspace)
-        # filter consortium_name
-        if requested_consortium_name and requested_consortium_name != workspace.consortium_name:
-            continue
+    return entities.get_catalog(consortium_name=requested_consortium_name, workspace_name=workspace_name)
 
-        # filter workspace_name
-        if workspace_name and workspace.workspace.name != workspace_name:
-            continue
 
-        workspace_names.append((workspace.consortium_name, workspace.workspace.name))
+def fetch_workspace_sizes(output_path):
+    """Query db and return {workspace_name: entity count}."""
+    entities = Entities(path=f"{output_path}/terra_entities.sqlite")
+    return entities.get_edge_counts(src_name='workspace')
 
-    return workspace_names
 
+def normalize(output_path, requested_consortium_name, workspace_name, validate_buckets, config, use_store=True, fingerprints=None):
+    """Read workspaces from db, normalize.
 
-def normalize(output_path, requested_consortium_name, workspace_name, validate_buckets, config):
-    """Read workspaces from db, normalize."""
-    workspace = get_pickled_workspace(output_path, requested_consortium_name, workspace_name)
-    if workspace:
-        yield workspace.consortium_name, workspace
-        return
+    If use_store, a workspace written by write_workspace is returned instead, provided its inputs are unchanged.
+    A store written with validate_buckets also serves reads without it.
+    fingerprints: see workspace_fingerprint
+    """
+    if use_store and requested_consortium_name and workspace_name and \
+            is_fresh(output_path, requested_consortium_name, workspace_name, validate_buckets, config, 'normalize',
+                     fingerprints=fingerprints, accept_validated=True, format_version=FORMAT_VERSION):
+        workspace = get_normalized_workspace(output_path, requested_consortium_name, workspace_name)
+        if workspace:
+            yield workspace.consortium_name, workspace
+            return
 
     config = config['consortiums']
 
@@ -303,16 +375,9 @@ def normalize(output_path, requested_consortium_name, workspace_name, validate_b
 
     tracker = json.load(open(f"{output_path}/data_ingestion_tracker.json"))
 
-    for workspace in entities.get_by_label('workspace'):
-        workspace = AttrDict(workspace)
-        # filter consortium_name
-        if requested_consortium_name and requested_consortium_name != workspace.consortium_name:
-            continue
-
+    for workspace in entities.get_workspaces(consortium_name=requested_consortium_name, workspace_name=workspace_name):
+        workspace = Workspace(workspace)
         consortium_name = workspace.consortium_name
-        # filter workspace_name
-        if workspace_name and workspace.workspace.name != workspace_name:
-            continue
 
         logger.info((consortium_name, workspace.workspace.name))
 
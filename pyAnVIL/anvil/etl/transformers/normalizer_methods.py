@@ -1,12 +1,13 @@
 # set up a command library
 import logging
+import time
 from collections import defaultdict
 from urllib.parse import urlparse
 
-from attrdict import AttrDict
 
 from anvil.etl.transformers import LogCapture
 from anvil.etl.utilities.entities import Entities
+from anvil.etl.utilities.node import Node
 
 # logger = LogCapture('anvil.etl_old.transformers.normalizer')
 # logger.addHandler(logging.root.handlers[0])
@@ -22,27 +23,52 @@ from . import logger
 from ..extractors.gen3 import DRSReader
 
 
-def exec_command(context, consortium_name, workspace, config, cmd):
-    """Find and run version of the command that matches."""
-    workspace_name = workspace['workspace']['name']
+def command_plan(consortium_name, workspace_name):
+    """Resolve every command to its most specific version for this workspace.
+
+    Returns:
+        dict: {cmd: (path, function)}
+
+    """
+    key = (consortium_name, workspace_name)
+    if key not in _PLANS:
+        plan = {}
+        for cmd in sorted({path.split('/')[-1] for path in C}):
+            for path in [f"{consortium_name}/{workspace_name}/{cmd}", f"{consortium_name}//{cmd}", f"//{workspace_name}/{cmd}", f"//{cmd}"]:
+                if path in C:
+                    plan[cmd] = (path, C[path])
+                    break
+        _PLANS[key] = plan
+    return _PLANS[key]
+
+
+def command_timings():
+    """Return {(consortium_name, cmd): (calls, seconds)} for commands run by this process, nested commands are included in their caller's time."""
+    return {key: tuple(value) for key, value in _TIMINGS.items()}
+
 
-    paths = [
-        f"{consortium_name}/{workspace_name}/{cmd}",
-        f"{consortium_name}//{cmd}",
-        f"//{workspace_name}/{cmd}",
-        f"//{cmd}"
-    ]
+def reset_command_timings():
+    """Clear command timings."""
+    _TIMINGS.clear()
 
-    path = None
-    for path in paths:
-        try:
-            runner = C.get(path, None)
-            if runner:
-                return runner(context, consortium_name, workspace, config)
-        except Exception as e:
-            raise e
 
-    assert False, f"Misconfiguration, we shouldn't get here. {cmd} {path} {consortium_name} {workspace_name}"
+def resolve_command(context, consortium_name, workspace, cmd):
+    """Return the version of the command that matches, for callers that run it in a loop."""
+    plan = context['plan'] if 'plan' in context else command_plan(consortium_name, workspace['workspace']['name'])
+    assert cmd in plan, f"Misconfiguration, we shouldn't get here. {cmd} {consortium_name} {workspace['workspace']['name']}"
+    return plan[cmd][1]
+
+
+def exec_command(context, consortium_name, workspace, config, cmd):
+    """Find and run version of the command that matches."""
+    runner = resolve_command(context, consortium_name, workspace, cmd)
+    start = time.perf_counter()
+    try:
+        return runner(context, consortium_name, workspace, config)
+    finally:
+        timing = _TIMINGS[(consortium_name, cmd)]
+        timing[0] += 1
+        timing[1] += time.perf_counter() - start
 
 
 def _extract_bucket_fields(output_path=None, entities=None, workspace_name=None):
@@ -50,11 +76,9 @@ def _extract_bucket_fields(output_path=None, entities=None, workspace_name=None)
     if not entities:
         assert output_path
         entities = Entities(path=f"{output_path}/terra_entities.sqlite")
-    for workspace in entities.get_by_label('workspace'):
-        workspace = AttrDict(workspace)
-        if workspace_name and workspace.workspace.name != workspace_name:
-            continue
-        schema = AttrDict(entities.get_edges_by_label(src=workspace.workspace.name, src_name='workspace', dst_name='schema'))
+    for workspace in entities.get_workspaces(workspace_name=workspace_name):
+        workspace = Node(workspace)
+        schema = Node(entities.get_edges_by_label(src=workspace.workspace.name, src_name='workspace', dst_name='schema'))
         for entity_name in schema.schema.keys():
             if entity_name == 'schema':
                 continue
@@ -90,7 +114,8 @@ def consortium_config(context, consortium_name, workspace, config):
     for fhir_entity in context.consortium_config['entities']:
         for alias in context.consortium_config['entities'][fhir_entity]['aliases']:
             inverted_config[alias] = fhir_entity
-    context.inverted_config = inverted_config
+    # plain dict, an unknown alias is a KeyError
+    context.inverted_config = dict(inverted_config)
 
 
 def patient_entity_names(context, consortium_name, workspace, config):
@@ -206,15 +231,37 @@ def patient_from_participant_pfb_subject(context, consortium_name, workspace, co
     return patient_key_from_specimen
 
 
+def entity_index(context, workspace, entity_names, keys):
+    """Index workspace children of entity_names by name and by the values of their `keys` attributes.
+
+    Built once per workspace and kept on the context.
+
+    Returns:
+        dict: {id: [entity, ...]} entities in workspace order
+
+    """
+    indexes = context.setdefault('indexes', {})
+    index_key = (tuple(entity_names), tuple(keys))
+    if index_key not in indexes:
+        index = defaultdict(list)
+        for entity_name in entity_names:
+            for entity in workspace.children.get(entity_name, []):
+                ids = [entity['name']] + [entity['attributes'][k] for k in keys if k in entity['attributes']]
+                for id_ in ids:
+                    if isinstance(id_, (str, int)) and (not index[id_] or index[id_][-1] is not entity):
+                        index[id_].append(entity)
+        indexes[index_key] = index
+    return indexes[index_key]
+
+
 def patient_from_qc_result_sample(context, consortium_name, workspace, config):
     """Introspect specimen, see if it has a dict pointing to subject."""
     sample_id = context.specimen['attributes']['qc_result_sample']
-    for s in workspace.children['sample']:
-        if s['name'] == sample_id or s['attributes'].get('collaborator_sample_id', None) == sample_id:
-            for k in ['subject_id', 'participant_id', 'collaborator_participant_id']:
-                if k in s['attributes']:
-                    return s['attributes'][k]
-            logger.error(('no.subject.found', workspace.workspace.name, sample_id, s))
+    for s in entity_index(context, workspace, ['sample'], ['collaborator_sample_id']).get(sample_id, []):
+        for k in ['subject_id', 'participant_id', 'collaborator_participant_id']:
+            if k in s['attributes']:
+                return s['attributes'][k]
+        logger.error(('no.subject.found', workspace.workspace.name, sample_id, s))
 
 
 def patient_from_specimen_all(context, consortium_name, workspace, config):
@@ -296,13 +343,13 @@ def ensure_tasks_populated(context, consortium_name, workspace, config):
         workspace['tasks']['_implied'] = []
         for specimen in workspace.specimens:
             # create terra type entity
-            workspace['tasks']['_implied'].append(AttrDict({
+            workspace['tasks']['_implied'].append({
                 'entityType': 'Task',
                 'name': specimen['name'],
                 'attributes': {
                     # TODO - are there any imputed attributes?
                 }
-            }))
+            })
 
     # check that other keys exist
     assert len(workspace['tasks']) > 0, ('missing.tasks', consortium_name, workspace.workspace.name)
@@ -360,52 +407,54 @@ def extract_specimen_reference_CMG(context, consortium_name, workspace, config):
 def ensure_tasks_linked_to_documents(context, consortium_name, workspace, config):
     """Ensure tasks have input that is a specimen, and outputs that are document references."""
 
-    # set up a hash of children with buckets for quick lookup
-    _children = _recursive_default_dict()
+    # index children with bucket fields by name, name -> [(bucket_field, child)] in bucket_fields order
+    _children = {}
     for bf in context.bucket_fields:
-        if bf['entity_name'] in workspace.children:
-            for child in workspace.children[bf['entity_name']]:
-                _children[bf['entity_name']][child['name']] = child
+        if bf['entity_name'] in workspace.children and bf['entity_name'] not in _children:
+            _children[bf['entity_name']] = {child['name']: child for child in workspace.children[bf['entity_name']]}
+    bucket_children = defaultdict(list)
+    for bf in context.bucket_fields:
+        for name, child in _children.get(bf['entity_name'], {}).items():
+            bucket_children[name].append((bf, child))
+
+    # TODO - remove if not needed
+    check_fields = workspace.workspace.name not in ['AnVIL_CMG_BaylorHopkins_HMB-NPU_WES'] and 'AnVIL_CMG_Broad' not in workspace.workspace.name
+    inverted_config = context.inverted_config
+    # run per task, timed as part of this command
+    extract_specimen_reference = resolve_command(context, consortium_name, workspace, 'extract_specimen_reference')
+
     # create a task, whose inputs are entities with bucket fields.
     # and whose outputs are those bucket fields
     deletion_keys = []
     for task_entity in workspace['tasks']:
         document_count = 0
         for task in workspace['tasks'][task_entity]:
-            _task_children = _recursive_default_dict()
+            _task_children = {}
             _task_inputs = []
-            for bf in context.bucket_fields:
-                if bf['entity_name'] in _children:
-                    if task['name'] in _children[bf['entity_name']]:
-                        child = _children[bf['entity_name']][task['name']]
-                        _task_inputs.append(
-                            {
-                                'entityType': child['entityType'],
-                                'name': child['name'],
-                                'fhir_entity': context.inverted_config[child['entityType']]
-                            }
-                        )
-                        for field in bf['bucket_fields']:
-                            if workspace.workspace.name not in ['AnVIL_CMG_BaylorHopkins_HMB-NPU_WES']:
-                                # TODO - remove if not needed
-                                if 'AnVIL_CMG_Broad' not in workspace.workspace.name:
-                                    assert field in child['attributes'], (field, child, bf)
-                            if field in child['attributes']:
-                                _task_children[bf['entity_name']][field] = child['attributes'][field]
-                                document_count += 1
-                # # a task might have it's own bucket fields
-                # for field in bf['bucket_fields']:
-                #     logger.error(('?', field))
-                #     if field in task['attributes']:
-                #         logger.error(('?', bf['entity_name'], field))
-                #         _task_children[bf['entity_name']][field] = task['attributes'][field]
-                #         document_count += 1
-
-            if 'Specimen' not in [ti['fhir_entity'] for ti in _task_inputs]:
+            for bf, child in bucket_children.get(task['name'], []):
+                _task_inputs.append(
+                    {
+                        'entityType': child['entityType'],
+                        'name': child['name'],
+                        'fhir_entity': inverted_config[child['entityType']]
+                    }
+                )
+                for field in bf['bucket_fields']:
+                    if check_fields:
+                        assert field in child['attributes'], (field, child, bf)
+                    if field in child['attributes']:
+                        _task_children.setdefault(bf['entity_name'], {})[field] = child['attributes'][field]
+                        document_count += 1
+
+            if not any(ti['fhir_entity'] == 'Specimen' for ti in _task_inputs):
                 no_specimen = True
+                # references appended below are visited as well
                 for ti in _task_inputs:
-                    context.entity_with_specimen_reference = _children[ti['entityType']][ti['name']]
-                    exec_command(context, consortium_name, workspace, config, 'extract_specimen_reference')
+                    child = _children.get(ti['entityType'], {}).get(ti['name'], None)
+                    if child is None:
+                        continue
+                    context.entity_with_specimen_reference = child
+                    extract_specimen_reference(context, consortium_name, workspace, config)
                     if 'specimen_reference' in context:
                         _task_inputs.append(context['specimen_reference'])
                         no_specimen = False
@@ -415,11 +464,8 @@ def ensure_tasks_linked_to_documents(context, consortium_name, workspace, config
 
             # It is possible for an entity that has  bucket fields to be classified as a task,
             # make sure we don't self reference
-            _task_inputs = [ti for ti in _task_inputs if
-                            not (task['name'] == ti['name'] and task['entityType'] == ti['entityType'])]
-
             task['outputs'] = _task_children
-            task['inputs'] = _task_inputs
+            task['inputs'] = [ti for ti in _task_inputs if not (ti['name'] == task['name'] and ti['entityType'] == task['entityType'])]
             if document_count == 0:
                 deletion_keys.append(task_entity)
 
@@ -431,10 +477,19 @@ def ensure_tasks_linked_to_documents(context, consortium_name, workspace, config
 
 def blob_attributes(context, consortium_name, workspace, config):
     """Decorate task outputs with blob attributes."""
-    google_entities = None
+    urls = {
+        url
+        for task_entity in workspace['tasks']
+        for task in workspace['tasks'][task_entity]
+        for output in task['outputs'].values()
+        for url in output.values()
+    }
+    # resolve all urls in bulk
+    blobs = {}
     if context['validate_buckets']:
-        google_entities = Entities(path=f"{context['output_path']}/google_entities.sqlite")
-    drs_reader = DRSReader(context['output_path'])
+        blobs = Entities(path=f"{context['output_path']}/google_entities.sqlite").get_blobs(urls)
+    # indexed lookups, workers handle one workspace each, preloading all of drs_file would cost more
+    drs_files = DRSReader(context['output_path']).get_many(url.split('/')[-1] for url in urls)
 
     missing_blob_count = 0
     for task_entity in workspace['tasks']:
@@ -442,7 +497,7 @@ def blob_attributes(context, consortium_name, workspace, config):
             for output_source, output in task['outputs'].items():
                 for output_property, url in output.items():
                     if context['validate_buckets']:
-                        blob = google_entities.get(url)
+                        blob = blobs[url]
                         if not blob:
                             blob = {'url': url, 'drs_uri': None}
                             missing_blob_count += 1
@@ -450,12 +505,15 @@ def blob_attributes(context, consortium_name, workspace, config):
                                 logger.warning(('blob.not.in.bucket', consortium_name, workspace.workspace.name,
                                                 output_source, output_property, url))
                                 context['logged_already'].append('blob.not.in.bucket')
+                        else:
+                            # the same url may be output by several tasks
+                            blob = dict(blob)
                     else:
                         blob = {'url': url, 'drs_uri': None}
-                    drs = drs_reader.get(url.split('/')[-1])
+                    drs = drs_files[url.split('/')[-1]]
                     if drs:
                         blob['drs_uri'] = drs.get('ga4gh_drs_uri', None)
-                    task['outputs'][output_source][output_property] = blob
+                    output[output_property] = blob
     if missing_blob_count > 0:
         logger.error(('total.blob.not.in.bucket', consortium_name, workspace.workspace.name, missing_blob_count))
 
@@ -741,7 +799,7 @@ def link_specimen_to_patient(context, consortium_name, workspace, config):
             missing_patient_count += 1
             continue
         else:
-            specimen_patient_ids.append((specimen.name, patient_id))
+            specimen_patient_ids.append((specimen['name'], patient_id))
     if missing_patient_count:
         logger.error(
             ("total.no.find.patient.from.sample", consortium_name, workspace.workspace.name, missing_patient_count))
@@ -756,8 +814,6 @@ def link_specimen_to_patient(context, consortium_name, workspace, config):
 
 def patient_model(context, consortium_name, workspace, config):
     """Standard model patient->specimen->task->document_reference."""
-    patients = {}
-    specimens = {}
     if 'patient_entity_names' not in context:
         logger.warning(('missing.context.patient_entity_names', consortium_name, workspace.workspace.name))
         return
@@ -771,11 +827,8 @@ def patient_model(context, consortium_name, workspace, config):
                 exec_command(context, consortium_name, workspace, config, 'gender')
                 exec_command(context, consortium_name, workspace, config, 'age')
                 exec_command(context, consortium_name, workspace, config, 'family_relationship')
-                # hash by several keys, the name and any other we know about
-                patients[p['name']] = p
-                for k in ['collaborator_participant_id']:
-                    if k in p['attributes']:
-                        patients[p['attributes'][k]] = p
+    # hash by several keys, the name and any other we know about, the last patient wins
+    patients = {id_: matches[-1] for id_, matches in entity_index(context, workspace, context.patient_entity_names, ['collaborator_participant_id']).items()}
 
     if len(patients) == 0:
         logger.error(('no.patients.found', consortium_name, workspace.workspace.name,
@@ -787,11 +840,8 @@ def patient_model(context, consortium_name, workspace, config):
         # normalize specimen properties
         context['specimen'] = s
         exec_command(context, consortium_name, workspace, config, 'body_site')
-        # hash by several keys, the name and any other we know about
-        specimens[s['name']] = s
-        for k in ['collaborator_sample_id']:
-            if k in s['attributes']:
-                specimens[s['attributes'][k]] = s
+    # hash by several keys, the name and any other we know about, the last specimen wins
+    specimens = {id_: matches[-1] for id_, matches in entity_index(context, workspace, [context.specimen_entity_name], ['collaborator_sample_id']).items()}
 
     for task_entity in workspace.tasks:
         for task in workspace.tasks[task_entity]:
@@ -835,55 +885,59 @@ def patient_model(context, consortium_name, workspace, config):
 # command specializations hierarchy
 #
 C = {}
-C['//consortium_config'] = lambda context, consortium_name, workspace, config: consortium_config(context, consortium_name, workspace, config)
-C['CMG//patient_entity_names'] = lambda context, consortium_name, workspace, config: patient_entity_names_CMG(context, consortium_name, workspace, config)
-C['CCDG//patient_entity_names'] = lambda context, consortium_name, workspace, config: patient_entity_names_CCDG(context, consortium_name, workspace, config)
-C['//patient_entity_names'] = lambda context, consortium_name, workspace, config: patient_entity_names(context, consortium_name, workspace, config)
-C['//specimen_entity_name'] = lambda context, consortium_name, workspace, config: specimen_entity_name(context, consortium_name, workspace, config)
-C['//patient_from_specimen'] = lambda context, consortium_name, workspace, config: patient_from_specimen_all(context, consortium_name, workspace, config)
-C['//task_entity_names'] = lambda context, consortium_name, workspace, config: task_entity_names(context, consortium_name, workspace, config)
-C['//ensure_tasks'] = lambda context, consortium_name, workspace, config: ensure_tasks(context, consortium_name, workspace, config)
-C['//ensure_tasks_populated'] = lambda context, consortium_name, workspace, config: ensure_tasks_populated(context, consortium_name, workspace, config)
-C['//ensure_tasks_linked_to_documents'] = lambda context, consortium_name, workspace, config: ensure_tasks_linked_to_documents(context, consortium_name, workspace, config)
-C['//ensure_bucket_fields'] = lambda context, consortium_name, workspace, config: ensure_bucket_fields(context, consortium_name, workspace, config)
-C['CMG/AnVIL_CMG_BaylorHopkins_HMB-NPU_WES/ensure_bucket_fields'] = lambda context, consortium_name, workspace, config: ensure_bucket_fieldsAnVIL_CMG_BaylorHopkins_HMB_NPU_WES(context, consortium_name, workspace, config)
-C['CMG/AnVIL_CMG_Broad_Kidney_Hildebrandt_WES/ensure_bucket_fields'] = lambda context, consortium_name, workspace, config: ensure_bucket_fieldsAnVIL_CMG_Broad_crai_or_bai(context, consortium_name, workspace, config)
-C['CMG/AnVIL_CMG_Broad_Muscle_KNC_WES/ensure_bucket_fields'] = lambda context, consortium_name, workspace, config: ensure_bucket_fieldsAnVIL_CMG_Broad_crai_or_bai(context, consortium_name, workspace, config)
-C['//blob_attributes'] = lambda context, consortium_name, workspace, config: blob_attributes(context, consortium_name, workspace, config)
-
-C['CCDG//extract_specimen_reference'] = lambda context, consortium_name, workspace, config: extract_specimen_reference_sample_id(context, consortium_name, workspace, config)
-C['CMG//extract_specimen_reference'] = lambda context, consortium_name, workspace, config: extract_specimen_reference_CMG(context, consortium_name, workspace, config)
-C['NIMH//extract_specimen_reference'] = lambda context, consortium_name, workspace, config: extract_specimen_reference_sample_id(context, consortium_name, workspace, config)
-
-C['//practitioner'] = lambda context, consortium_name, workspace, config: practitioner(context, consortium_name, workspace, config)
-
-C['//phenotypes'] = lambda context, consortium_name, workspace, config: phenotypes(context, consortium_name, workspace, config)
-C['CMG//phenotypes'] = lambda context, consortium_name, workspace, config: phenotypes_CMG(context, consortium_name, workspace, config)
-C['CCDG//phenotypes'] = lambda context, consortium_name, workspace, config: phenotypes_CCDG(context, consortium_name, workspace, config)
-
-C['//disease'] = lambda context, consortium_name, workspace, config: disease(context, consortium_name, workspace, config)
-C['CMG//disease'] = lambda context, consortium_name, workspace, config: disease_CMG(context, consortium_name, workspace, config)
-C['CCDG//disease'] = lambda context, consortium_name, workspace, config: disease_CCDG(context, consortium_name, workspace, config)
-C['NIMH//disease'] = lambda context, consortium_name, workspace, config: disease_NIMH(context, consortium_name, workspace, config)
-C['NHGRI//disease'] = lambda context, consortium_name, workspace, config: disease_NIMH(context, consortium_name, workspace, config)
-
-C['CCDG/AnVIL_CCDG_NYGC_NP_Autism_ACE2_GRU-MDS_WGS/disease'] = lambda context, consortium_name, workspace, config: disease_CCDG_ADI_R_DIAG(context, consortium_name, workspace, config)
-
-C['//gender'] = lambda context, consortium_name, workspace, config: gender(context, consortium_name, workspace, config)
-C['CMG//gender'] = lambda context, consortium_name, workspace, config: gender_CMG(context, consortium_name, workspace, config)
-C['NHGRI//gender'] = lambda context, consortium_name, workspace, config: gender_NHGRI(context, consortium_name, workspace, config)
-C['NIMH//gender'] = lambda context, consortium_name, workspace, config: gender_NIMH(context, consortium_name, workspace, config)
-C['CCDG//gender'] = lambda context, consortium_name, workspace, config: gender_CCDG(context, consortium_name, workspace, config)
-C['GTEx//gender'] = lambda context, consortium_name, workspace, config: gender_GTEx(context, consortium_name, workspace, config)
-
-C['//family_relationship'] = lambda context, consortium_name, workspace, config: family_relationship(context, consortium_name, workspace, config)
-
-C['//body_site'] = lambda context, consortium_name, workspace, config: body_site(context, consortium_name, workspace, config)
-C['CMG//body_site'] = lambda context, consortium_name, workspace, config: body_site_CMG(context, consortium_name, workspace, config)
-C['GTEx//body_site'] = lambda context, consortium_name, workspace, config: body_site_GTEx(context, consortium_name, workspace, config)
-
-C['//link_specimen_to_patient'] = lambda context, consortium_name, workspace, config: link_specimen_to_patient(context, consortium_name, workspace, config)
-
-C['//patient_model'] = lambda context, consortium_name, workspace, config: patient_model(context, consortium_name, workspace, config)
-
-C['//age'] = lambda context, consortium_name, workspace, config: age(context, consortium_name, workspace, config)
+# (consortium_name, workspace_name) -> {cmd: (path, function)}
+_PLANS = {}
+# (consortium_name, cmd) -> [calls, seconds]
+_TIMINGS = defaultdict(lambda: [0, 0.0])
+C['//consortium_config'] = consortium_config
+C['CMG//patient_entity_names'] = patient_entity_names_CMG
+C['CCDG//patient_entity_names'] = patient_entity_names_CCDG
+C['//patient_entity_names'] = patient_entity_names
+C['//specimen_entity_name'] = specimen_entity_name
+C['//patient_from_specimen'] = patient_from_specimen_all
+C['//task_entity_names'] = task_entity_names
+C['//ensure_tasks'] = ensure_tasks
+C['//ensure_tasks_populated'] = ensure_tasks_populated
+C['//ensure_tasks_linked_to_documents'] = ensure_tasks_linked_to_documents
+C['//ensure_bucket_fields'] = ensure_bucket_fields
+C['CMG/AnVIL_CMG_BaylorHopkins_HMB-NPU_WES/ensure_bucket_fields'] = ensure_bucket_fieldsAnVIL_CMG_BaylorHopkins_HMB_NPU_WES
+C['CMG/AnVIL_CMG_Broad_Kidney_Hildebrandt_WES/ensure_bucket_fields'] = ensure_bucket_fieldsAnVIL_CMG_Broad_crai_or_bai
+C['CMG/AnVIL_CMG_Broad_Muscle_KNC_WES/ensure_bucket_fields'] = ensure_bucket_fieldsAnVIL_CMG_Broad_crai_or_bai
+C['//blob_attributes'] = blob_attributes
+
+C['CCDG//extract_specimen_reference'] = extract_specimen_reference_sample_id
+C['CMG//extract_specimen_reference'] = extract_specimen_reference_CMG
+C['NIMH//extract_specimen_reference'] = extract_specimen_reference_sample_id
+
+C['//practitioner'] = practitioner
+
+C['//phenotypes'] = phenotypes
+C['CMG//phenotypes'] = phenotypes_CMG
+C['CCDG//phenotypes'] = phenotypes_CCDG
+
+C['//disease'] = disease
+C['CMG//disease'] = disease_CMG
+C['CCDG//disease'] = disease_CCDG
+C['NIMH//disease'] = disease_NIMH
+C['NHGRI//disease'] = disease_NIMH
+
+C['CCDG/AnVIL_CCDG_NYGC_NP_Autism_ACE2_GRU-MDS_WGS/disease'] = disease_CCDG_ADI_R_DIAG
+
+C['//gender'] = gender
+C['CMG//gender'] = gender_CMG
+C['NHGRI//gender'] = gender_NHGRI
+C['NIMH//gender'] = gender_NIMH
+C['CCDG//gender'] = gender_CCDG
+C['GTEx//gender'] = gender_GTEx
+
+C['//family_relationship'] = family_relationship
+
+C['//body_site'] = body_site
+C['CMG//body_site'] = body_site_CMG
+C['GTEx//body_site'] = body_site_GTEx
+
+C['//link_specimen_to_patient'] = link_specimen_to_patient
+
+C['//patient_model'] = patient_model
+
+C['//age'] = age
@@ -0,0 +1,144 @@
+"""Persist normalized workspaces in a versioned sqlite file, load sections on demand."""
+
+import logging
+import os
+import sqlite3
+from collections.abc import Mapping
+
+from anvil.etl.utilities import serializer
+
+from .model import Workspace
+
+logger = logging.getLogger(__name__)
+
+# bump when the layout of nodes or meta changes, older files are ignored and re-normalized
+FORMAT_VERSION = 1
+
+
+def _json_default(obj):
+    """Serialize sets and other leftovers from normalization."""
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj, key=str)
+    return str(obj)
+
+
+def _dumps(obj):
+    return serializer.dumps(obj, default=_json_default)
+
+
+def write_workspace_store(path, workspace):
+    """Write workspace to path, one row per item of each top level mapping.
+
+    The file is written to a temporary name and renamed, readers never see a partial file.
+    Items are stored as json, so read back as independent copies: a dict referenced from two sections,
+    e.g. a task in tasks and in its specimen, is two dicts, and sets are lists.
+    Stored workspaces are only read, by analyze and the FHIR writer, after normalization.
+    """
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    conn.executescript("""
+    PRAGMA synchronous = OFF;
+    PRAGMA journal_mode = OFF;
+    CREATE TABLE meta (
+        key text PRIMARY KEY,
+        value text NOT NULL
+    );
+    CREATE TABLE nodes (
+        section text NOT NULL,
+        key text,
+        json text NOT NULL
+    );
+    """)
+    sections = list(workspace.keys())
+    with conn:
+        conn.executemany("INSERT into meta values (?, ?);", [
+            ('format_version', str(FORMAT_VERSION)),
+            ('sections', _dumps(sections)),
+        ])
+        for section in sections:
+            value = workspace[section]
+            if isinstance(value, Mapping) and len(value) > 0:
+                rows = ((section, str(key), _dumps(item)) for key, item in value.items())
+            else:
+                rows = [(section, None, _dumps(value))]
+            conn.executemany("INSERT into nodes values (?, ?, ?);", rows)
+    conn.execute("CREATE INDEX nodes_section ON nodes(section);")
+    conn.commit()
+    conn.close()
+    os.replace(tmp_path, path)
+
+
+def read_workspace_store(path):
+    """Open workspace written by write_workspace_store, None if missing or written by another format version."""
+    if not os.path.exists(path):
+        return None
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+    meta = dict(conn.execute("SELECT key, value FROM meta"))
+    if meta.get('format_version') != str(FORMAT_VERSION):
+        conn.close()
+        logger.warning(('workspace.store.version', path, meta.get('format_version'), FORMAT_VERSION))
+        return None
+    return LazyWorkspace(conn=conn, sections=serializer.loads(meta['sections']))
+
+
+class LazyWorkspace(Workspace):
+    """Workspace whose sections are read from the store the first time they are used."""
+
+    __slots__ = ('_conn', '_pending')
+
+    def __init__(self, conn, sections):
+        """Register sections, nothing is read yet."""
+        super().__init__()
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, '_pending', list(sections))
+
+    def _load(self, section):
+        rows = self._conn.execute("SELECT key, json FROM nodes WHERE section = ? ORDER BY rowid", (section,)).fetchall()
+        if len(rows) == 1 and rows[0][0] is None:
+            value = serializer.loads(rows[0][1])
+        else:
+            value = {key: serializer.loads(item) for key, item in rows}
+        setattr(self, section, value)
+        return self[section]
+
+    def _load_all(self):
+        for section in list(self._pending):
+            self._load(section)
+
+    def __getattr__(self, key):
+        """Load a pending section, else as Workspace, only called for unset fields and unknown names."""
+        if key in object.__getattribute__(self, '_pending'):
+            return self._load(key)
+        return super().__getattr__(key)
+
+    def __setattr__(self, key, value):
+        """Set a field, a pending section is no longer read from the store."""
+        if key in self._pending:
+            self._pending.remove(key)
+        super().__setattr__(key, value)
+
+    def __contains__(self, key):
+        """Return True if key is pending or set."""
+        return key in self._pending or super().__contains__(key)
+
+    def keys(self):
+        """Return set fields and extra keys, pending sections included, nothing is loaded."""
+        # pending fields are already listed, see __contains__
+        return super().keys() + [section for section in self._pending if section not in Workspace.FIELDS]
+
+    def items(self):
+        """Load all pending sections, return [(key, value)]."""
+        self._load_all()
+        return super().items()
+
+    def values(self):
+        """Load all pending sections, return values."""
+        self._load_all()
+        return super().values()
+
+    def __reduce__(self):
+        """Load all pending sections, pickle as a Workspace."""
+        self._load_all()
+        return super().__reduce__()
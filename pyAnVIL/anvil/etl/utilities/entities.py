@@ -1,12 +1,24 @@
 """Cache items into sqlite."""
 import sqlite3
-import json
 import logging
+import os
+import queue
+import threading
 from datetime import date, datetime
 from collections import defaultdict
+from itertools import islice
+
+from anvil.etl.utilities import serializer
 
 logger = logging.getLogger(__name__)
 
+# rows per transaction for bulk writes
+DEFAULT_BATCH_SIZE = 10000
+
+
+class StaleBlobsError(Exception):
+    """Blobs are stored as vertices, as extract google wrote them before the blobs table."""
+
 
 def json_serial(obj):
     """JSON serializer for objects not serializable by default json code."""
@@ -15,6 +27,16 @@ def json_serial(obj):
     raise TypeError("Type %s not serializable" % type(obj))
 
 
+def batches(iterable, size):
+    """Works with any iterable, returns iterator of lists of at most size items."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
 def dict_factory(cursor, row):
     d = {}
     for idx, col in enumerate(cursor.description):
@@ -32,6 +54,10 @@ class Entities():
         self._conn = sqlite3.connect(path, check_same_thread=True)
         self._conn.row_factory = dict_factory
         cur = self._conn.cursor()
+        # databases written before the catalog existed get one built from their workspace vertices
+        migrate_catalog = cur.execute(
+            "SELECT count(*) as count FROM sqlite_master WHERE type='table' and name in ('vertices', 'catalog')"
+        ).fetchone()['count'] == 1
         cur.executescript("""
         CREATE TABLE IF NOT EXISTS vertices (
             key text PRIMARY KEY,
@@ -44,6 +70,41 @@ class Entities():
             src_name text,
             dst_name text
         );
+        CREATE TABLE IF NOT EXISTS catalog (
+            name text PRIMARY KEY,
+            consortium_name text NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS staged_vertices (
+            src text NOT NULL,
+            key text NOT NULL,
+            label text NOT NULL,
+            json text NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS staged_edges (
+            src text,
+            dst text,
+            src_name text,
+            dst_name text
+        );
+        CREATE TABLE IF NOT EXISTS checkpoint (
+            name text PRIMARY KEY,
+            page_token text,
+            done integer NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS blobs (
+            url text PRIMARY KEY,
+            bucket text NOT NULL,
+            name text NOT NULL,
+            size integer,
+            md5Hash text,
+            crc32c text,
+            updated text
+        );
+        CREATE TABLE IF NOT EXISTS workspace_state (
+            name text PRIMARY KEY,
+            last_modified text,
+            entity_counts text NOT NULL
+        );
         """)
         self._conn.commit()
 
@@ -58,6 +119,9 @@ class Entities():
         self._conn.row_factory = dict_factory
         self._cursor = None
         self._put_count = 0
+        self._blobs_checked = False
+        if migrate_catalog:
+            self._rebuild_catalog()
 
     def get(self, key):
         """Retrieve an item."""
@@ -66,7 +130,7 @@ class Entities():
         cur = self._conn.cursor()
         data = cur.execute("SELECT json FROM vertices where key=? ", (key,)).fetchone()
         if data:
-            data = json.loads(data['json'])
+            data = serializer.loads(data['json'])
             logger.debug(f"hit {key}")
         else:
             logger.debug(f"miss {key}")
@@ -85,7 +149,7 @@ class Entities():
         logger.debug(f"? {label}")
         rows = self.cursor.execute("SELECT json FROM vertices where label=? order  by key ", (label,)).fetchall()
         for row in rows:
-            yield json.loads(row['json'])
+            yield serializer.loads(row['json'])
 
     def commit(self, force=False):
         """Commit if put count over limit."""
@@ -97,7 +161,7 @@ class Entities():
     def put(self, key, label, data):
         """Save an item."""
         logger.debug(f"put {key}")
-        self.cursor.execute("REPLACE into vertices values (?, ?, ?);", (key, label, json.dumps(data, default=json_serial)))
+        self.cursor.execute("REPLACE into vertices values (?, ?, ?);", (key, label, serializer.dumps(data, default=json_serial)))
         self._put_count += 1
         self.commit()
 
@@ -108,23 +172,262 @@ class Entities():
         self._put_count += 1
         self.commit()
 
+    def put_many(self, items, batch_size=DEFAULT_BATCH_SIZE):
+        """Save items, an iterable of (key, label, data), in transactions of batch_size rows.
+
+        Returns:
+            int: number of items written
+
+        """
+        rows = ((key, label, serializer.dumps(data, default=json_serial)) for key, label, data in items)
+        return self._execute_many("REPLACE into vertices values (?, ?, ?);", rows, batch_size)
+
+    def put_edges_many(self, edges, batch_size=DEFAULT_BATCH_SIZE):
+        """Save edges, an iterable of (src, dst, src_name, dst_name), in transactions of batch_size rows.
+
+        Returns:
+            int: number of edges written
+
+        """
+        return self._execute_many("REPLACE into edges values (?, ?, ?, ?);", edges, batch_size)
+
+    def _execute_many(self, sql, rows, batch_size):
+        """Write rows with executemany, one transaction per batch."""
+        # flush anything pending from put/put_edge
+        self.commit(force=True)
+        count = 0
+        for batch in batches(rows, batch_size):
+            with self._conn:
+                self._conn.executemany(sql, batch)
+            count += len(batch)
+            logger.debug(f"put_many {count}")
+        return count
+
+    def put_catalog(self, items, batch_size=DEFAULT_BATCH_SIZE):
+        """Save workspace catalog entries, an iterable of (name, consortium_name).
+
+        Returns:
+            int: number of entries written
+
+        """
+        return self._execute_many("REPLACE into catalog values (?, ?);", items, batch_size)
+
+    def get_catalog(self, consortium_name=None, workspace_name=None):
+        """Retrieve [(consortium_name, workspace_name)] from the catalog, no json decoding.
+
+        Args:
+            consortium_name (str): Optional, only this consortium.
+            workspace_name (str): Optional, only this workspace.
+
+        """
+        sql = "SELECT consortium_name, name FROM catalog WHERE 1 = 1"
+        params = []
+        if consortium_name:
+            sql += " and consortium_name = ?"
+            params.append(consortium_name)
+        if workspace_name:
+            sql += " and name = ?"
+            params.append(workspace_name)
+        sql += " order by name"
+        cur = self._conn.cursor()
+        cur.row_factory = None
+        catalog = cur.execute(sql, params).fetchall()
+        cur.close()
+        return catalog
+
+    def get_workspaces(self, consortium_name=None, workspace_name=None):
+        """Retrieve workspace vertices by primary key, filtered by the catalog."""
+        for _consortium_name, _workspace_name in self.get_catalog(consortium_name, workspace_name):
+            workspace = self.get(_workspace_name)
+            if workspace:
+                yield workspace
+
+    def _rebuild_catalog(self):
+        """Replace the catalog with the workspace vertices' names, dropping workspaces no longer extracted."""
+        self.commit(force=True)
+        rows = [
+            (workspace['workspace']['name'], workspace['consortium_name'])
+            for workspace in self.get_by_label('workspace')
+        ]
+        with self._conn:
+            self._conn.execute("DELETE FROM catalog;")
+            self._conn.executemany("REPLACE into catalog values (?, ?);", rows)
+
+    def put_blobs(self, rows, batch_size=DEFAULT_BATCH_SIZE):
+        """Save (url, bucket, name, size, md5Hash, crc32c, updated) rows, replacing existing urls.
+
+        Returns:
+            int: number of rows written
+
+        """
+        return self._execute_many("REPLACE into blobs values (?, ?, ?, ?, ?, ?, ?);", rows, batch_size)
+
+    def _check_blobs(self):
+        """Raise StaleBlobsError if only Blob vertices are stored, read as no blobs at all otherwise."""
+        if self._blobs_checked:
+            return
+        cur = self._conn.cursor()
+        has_blob_vertices = cur.execute("SELECT 1 FROM vertices WHERE label = 'Blob' LIMIT 1").fetchone()
+        has_blobs = cur.execute("SELECT 1 FROM blobs LIMIT 1").fetchone()
+        cur.close()
+        if has_blob_vertices and not has_blobs:
+            raise StaleBlobsError(f"{self._path} was written by an older version, re-run `anvil_etl extract google --restart`")
+        self._blobs_checked = True
+
+    def get_blob(self, url):
+        """Retrieve a blob's attributes by gs:// url, None if not found."""
+        self._check_blobs()
+        cur = self._conn.cursor()
+        blob = cur.execute("SELECT * FROM blobs WHERE url = ?", (url,)).fetchone()
+        cur.close()
+        return blob
+
+    def get_blobs(self, urls):
+        """Retrieve attributes of many blobs.
+
+        Returns:
+            dict: {url: blob or None}
+
+        """
+        self._check_blobs()
+        blobs = {url: None for url in urls}
+        cur = self._conn.cursor()
+        # stay under sqlite's host parameter limit
+        for batch in batches(blobs, 500):
+            for blob in cur.execute(f"SELECT * FROM blobs WHERE url in ({', '.join('?' * len(batch))})", batch):
+                blobs[blob['url']] = blob
+        cur.close()
+        return blobs
+
+    def get_edge_counts(self, src_name):
+        """Retrieve {src: number of edges} for all src of type src_name."""
+        cur = self._conn.cursor()
+        cur.row_factory = None
+        counts = dict(cur.execute("SELECT src, count(*) FROM edges WHERE src_name = ? GROUP BY src", (src_name,)))
+        cur.close()
+        return counts
+
+    def get_workspace_states(self):
+        """Retrieve {workspace_name: (last_modified, entity_counts)} recorded by the last extract."""
+        cur = self._conn.cursor()
+        cur.row_factory = None
+        states = {name: (last_modified, serializer.loads(entity_counts))
+                  for name, last_modified, entity_counts in cur.execute("SELECT name, last_modified, entity_counts FROM workspace_state")}
+        cur.close()
+        return states
+
+    def put_workspace_state(self, name, last_modified, entity_counts):
+        """Record workspace lastModified and {entity_type: count}."""
+        self.commit(force=True)
+        with self._conn:
+            self._conn.execute("REPLACE into workspace_state values (?, ?, ?);", (name, last_modified, serializer.dumps(entity_counts, sort_keys=True)))
+
+    def get_checkpoints(self):
+        """Retrieve {name: (page_token, done)} recorded by an interrupted run."""
+        cur = self._conn.cursor()
+        cur.row_factory = None
+        checkpoints = {name: (page_token, bool(done))
+                       for name, page_token, done in cur.execute("SELECT name, page_token, done FROM checkpoint")}
+        cur.close()
+        return checkpoints
+
+    def put_checkpoint(self, name, page_token, done):
+        """Record the next page_token to read for name, or done."""
+        self.commit(force=True)
+        with self._conn:
+            self._conn.execute("REPLACE into checkpoint values (?, ?, ?);", (name, page_token, int(done)))
+
+    def clear_checkpoints(self):
+        """Remove all checkpoints, the next run starts from the beginning."""
+        self.commit(force=True)
+        with self._conn:
+            self._conn.execute("DELETE FROM checkpoint")
+
+    def stage_many(self, src, vertices=(), edges=(), batch_size=DEFAULT_BATCH_SIZE):
+        """Save vertices and edges to staging tables, to be swapped in by replace_edges(src, ...).
+
+        Returns:
+            int: number of vertices staged
+
+        """
+        rows = ((src, key, label, serializer.dumps(data, default=json_serial)) for key, label, data in vertices)
+        count = self._execute_many("INSERT into staged_vertices values (?, ?, ?, ?);", rows, batch_size)
+        self._execute_many("INSERT into staged_edges values (?, ?, ?, ?);", edges, batch_size)
+        return count
+
+    def clear_staging(self, src):
+        """Remove anything staged for src, e.g. left over from an interrupted run."""
+        self.commit(force=True)
+        with self._conn:
+            self._conn.execute("DELETE FROM staged_vertices WHERE src = ?", (src,))
+            self._conn.execute("DELETE FROM staged_edges WHERE src = ?", (src,))
+
+    def replace_edges(self, src, src_name):
+        """In one transaction, remove all edges from src and their vertices, then move staged rows for src into place."""
+        self.commit(force=True)
+        with self._conn:
+            self._conn.execute("DELETE FROM vertices WHERE key IN (SELECT dst FROM edges WHERE src = ? and src_name = ?)", (src, src_name))
+            self._conn.execute("DELETE FROM edges WHERE src = ? and src_name = ?", (src, src_name))
+            self._conn.execute("REPLACE into vertices SELECT key, label, json FROM staged_vertices WHERE src = ?", (src,))
+            self._conn.execute("REPLACE into edges SELECT src, dst, src_name, dst_name FROM staged_edges WHERE src = ? and src_name = ?", (src, src_name))
+            self._conn.execute("DELETE FROM staged_vertices WHERE src = ?", (src,))
+            self._conn.execute("DELETE FROM staged_edges WHERE src = ?", (src,))
+
+    def iter_edge_json(self, src, src_name):
+        """Stream (dst, json text) for src and all vertices it has edges to, ordered by key, without parsing json."""
+        cur = self._conn.cursor()
+        cur.row_factory = None
+        yield from cur.execute("""
+            SELECT key, json FROM vertices WHERE key = ?
+            UNION ALL
+            SELECT edges.dst, vertices.json FROM edges
+            LEFT JOIN vertices ON vertices.key = edges.dst
+            WHERE edges.src = ? and edges.src_name = ?
+            ORDER BY 1
+        """, (src, src, src_name))
+        cur.close()
+
+    def iter_edges(self, src, src_name, dst_name=None, limit=None):
+        """Stream (dst_name, vertex) for all edges from src, vertices are fetched in the same query.
+
+        Args:
+            src (str): source vertex key
+            src_name (str): source vertex label
+            dst_name (str): Optional, only edges to this label
+            limit (int): Optional, maximum number of edges
+
+        """
+        sql = """
+            SELECT edges.dst_name, vertices.json FROM edges
+            LEFT JOIN vertices ON vertices.key = edges.dst
+            WHERE edges.src = ? and edges.src_name = ?
+        """
+        params = [src, src_name]
+        if dst_name:
+            sql += " and edges.dst_name = ?"
+            params.append(dst_name)
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        cur = self._conn.cursor()
+        # plain tuples, skip dict_factory
+        cur.row_factory = None
+        try:
+            for _dst_name, _json in cur.execute(sql, params):
+                yield _dst_name, serializer.loads(_json) if _json else None
+        finally:
+            cur.close()
+
     def get_edges(self, src, src_name):
         """Retrieves all edges."""
-        destination_edges = self.cursor.execute("SELECT dst, dst_name FROM edges where src= ? and src_name= ? ", (src, src_name, )).fetchall()
         destination_vertices = defaultdict(list)
-        for de in destination_edges:
-            destination_vertices[de['dst_name']].append(self.get(de['dst']))
+        for dst_name, vertex in self.iter_edges(src, src_name):
+            destination_vertices[dst_name].append(vertex)
         return destination_vertices
 
     def get_edges_by_label(self, src, src_name, dst_name, limit=None):
         """Retrieves all edges for a particular label."""
-        if limit:
-            limit = f"LIMIT {limit}"
-        else:
-            limit = ''
-        destination_edges = self.cursor.execute(f"SELECT dst, dst_name FROM edges where src = ? and src_name = ? and dst_name = ? {limit}", (src, src_name, dst_name, )).fetchall()
-        destination_vertices = {de['dst_name']: self.get(de['dst']) for de in destination_edges}
-        return destination_vertices
+        return {_dst_name: vertex for _dst_name, vertex in self.iter_edges(src, src_name, dst_name=dst_name, limit=limit)}
 
     def index(self):
         logger.info('Indexing')
@@ -136,3 +439,92 @@ class Entities():
         CREATE  INDEX IF NOT EXISTS edges_dst ON edges(dst);
         """)
         self._conn.commit()
+        self._rebuild_catalog()
+
+
+class EntitiesWriter(threading.Thread):
+    """Single thread that owns an Entities connection, other threads queue writes to it.
+
+    Use as a context manager; on exit pending writes are drained, committed and indexed.
+    """
+
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE, max_pending=16, index=True):
+        """Set up queue, connection is opened in the writer thread."""
+        super().__init__(name=f"writer-{os.path.basename(path)}", daemon=True)
+        self._path = path
+        self._batch_size = batch_size
+        self._index = index
+        # bound memory, producers block when writer falls behind
+        self._queue = queue.Queue(maxsize=max_pending)
+        self.vertex_count = 0
+        self.edge_count = 0
+        self.blob_count = 0
+        self.exception = None
+
+    def submit(self, fn, *args):
+        """Queue fn(entities, *args) to run in the writer thread."""
+        if self.exception:
+            raise self.exception
+        self._queue.put((fn, args))
+
+    def put(self, vertices=(), edges=(), catalog=()):
+        """Queue rows for Entities.put_many, put_edges_many and put_catalog."""
+        self.submit(self._put, vertices, edges, catalog)
+
+    def put_blobs(self, rows):
+        """Queue rows for Entities.put_blobs."""
+        self.submit(self._put_blobs, rows)
+
+    def stage(self, src, vertices=(), edges=()):
+        """Queue rows for Entities.stage_many."""
+        self.submit(self._stage, src, vertices, edges)
+
+    def _stage(self, entities, src, vertices, edges):
+        self.vertex_count += entities.stage_many(src, vertices, edges, batch_size=self._batch_size)
+        self.edge_count += len(edges)
+
+    def _put_blobs(self, entities, rows):
+        self.blob_count += entities.put_blobs(rows, batch_size=self._batch_size)
+
+    def _put(self, entities, vertices, edges, catalog):
+        self.vertex_count += entities.put_many(vertices, batch_size=self._batch_size)
+        self.edge_count += entities.put_edges_many(edges, batch_size=self._batch_size)
+        if catalog:
+            entities.put_catalog(catalog, batch_size=self._batch_size)
+
+    def run(self):
+        """Write until closed."""
+        entities = Entities(path=self._path)
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self.exception:
+                # keep draining so producers do not block
+                continue
+            fn, args = item
+            try:
+                fn(entities, *args)
+            except Exception as e:
+                logger.error(f"writer {self._path} failed", exc_info=True)
+                self.exception = e
+        if not self.exception:
+            entities.commit(True)
+            if self._index:
+                entities.index()
+
+    def close(self):
+        """Drain queue and wait for writer, raise any writer exception."""
+        self._queue.put(None)
+        self.join()
+        if self.exception:
+            raise self.exception
+
+    def __enter__(self):
+        """Start the writer thread, return self."""
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Drain queue and wait for writer, see close()."""
+        self.close()
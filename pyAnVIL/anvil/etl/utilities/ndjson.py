@@ -0,0 +1,120 @@
+"""Write ndjson files into a staging directory, moved into place when complete."""
+import gzip
+import logging
+import os
+import shutil
+from collections import OrderedDict, defaultdict
+
+from anvil.etl.utilities import serializer
+
+logger = logging.getLogger(__name__)
+
+# bytes buffered per open file
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+# files open at once, the least recently written is closed and reopened in append mode
+DEFAULT_MAX_OPEN = 32
+# zlib's default, most of the size reduction of level 9 in a fraction of the time
+DEFAULT_COMPRESS_LEVEL = 6
+# file name suffix of each compression
+SUFFIXES = {None: '', 'gzip': '.gz'}
+
+
+class NDJSONWriter:
+    """Write objects, one per line, to files under dir_path.
+
+    Files are written under staging_path, on commit() staging_path replaces dir_path.
+    Readers of dir_path see the previous complete set of files or the new one, never a partial one.
+    Between commit()'s two renames dir_path is missing, the previous files are in f"{staging_path}.previous".
+    If a process dies there, the next NDJSONWriter for the same paths moves them back.
+    On exception the staged files are removed and dir_path is left as is.
+    With compress='gzip' files are gzipped and named with a .gz suffix.
+
+    with NDJSONWriter(dir_path, staging_path) as writer:
+        writer.write('public/Organization.ndjson', {...})
+    """
+
+    def __init__(self, dir_path, staging_path, buffer_size=DEFAULT_BUFFER_SIZE, max_open=DEFAULT_MAX_OPEN,
+                 compress=None, compress_level=DEFAULT_COMPRESS_LEVEL):
+        """Restore dir_path if a commit was interrupted, remove leftovers of an interrupted write in staging_path."""
+        assert compress in SUFFIXES, f"compress should be one of {list(SUFFIXES)}"
+        self.dir_path = dir_path
+        self.staging_path = staging_path
+        self.buffer_size = buffer_size
+        self.max_open = max_open
+        self.compress = compress
+        self.compress_level = compress_level
+        # relative path -> lines written
+        self.counts = defaultdict(int)
+        self._handles = OrderedDict()
+        previous_path = f"{staging_path}.previous"
+        if os.path.exists(previous_path):
+            if os.path.exists(dir_path):
+                shutil.rmtree(previous_path)
+            else:
+                logger.warning(("restoring.interrupted.commit", dir_path))
+                os.makedirs(os.path.dirname(dir_path), exist_ok=True)
+                os.rename(previous_path, dir_path)
+        shutil.rmtree(staging_path, ignore_errors=True)
+
+    def _handle(self, relative_path):
+        handle = self._handles.get(relative_path, None)
+        if handle is not None:
+            self._handles.move_to_end(relative_path)
+            return handle
+        if len(self._handles) >= self.max_open:
+            _, least_recent = self._handles.popitem(last=False)
+            least_recent.close()
+        path = os.path.join(self.staging_path, relative_path)
+        # a reopened gzip file gets another gzip member, read as one stream
+        mode = 'a' if relative_path in self.counts else 'w'
+        if mode == 'w':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if self.compress == 'gzip':
+            handle = gzip.open(path, f"{mode}t", compresslevel=self.compress_level, encoding='utf-8')
+        else:
+            handle = open(path, mode, buffering=self.buffer_size, encoding='utf-8')
+        self._handles[relative_path] = handle
+        return handle
+
+    def write(self, relative_path, obj):
+        """Append obj to relative_path, plus the compression's suffix, as a line of json escaped to ascii."""
+        relative_path += SUFFIXES[self.compress]
+        self._handle(relative_path).write(serializer.dumps(obj, ensure_ascii=True) + '\n')
+        self.counts[relative_path] += 1
+
+    def _close(self):
+        while self._handles:
+            _, handle = self._handles.popitem(last=False)
+            handle.close()
+
+    def commit(self):
+        """Flush files to disk, replace dir_path with staging_path."""
+        self._close()
+        for relative_path in self.counts:
+            with open(os.path.join(self.staging_path, relative_path), 'a') as handle:
+                os.fsync(handle.fileno())
+        os.makedirs(self.staging_path, exist_ok=True)
+        previous_path = f"{self.staging_path}.previous"
+        shutil.rmtree(previous_path, ignore_errors=True)
+        # dir_path is missing until the second rename, see __init__
+        if os.path.exists(self.dir_path):
+            os.rename(self.dir_path, previous_path)
+        os.makedirs(os.path.dirname(self.dir_path), exist_ok=True)
+        os.rename(self.staging_path, self.dir_path)
+        shutil.rmtree(previous_path, ignore_errors=True)
+
+    def abort(self):
+        """Close and remove staged files."""
+        self._close()
+        shutil.rmtree(self.staging_path, ignore_errors=True)
+
+    def __enter__(self):
+        """Return self."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Commit, or abort if the block raised."""
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
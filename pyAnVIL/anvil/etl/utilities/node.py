@@ -0,0 +1,33 @@
+"""A dict with attribute access."""
+
+
+class Node(dict):
+    """dict whose items can be read and written as attributes, replaces AttrDict.
+
+    Unlike AttrDict nothing is copied on access: values are returned as is,
+    except a nested dict, which is converted to a Node once, in place, the first time it is reached as an attribute.
+    """
+
+    __slots__ = ()
+
+    def __getattr__(self, key):
+        """Return self[key], a nested dict converted to a Node in place."""
+        try:
+            value = self[key]
+        except KeyError:
+            raise AttributeError(key) from None
+        if type(value) is dict:
+            value = Node(value)
+            self[key] = value
+        return value
+
+    def __setattr__(self, key, value):
+        """Set self[key]."""
+        self[key] = value
+
+    def __delattr__(self, key):
+        """Delete self[key]."""
+        try:
+            del self[key]
+        except KeyError:
+            raise AttributeError(key) from None
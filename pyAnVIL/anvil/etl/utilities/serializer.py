@@ -0,0 +1,46 @@
+"""Compact JSON, encoded with orjson when installed, otherwise the standard library json."""
+import json
+
+try:
+    import orjson
+except ImportError:  # optional, `pip install orjson`
+    orjson = None
+
+BACKEND = 'orjson' if orjson else 'json'
+
+if orjson:
+    # int keys written as strings, datetimes and dataclasses go to default, as with json
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+
+def dumps(obj, default=None, sort_keys=False, ensure_ascii=False):
+    """Return obj as compact json text, utf-8, or escaped to ascii as json.dumps writes it by default if ensure_ascii.
+
+    Files are written with ensure_ascii, byte for byte what json.dumps wrote before, and whatever the locale's encoding.
+    Both backends write the same values. Floats may be formatted differently, 1e16 by orjson, 1e+16 by json.
+    Integers over 64 bits, which orjson can't write, are written by json. NaN and Infinity are written as null by orjson.
+    """
+    if orjson:
+        try:
+            s = orjson.dumps(obj, default=default, option=(_OPTIONS | orjson.OPT_SORT_KEYS) if sort_keys else _OPTIONS).decode()
+            # orjson can't escape, text that needs it is written by json
+            if not ensure_ascii or s.isascii():
+                return s
+        except orjson.JSONEncodeError:
+            # integers over 64 bits, or default raised, in which case json raises too
+            pass
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=ensure_ascii, default=default, sort_keys=sort_keys)
+
+
+def loads(s):
+    """Return the object encoded in s, str or bytes.
+
+    orjson reads integers over 64 bits as floats.
+    """
+    if orjson:
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            # NaN, Infinity ...
+            pass
+    return json.loads(s)
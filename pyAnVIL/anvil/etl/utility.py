@@ -13,7 +13,9 @@ from tabulate import tabulate
 from anvil.etl.extractors.gen3 import DRSReader
 from anvil.etl.transform import _consortium_from_workspace
 from anvil.etl.transformers import _recursive_default_dict
-from anvil.etl.transformers.normalizer import ontologies, normalize, fetch_workspace_names
+from anvil.etl.transformers.normalizer import ontologies, normalize, fetch_workspace_names, read_analysis
+from anvil.etl.transformers.normalizer_methods import command_plan
+from anvil.etl.utilities import serializer
 from anvil.etl.utilities.shell_helper import ensure_env_variables
 
 logger = logging.getLogger(__name__)
@@ -53,10 +55,24 @@ def _config(ctx, format_):
 @click.pass_context
 def errors(ctx, workspace):
     """Dump errors."""
-    _consortium_name, workspace = next(iter(normalize(output_path=ctx.obj['output_path'], requested_consortium_name=None, workspace_name=workspace, validate_buckets=False, config=ctx.obj['config'])), None)
+    # with a consortium, an unchanged workspace is read from its store
+    consortium = _consortium_from_workspace(ctx.obj['config'], workspace)
+    _consortium_name, workspace = next(iter(normalize(output_path=ctx.obj['output_path'], requested_consortium_name=consortium, workspace_name=workspace, validate_buckets=False, config=ctx.obj['config'])), None)
     print(json.dumps(workspace.errors))
 
 
+@utility.command(name='plan')
+@click.option('--consortium', default=None, help='Consortium, default: deduced from workspace.')
+@click.option('--workspace', required=True, help='Workspace name.')
+@click.pass_context
+def plan(ctx, consortium, workspace):
+    """Print the normalizer command plan, the function each command resolves to for a workspace."""
+    if not consortium:
+        consortium = _consortium_from_workspace(ctx.obj['config'], workspace)
+    rows = [[cmd, path, function.__name__] for cmd, (path, function) in command_plan(consortium, workspace).items()]
+    print(tabulate(rows, ['command', 'path', 'function']))
+
+
 @utility.command(name='qa')
 @click.option('--consortium', default=None, help='Filter, only this consortium.')
 @click.option('--workspace', default=None, help='Filter, only this workspace.')
@@ -65,31 +81,29 @@ def errors(ctx, workspace):
 def qa(ctx, consortium, workspace, details):
     """Report on analysis."""
     summaries = []
-    with open(f"{ctx.obj['output_path']}/analysis.ndjson") as input_stream:
-        for line in input_stream.readlines():
-            summary = json.loads(line)
-            o = {
-                'consortium': summary['consortium'],
-                'workspace': summary['workspace'],
-            }
-            for k in ['patients', 'specimens', 'tasks', 'documents']:
-                o[k] = summary['nodes'][k]
-            file_count = 0
-            drs_count = 0
-            for k in summary['files']:
-                o[k] = summary['files'][k]['count']
-                drs_count += summary['files'][k]['drs_count']
-                file_count += summary['files'][k]['count']
-            if o['specimens'] == 0:
-                o['qa_grade'] = 0
-            else:
-                o['qa_grade'] = 100 - (summary['error_count'] / o['specimens'])
-
-            if drs_count == 0:
-                o['drs_grade'] = 0
-            else:
-                o['drs_grade'] = 100 - (drs_count / file_count)
-            summaries.append(o)
+    for summary in read_analysis(ctx.obj['output_path'], consortium_name=consortium, workspace_name=workspace):
+        o = {
+            'consortium': summary['consortium'],
+            'workspace': summary['workspace'],
+        }
+        for k in ['patients', 'specimens', 'tasks', 'documents']:
+            o[k] = summary['nodes'][k]
+        file_count = 0
+        drs_count = 0
+        for k in summary['files']:
+            o[k] = summary['files'][k]['count']
+            drs_count += summary['files'][k]['drs_count']
+            file_count += summary['files'][k]['count']
+        if o['specimens'] == 0:
+            o['qa_grade'] = 0
+        else:
+            o['qa_grade'] = 100 - (summary['error_count'] / o['specimens'])
+
+        if drs_count == 0:
+            o['drs_grade'] = 0
+        else:
+            o['drs_grade'] = 100 - (drs_count / file_count)
+        summaries.append(o)
     df = pd.DataFrame(summaries).replace({np.nan: None})
     print(tabulate(df, headers='keys', tablefmt='github'))
 
@@ -202,17 +216,11 @@ def _sample(ctx, consortium, workspace, depth):
                 emitters[file_path] = emitter
 
             if entity['entityType'] not in ['blob', 'drs', 'schema']:
-                json.dump({'attributes': entity['attributes'],
-                           'name': entity['name'],
-                           'entityType': entity['entityType']},
-                          emitter,
-                          separators=(',', ':'),
-                          )
+                emitter.write(serializer.dumps({'attributes': entity['attributes'],
+                                                'name': entity['name'],
+                                                'entityType': entity['entityType']}, ensure_ascii=True))
             else:
-                json.dump(entity['attributes'],
-                          emitter,
-                          separators=(',', ':'),
-                          )
+                emitter.write(serializer.dumps(entity['attributes'], ensure_ascii=True))
 
             emitter.write('\n')
 
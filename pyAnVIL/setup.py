@@ -109,6 +109,11 @@ setup(
     # https://packaging.python.org/en/latest/requirements.html
     install_requires=requirements,
 
+    # faster json encoding and decoding in the etl, see anvil/etl/utilities/serializer.py
+    extras_require={  # Optional
+        'fast': ['orjson'],
+    },
+
     # If there are data files included in your packages that need to be
     # installed, specify them here.
     #
@@ -30,6 +30,19 @@ def pytest_addoption(parser):
     parser.addoption(
         "--avro_path", action="store", default=None, help="Where to find avro"
     )
+    parser.addoption(
+        "--benchmark", action="store_true", default=False, help="Run tests marked benchmark, they log timings"
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    """Skip tests marked benchmark unless --benchmark."""
+    if config.getoption("--benchmark"):
+        return
+    skip = pytest.mark.skip(reason="benchmark, use --benchmark to run")
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip)
 
 @pytest.fixture
 def terra_auth_url(request):
@@ -0,0 +1,136 @@
+"""Benchmark normalizer and FHIR writer steps on synthetic data."""
+
+import json
+import logging
+import re
+import time
+import uuid
+
+import pytest
+
+from anvil.etl.transformers.fhir_writer import _fhir_id, _id
+from anvil.etl.transformers.model import Workspace
+from anvil.etl.transformers.normalizer_methods import ensure_tasks_linked_to_documents
+from anvil.etl.utilities import serializer
+from anvil.etl.utilities.entities import json_serial
+from anvil.etl.utilities.node import Node
+
+logger = logging.getLogger(__name__)
+
+# rows in the benchmark workspace
+BENCHMARK_ROWS = 500_000
+
+
+def _synthetic_workspace(rows):
+    """Return (context, workspace) with `rows` sequencing entities, each with a cram, crai and sample alias."""
+    sequencing = [
+        {
+            'entityType': 'sequencing',
+            'name': f"seq-{i}",
+            'attributes': {
+                'sample_alias': f"sample-{i}",
+                'cram_path': f"gs://bucket/seq-{i}.cram",
+                'crai_path': f"gs://bucket/seq-{i}.cram.crai",
+            }
+        }
+        for i in range(rows)
+    ]
+    workspace = Workspace({'workspace': {'name': 'AnVIL_CMG_Synthetic'}, 'consortium_name': 'CMG'})
+    workspace.children = {'sequencing': sequencing}
+    workspace.tasks = {'sequencing': sequencing}
+    context = Node({
+        'logged_already': [],
+        'bucket_fields': [{'entity_name': 'sequencing', 'bucket_fields': ['cram_path', 'crai_path']}],
+        'inverted_config': {'sequencing': 'Task', 'sample': 'Specimen'},
+    })
+    return context, workspace
+
+
+def test_ensure_tasks_linked_to_documents():
+    """Should link every task to its documents and specimen."""
+    context, workspace = _synthetic_workspace(3)
+    ensure_tasks_linked_to_documents(context, 'CMG', workspace, {})
+    tasks = workspace.tasks['sequencing']
+    assert len(tasks) == 3
+    for i, task in enumerate(tasks):
+        assert task['outputs'] == {'sequencing': {'cram_path': f"gs://bucket/seq-{i}.cram", 'crai_path': f"gs://bucket/seq-{i}.cram.crai"}}
+        assert task['inputs'] == [{'name': f"sample-{i}", 'entityType': 'sample', 'fhir_entity': 'Specimen'}]
+
+
+@pytest.mark.benchmark
+def test_benchmark_ensure_tasks_linked_to_documents():
+    """Log the time to link tasks in a large workspace."""
+    context, workspace = _synthetic_workspace(BENCHMARK_ROWS)
+    start = time.time()
+    ensure_tasks_linked_to_documents(context, 'CMG', workspace, {})
+    logger.info(f"ensure_tasks_linked_to_documents: {time.time() - start:.1f}s for {BENCHMARK_ROWS} rows")
+
+
+def _id_before(*args):
+    """_id before the namespace was computed once and ids were cached."""
+    name = '-'.join([x for x in args])
+    namespace = bytes(bytearray("pyAnVIL".ljust(16), 'utf-8'))
+    namespace_uuid = uuid.UUID(bytes=namespace)
+    return str(uuid.uuid5(namespace_uuid, name))
+
+
+def _fhir_id_before(*args):
+    """_fhir_id before the pattern was compiled and ids were cached."""
+    return re.sub(r'[^A-Za-z0-9\-\.]', "-", ".".join(str(a) for a in args))[-64:]
+
+
+def _ids_per_second(fn, keys):
+    start = time.perf_counter()
+    for key in keys:
+        fn(*key)
+    return len(keys) / (time.perf_counter() - start)
+
+
+def test_ids_unchanged():
+    """Cached ids should be those created before caching."""
+    keys = [('AnVIL_CMG_Synthetic', 'Patient', f"subject-{i // 2}") for i in range(10)] + [('a b', 'c/d', 'e.f')]
+    for fn, before in [(_id, _id_before), (_fhir_id, _fhir_id_before)]:
+        fn.cache_clear()
+        assert [fn(*key) for key in keys] == [before(*key) for key in keys]
+        assert fn.cache_info().hits == 5
+
+
+@pytest.mark.benchmark
+def test_benchmark_ids():
+    """Log ids created per second, before and after caching, when patients are referenced repeatedly."""
+    # each patient is referenced by its specimen, task, observations ...
+    keys = [('AnVIL_CMG_Synthetic', 'Patient', f"subject-{i // 8}") for i in range(200_000)]
+    for fn, before in [(_id, _id_before), (_fhir_id, _fhir_id_before)]:
+        fn.cache_clear()
+        rate_before = _ids_per_second(before, keys)
+        rate = _ids_per_second(fn, keys)
+        logger.info(f"{fn.__name__}: {rate_before:,.0f} ids/sec before, {rate:,.0f} ids/sec after")
+
+
+def _seconds(fn, items):
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    return time.perf_counter() - start
+
+
+def test_serializer():
+    """Should write what json writes, and read it back."""
+    _, workspace = _synthetic_workspace(3)
+    entities = workspace.children['sequencing']
+    encoded = [json.dumps(entity, separators=(',', ':'), default=json_serial) for entity in entities]
+    assert [serializer.dumps(entity, default=json_serial) for entity in entities] == encoded
+    assert [serializer.loads(text) for text in encoded] == entities
+
+
+@pytest.mark.benchmark
+def test_benchmark_serializer():
+    """Log serializer speed relative to json."""
+    _, workspace = _synthetic_workspace(100_000)
+    entities = workspace.children['sequencing']
+    encoded = [json.dumps(entity, separators=(',', ':'), default=json_serial) for entity in entities]
+    dumps_before = _seconds(lambda entity: json.dumps(entity, separators=(',', ':'), default=json_serial), entities)
+    dumps_after = _seconds(lambda entity: serializer.dumps(entity, default=json_serial), entities)
+    loads_before = _seconds(json.loads, encoded)
+    loads_after = _seconds(serializer.loads, encoded)
+    logger.info(f"{serializer.BACKEND}: dumps {dumps_before / dumps_after:.1f}x, loads {loads_before / loads_after:.1f}x faster than json")
@@ -0,0 +1,41 @@
+"""This module tests the FHIR data store loader."""
+
+import gzip
+import json
+import os
+
+from click.testing import CliRunner
+
+from anvil.etl.loaders.fhir import datastore
+
+
+def _run(monkeypatch, output_path):
+    """Invoke load-public, return the commands it ran."""
+    cmds = []
+
+    def _run_cmd(command_line):
+        cmds.append(command_line)
+        if command_line.strip().startswith('find'):
+            return '\n'.join(
+                os.path.join(root, name)
+                for root, _, names in os.walk(f"{output_path}/fhir") for name in names if name.startswith('ResearchStudy.ndjson')
+            )
+        return ''
+
+    monkeypatch.setattr(datastore, 'run_cmd', _run_cmd)
+    monkeypatch.setattr('anvil.etl.loaders.fhir.run_cmd', _run_cmd)
+    monkeypatch.setattr(datastore, '_log_console_link', lambda logger: None)
+    result = CliRunner().invoke(datastore.data_store_cli, ['load-public'], obj={'output_path': output_path})
+    assert result.exit_code == 0, result.output
+    return [cmd for cmd in cmds if 'fhir-stores import' in cmd]
+
+
+def test_load_public(tmp_path, monkeypatch):
+    """Should import the suffixes written locally, *.ndjson if there is no local output."""
+    assert [cmd.split('/')[-1] for cmd in _run(monkeypatch, str(tmp_path))] == ['*.ndjson']
+
+    dir_path = f"{tmp_path}/fhir/phs000001-GRU/CMG/ws/public"
+    os.makedirs(dir_path)
+    with gzip.open(f"{dir_path}/ResearchStudy.ndjson.gz", 'wt') as output_stream:
+        json.dump({'id': 'ws', 'identifier': [{'system': 'https://anvil.terra.bio/#consortium', 'value': 'CMG'}]}, output_stream)
+    assert [cmd.split('/')[-1] for cmd in _run(monkeypatch, str(tmp_path))] == ['*.ndjson.gz']
@@ -0,0 +1,171 @@
+"""This module tests the sqlite entity cache."""
+
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from anvil.etl.utilities.entities import Entities, EntitiesWriter, StaleBlobsError
+
+
+def test_put_many(tmp_path):
+    """Should write vertices and edges in batches."""
+    entities = Entities(path=f"{tmp_path}/entities.sqlite")
+    vertices = ((f"sample/ws/{i}", 'sample', {'name': str(i)}) for i in range(25))
+    assert entities.put_many(vertices, batch_size=10) == 25
+    edges = (("ws", f"sample/ws/{i}", 'workspace', 'sample') for i in range(25))
+    assert entities.put_edges_many(edges, batch_size=10) == 25
+    entities.index()
+
+    assert entities.get('sample/ws/3') == {'name': '3'}
+    assert len(list(entities.get_by_label('sample'))) == 25
+    assert len(entities.get_edges(src='ws', src_name='workspace')['sample']) == 25
+
+    # replace semantics
+    assert entities.put_many([('sample/ws/3', 'sample', {'name': 'three'})]) == 1
+    assert entities.get('sample/ws/3') == {'name': 'three'}
+    assert len(list(entities.get_by_label('sample'))) == 25
+
+
+def test_get_edges(tmp_path):
+    """Should join edges to their vertices."""
+    entities = Entities(path=f"{tmp_path}/entities.sqlite")
+    entities.put_many([
+        ('ws', 'workspace', {'consortium_name': 'CMG', 'workspace': {'name': 'ws'}}),
+        ('schema/ws', 'schema', {'sample': {}}),
+        ('sample/ws/1', 'sample', {'name': '1'}),
+        ('sample/ws/2', 'sample', {'name': '2'}),
+    ])
+    entities.put_edges_many([
+        ('ws', 'schema/ws', 'workspace', 'schema'),
+        ('ws', 'sample/ws/1', 'workspace', 'sample'),
+        ('ws', 'sample/ws/2', 'workspace', 'sample'),
+        ('ws', 'sample/ws/missing', 'workspace', 'sample'),
+    ])
+    entities.index()
+
+    children = entities.get_edges(src='ws', src_name='workspace')
+    assert children['schema'] == [{'sample': {}}]
+    assert sorted(children['sample'], key=lambda v: v['name'] if v else '') == [None, {'name': '1'}, {'name': '2'}]
+
+    assert entities.get_edges_by_label(src='ws', src_name='workspace', dst_name='schema') == {'schema': {'sample': {}}}
+    assert len(list(entities.iter_edges(src='ws', src_name='workspace', dst_name='sample', limit=1))) == 1
+    assert list(entities.iter_edges(src='other', src_name='workspace')) == []
+    assert entities.get_edge_counts(src_name='workspace') == {'ws': 4}
+
+
+def test_catalog(tmp_path):
+    """Should list and fetch workspaces from the catalog."""
+    entities = Entities(path=f"{tmp_path}/entities.sqlite")
+    entities.put_many([
+        ('ws-b', 'workspace', {'consortium_name': 'CMG', 'workspace': {'name': 'ws-b'}}),
+        ('ws-a', 'workspace', {'consortium_name': 'CCDG', 'workspace': {'name': 'ws-a'}}),
+    ])
+    # reads don't write, the catalog is built on index
+    assert entities.get_catalog() == []
+    entities.index()
+    assert entities.get_catalog() == [('CCDG', 'ws-a'), ('CMG', 'ws-b')]
+    assert entities.get_catalog(consortium_name='CMG') == [('CMG', 'ws-b')]
+    assert entities.get_catalog(workspace_name='ws-a') == [('CCDG', 'ws-a')]
+    assert [w['workspace']['name'] for w in entities.get_workspaces(workspace_name='ws-b')] == ['ws-b']
+
+    entities.put_many([('ws-c', 'workspace', {'consortium_name': 'CMG', 'workspace': {'name': 'ws-c'}})])
+    entities.put_catalog([('ws-c', 'CMG')])
+    assert entities.get_catalog(consortium_name='CMG') == [('CMG', 'ws-b'), ('CMG', 'ws-c')]
+
+    # rebuilt, not added to, dropping workspaces no longer extracted
+    entities.put_catalog([('ws-gone', 'CMG')])
+    entities.index()
+    assert entities.get_catalog() == [('CCDG', 'ws-a'), ('CMG', 'ws-b'), ('CMG', 'ws-c')]
+
+
+def test_catalog_migration(tmp_path):
+    """Should build the catalog when opening a database written before the catalog existed."""
+    path = f"{tmp_path}/entities.sqlite"
+    Entities(path=path).put_many([('ws-a', 'workspace', {'consortium_name': 'CCDG', 'workspace': {'name': 'ws-a'}})])
+    with sqlite3.connect(path) as conn:
+        conn.execute("DROP TABLE catalog")
+    assert Entities(path=path).get_catalog() == [('CCDG', 'ws-a')]
+
+
+def test_writer(tmp_path):
+    """Should funnel writes from many threads through one writer."""
+    path = f"{tmp_path}/entities.sqlite"
+
+    def _produce(writer, i):
+        writer.put(
+            vertices=[(f"sample/ws/{i}", 'sample', {'name': str(i)})],
+            edges=[('ws', f"sample/ws/{i}", 'workspace', 'sample')],
+        )
+
+    with EntitiesWriter(path=path, batch_size=7, max_pending=2) as writer:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            for i in range(50):
+                executor.submit(_produce, writer, i)
+    assert writer.vertex_count == 50
+    assert writer.edge_count == 50
+    assert len(Entities(path=path).get_edges(src='ws', src_name='workspace')['sample']) == 50
+
+
+def test_writer_exception(tmp_path):
+    """Should surface writer errors to the caller."""
+    with pytest.raises(TypeError):
+        with EntitiesWriter(path=f"{tmp_path}/entities.sqlite") as writer:
+            writer.put(vertices=[('key', 'label', {'not': object()})])
+
+
+def test_replace_edges(tmp_path):
+    """Should replace a workspace's vertices and edges, leaving others alone."""
+    entities = Entities(path=f"{tmp_path}/entities.sqlite")
+    for ws in ['ws-a', 'ws-b']:
+        entities.put_many((f"sample/{ws}/{i}", 'sample', {'name': str(i)}) for i in range(3))
+        entities.put_edges_many((ws, f"sample/{ws}/{i}", 'workspace', 'sample') for i in range(3))
+
+    entities.stage_many('ws-a', [('sample/ws-a/9', 'sample', {'name': '9'})], [('ws-a', 'sample/ws-a/9', 'workspace', 'sample')])
+    # nothing visible until replaced
+    assert len(entities.get_edges(src='ws-a', src_name='workspace')['sample']) == 3
+    entities.replace_edges('ws-a', 'workspace')
+    assert entities.get_edges(src='ws-a', src_name='workspace')['sample'] == [{'name': '9'}]
+    assert entities.get('sample/ws-a/0') is None
+    assert len(entities.get_edges(src='ws-b', src_name='workspace')['sample']) == 3
+    # staging emptied
+    entities.replace_edges('ws-a', 'workspace')
+    assert entities.get_edges(src='ws-a', src_name='workspace') == {}
+
+    entities.put_workspace_state('ws-a', '2022-01-01T00:00:00.000Z', {'sample': 1})
+    assert entities.get_workspace_states() == {'ws-a': ('2022-01-01T00:00:00.000Z', {'sample': 1})}
+
+
+def test_checkpoints(tmp_path):
+    """Should record and clear page tokens."""
+    entities = Entities(path=f"{tmp_path}/entities.sqlite")
+    entities.put_checkpoint('bucket-a', 'token-1', False)
+    entities.put_checkpoint('bucket-b', None, True)
+    assert entities.get_checkpoints() == {'bucket-a': ('token-1', False), 'bucket-b': (None, True)}
+    entities.clear_checkpoints()
+    assert entities.get_checkpoints() == {}
+
+
+def test_blobs(tmp_path):
+    """Should write and fetch blob attributes by url."""
+    path = f"{tmp_path}/entities.sqlite"
+    with EntitiesWriter(path=path) as writer:
+        writer.put_blobs([('gs://b/x.cram', 'b', 'x.cram', 10, 'md5', 'crc', '2022-01-01T00:00:00.000Z')])
+        writer.put_blobs([('gs://b/x.cram', 'b', 'x.cram', 11, 'md5', 'crc', '2022-01-02T00:00:00.000Z')])
+    assert writer.blob_count == 2
+    entities = Entities(path=path)
+    assert entities.get_blob('gs://b/x.cram')['size'] == 11
+    assert entities.get_blob('gs://b/missing') is None
+    assert entities.get_blobs(['gs://b/x.cram', 'gs://b/missing']) == {'gs://b/x.cram': entities.get_blob('gs://b/x.cram'), 'gs://b/missing': None}
+
+
+def test_stale_blobs(tmp_path):
+    """Should refuse to read blobs from a database holding them as vertices, as older extracts wrote them."""
+    entities = Entities(path=f"{tmp_path}/entities.sqlite")
+    entities.put_many([('gs://b/x.cram', 'Blob', {'bucket': 'b', 'name': 'x.cram', 'size': 10})])
+    with pytest.raises(StaleBlobsError, match='extract google'):
+        entities.get_blobs(['gs://b/x.cram'])
+    with pytest.raises(StaleBlobsError):
+        entities.get_blob('gs://b/x.cram')
+    entities.put_blobs([('gs://b/x.cram', 'b', 'x.cram', 10, 'md5', 'crc', '2022-01-01T00:00:00.000Z')])
+    assert entities.get_blob('gs://b/x.cram')['size'] == 10
@@ -0,0 +1,89 @@
+"""This module tests the FHIR writer."""
+
+import os
+
+import pytest
+
+from anvil.etl import read_config
+from anvil.etl.transformers.fhir_writer import write, workspace_dir_path
+from anvil.etl.transformers.model import Workspace
+
+
+def _workspace():
+    """Return a small normalized workspace that exercises every resource the writer emits, and non-ascii text."""
+    def _blob(name):
+        return {'url': f"gs://bucket/{name}", 'size': 10, 'drs_uri': None}
+
+    patients = {}
+    for i, (relationship, gender, age) in enumerate([('proband', 'female', '12'), ('mother', None, None), ('father', 'male', '40')]):
+        specimen = {
+            'entityType': 'sample',
+            'name': f"sample-{i}",
+            'attributes': {'collaborator_sample_id': f"s{i}", 'nested': {'a': 1}, 'site': 'Zürich'},
+            'body_site': 'Adrenal Gland' if i == 0 else None,
+            'tasks': [{
+                'entityType': 'sequencing',
+                'name': f"seq-{i}",
+                'attributes': {'cram_path': f"gs://bucket/{i}.cram"},
+                'inputs': [{'entityType': 'sample', 'name': f"sample-{i}", 'fhir_entity': 'Specimen'}],
+                'outputs': {'sequencing': {'cram_path': _blob(f"{i}.cram"), 'crai_path': _blob(f"{i}.crai")}},
+            }]
+        }
+        patient = {
+            'entityType': 'subject',
+            'name': f"subject-{i}",
+            'attributes': {'family_id': 'fam-1'},
+            'gender': gender,
+            'age': age,
+            'specimens': [specimen],
+            'family_relationship_values': [{'family_id': 'fam-1', 'family_relationship': relationship}],
+        }
+        patients[patient['name']] = patient
+    # a family without a proband
+    patients['subject-3'] = {
+        'entityType': 'subject', 'name': 'subject-3', 'attributes': {}, 'gender': 'male',
+        'family_relationship_values': [{'family_id': 'fam-2', 'family_relationship': 'father'}],
+    }
+    patients['subject-4'] = {
+        'entityType': 'subject', 'name': 'subject-4', 'attributes': {}, 'gender': 'female',
+        'family_relationship_values': [{'family_id': 'fam-2', 'family_relationship': 'mother'}],
+    }
+    return Workspace({
+        'workspace': {'name': 'AnVIL_CMG_Test'},
+        'consortium_name': 'CMG',
+        'practitioner': 'Dr. Test',
+        'patients': patients,
+        'tracker': {
+            'phsId': 'phs000001', 'library:dataUseRestriction': 'GRU',
+            'library:indication': 'TRIGEMINAL NEURALGIA', 'library:studyDesign': 'Case-Control', 'library:datatype': None,
+        },
+    })
+
+
+# written by the fhirclient model builders, before the dict builders, from _workspace()
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), 'fixtures', 'fhir_writer')
+
+
+def _read_all(dir_path):
+    """Return {relative path: bytes} of files written."""
+    files = {}
+    for root, _, names in os.walk(dir_path):
+        for name in names:
+            with open(os.path.join(root, name), 'rb') as input_stream:
+                files[os.path.relpath(os.path.join(root, name), dir_path)] = input_stream.read()
+    return files
+
+
+@pytest.mark.parametrize('strict', [False, True])
+def test_baseline_parity(tmp_path, strict):
+    """Should write byte for byte what the fhirclient model builders wrote."""
+    config = read_config()
+    counts = write('CMG', _workspace(), str(tmp_path), True, config, strict=strict)
+    assert {'Patient', 'Specimen', 'Task', 'DocumentReference', 'Observation', 'ResearchStudy'} <= set(counts)
+
+    written = _read_all(workspace_dir_path(str(tmp_path), 'CMG', _workspace()))
+    expected = _read_all(FIXTURE_PATH)
+    assert sorted(written) == sorted(expected)
+    for path in expected:
+        assert written[path] == expected[path], path
+    assert sum(counts.values()) == sum(len(resources.splitlines()) for resources in expected.values())
@@ -0,0 +1,85 @@
+"""This module tests skipping unchanged workspaces."""
+
+import json
+
+import pytest
+
+# gen3 is a requirement, skip rather than fail collection where it isn't installed
+pytest.importorskip('gen3')
+
+from anvil.etl.transformers import fingerprint as fingerprint_module  # noqa: E402
+from anvil.etl.transformers.fingerprint import is_fresh, read_record, workspace_fingerprint, write_record  # noqa: E402
+from anvil.etl.transformers.workspace_store import FORMAT_VERSION  # noqa: E402
+from anvil.etl.utilities.entities import Entities  # noqa: E402
+
+CONFIG = {'consortiums': {'CMG': {}}}
+
+
+@pytest.fixture
+def output_path(tmp_path):
+    """Return an output path with one extracted workspace."""
+    with open(f"{tmp_path}/data_ingestion_tracker.json", 'w') as output_stream:
+        json.dump([{'name': 'ws'}], output_stream)
+    entities = Entities(path=f"{tmp_path}/terra_entities.sqlite")
+    entities.put_many([('ws', 'workspace', {'consortium_name': 'CMG', 'workspace': {'name': 'ws'}}), ('sample/ws/1', 'sample', {'name': '1'})])
+    entities.put_edges_many([('ws', 'sample/ws/1', 'workspace', 'sample')])
+    entities.index()
+    return str(tmp_path)
+
+
+def test_is_fresh(output_path):
+    """Should be fresh while inputs and options are unchanged."""
+    fingerprint = workspace_fingerprint(output_path, 'CMG', 'ws', False, CONFIG)
+    write_record(output_path, 'CMG', 'ws', 'normalize', {'fingerprint': fingerprint, 'urls': [], 'format_version': FORMAT_VERSION})
+    assert is_fresh(output_path, 'CMG', 'ws', False, CONFIG, 'normalize', format_version=FORMAT_VERSION)
+    # store written in another format
+    assert not is_fresh(output_path, 'CMG', 'ws', False, CONFIG, 'normalize', format_version=FORMAT_VERSION + 1)
+    # records written before the format was recorded
+    write_record(output_path, 'CMG', 'ws', 'normalize', {'fingerprint': fingerprint, 'urls': []})
+    assert not is_fresh(output_path, 'CMG', 'ws', False, CONFIG, 'normalize', format_version=FORMAT_VERSION)
+
+    Entities(path=f"{output_path}/terra_entities.sqlite").put_many([('sample/ws/1', 'sample', {'name': 'one'})])
+    assert workspace_fingerprint(output_path, 'CMG', 'ws', False, CONFIG) != fingerprint
+
+
+def test_code_versions(output_path, monkeypatch):
+    """Should be stale once the code that wrote the record changes."""
+    fingerprint = workspace_fingerprint(output_path, 'CMG', 'ws', False, CONFIG)
+    write_record(output_path, 'CMG', 'ws', 'normalize', {'fingerprint': fingerprint, 'urls': []})
+    write_record(output_path, 'CMG', 'ws', 'fhir', {'fingerprint': fingerprint, 'urls': []})
+    assert read_record(output_path, 'CMG', 'ws', 'fhir')['fhir_writer_version'] == fingerprint_module.FHIR_WRITER_VERSION
+    assert is_fresh(output_path, 'CMG', 'ws', False, CONFIG, 'normalize')
+    assert is_fresh(output_path, 'CMG', 'ws', False, CONFIG, 'fhir')
+    monkeypatch.setitem(fingerprint_module.CODE_VERSIONS, 'fhir', {'normalizer_version': 1, 'fhir_writer_version': 2})
+    assert is_fresh(output_path, 'CMG', 'ws', False, CONFIG, 'normalize')
+    assert not is_fresh(output_path, 'CMG', 'ws', False, CONFIG, 'fhir')
+    # fhir output is written from normalized workspaces
+    monkeypatch.setitem(fingerprint_module.CODE_VERSIONS, 'normalize', {'normalizer_version': 2})
+    monkeypatch.setitem(fingerprint_module.CODE_VERSIONS, 'fhir', {'normalizer_version': 2, 'fhir_writer_version': 1})
+    assert not is_fresh(output_path, 'CMG', 'ws', False, CONFIG, 'normalize')
+    assert not is_fresh(output_path, 'CMG', 'ws', False, CONFIG, 'fhir')
+
+
+def test_fingerprints_computed_once(output_path):
+    """Should compute a fingerprint once per set of urls for calls sharing fingerprints."""
+    fingerprints = {}
+    fingerprint = workspace_fingerprint(output_path, 'CMG', 'ws', False, CONFIG, fingerprints=fingerprints)
+    write_record(output_path, 'CMG', 'ws', 'fhir', {'fingerprint': fingerprint, 'urls': []})
+    Entities(path=f"{output_path}/terra_entities.sqlite").put_many([('sample/ws/1', 'sample', {'name': 'one'})])
+    # cached, not rehashed
+    assert is_fresh(output_path, 'CMG', 'ws', False, CONFIG, 'fhir', fingerprints=fingerprints)
+    assert not is_fresh(output_path, 'CMG', 'ws', False, CONFIG, 'fhir')
+    assert list(fingerprints) == [(False, ())]
+
+
+def test_accept_validated(output_path):
+    """Should let a record written with validate_buckets satisfy a check without, only if asked."""
+    fingerprint = workspace_fingerprint(output_path, 'CMG', 'ws', True, CONFIG)
+    write_record(output_path, 'CMG', 'ws', 'normalize', {'fingerprint': fingerprint, 'urls': [], 'validate_buckets': True})
+    assert is_fresh(output_path, 'CMG', 'ws', False, CONFIG, 'normalize', accept_validated=True)
+    assert is_fresh(output_path, 'CMG', 'ws', True, CONFIG, 'normalize', accept_validated=True)
+    assert not is_fresh(output_path, 'CMG', 'ws', False, CONFIG, 'normalize')
+    # not the other way round
+    write_record(output_path, 'CMG', 'ws', 'normalize', {
+        'fingerprint': workspace_fingerprint(output_path, 'CMG', 'ws', False, CONFIG), 'urls': [], 'validate_buckets': False})
+    assert not is_fresh(output_path, 'CMG', 'ws', True, CONFIG, 'normalize', accept_validated=True)
@@ -0,0 +1,56 @@
+"""This module tests reading gen3 file records."""
+
+import logging
+import sqlite3
+
+import pytest
+
+# gen3 is a requirement, skip rather than fail collection where it isn't installed
+pytest.importorskip('gen3')
+
+from anvil.etl.extractors.gen3 import DRSReader, _load, _replace_tables  # noqa: E402
+
+
+def test_drs_reader(tmp_path):
+    """Preloaded and sql lookups should agree, NULL columns never match."""
+    conn = sqlite3.connect(f"{tmp_path}/drs_file.sqlite")
+    conn.execute("CREATE TABLE drs_file (md5sum text, sequencing_id text PRIMARY KEY, file_name text, ga4gh_drs_uri text)")
+    conn.executemany("INSERT into drs_file values (?, ?, ?, ?)", [
+        (None, 's1', 'a.cram', 'drs://a'),
+        ('md5-b', 's2', None, 'drs://b'),
+        ('md5-c', 's3', 'c.cram', 'drs://c'),
+    ])
+    conn.commit()
+    conn.close()
+    readers = [DRSReader(str(tmp_path)), DRSReader(str(tmp_path), preload=True)]
+    for file_name, md5sum, expected in [('a.cram', None, 'drs://a'), ('missing', None, None), (None, 'md5-b', 'drs://b'), ('missing', 'md5-c', 'drs://c')]:
+        for reader in readers:
+            item = reader.get(file_name=file_name, md5sum=md5sum)
+            assert (item['ga4gh_drs_uri'] if item else None) == expected, (file_name, md5sum)
+    for reader in readers:
+        assert {k: v['sequencing_id'] if v else None for k, v in reader.get_many(['a.cram', 'missing']).items()} == {'a.cram': 's1', 'missing': None}
+
+
+def test_replace_tables(tmp_path):
+    """Should keep the previous tables until the new ones replace them, in one transaction."""
+    conn = sqlite3.connect(f"{tmp_path}/drs_file.sqlite")
+    columns = "(md5sum text, sequencing_id text PRIMARY KEY, file_name text, ga4gh_drs_uri text, sample_submitter_id text, subject_submitter_id text, subject_id text, project_id text, anvil_project_id text)"
+    for table in ['drs_file', 'drs_file_new']:
+        conn.execute(f"CREATE TABLE {table} {columns}")
+        conn.execute(f"CREATE TABLE {table}_reject (json text NOT NULL, error text NOT NULL)")
+    conn.execute("CREATE INDEX drs_file_md5sum ON drs_file(md5sum)")
+    conn.execute("INSERT into drs_file values ('md5-old', 'old', 'old.cram', 'drs://old', null, null, null, 'p', null)")
+    conn.commit()
+    records = [
+        {'md5sum': 'md5-new', 'node_id': 'new', 'file_name': 'new.cram', 'drs_id': 'drs://new', 'sample_submitter_id': ['s'],
+         'subject_submitter_id': [], '_subject_id': ['x'], 'project_id': 'p', 'anvil_project_id': None},
+        {'md5sum': 'md5-bad'},
+    ]
+    assert _load(conn, records, 10, logging.getLogger(__name__), table='drs_file_new') == (1, 1)
+    # a short or failed export stops here, the previous table is untouched
+    assert conn.execute("SELECT sequencing_id FROM drs_file").fetchall() == [('old',)]
+    _replace_tables(conn)
+    assert conn.execute("SELECT sequencing_id FROM drs_file").fetchall() == [('new',)]
+    assert conn.execute("SELECT count(*) FROM drs_file_reject").fetchone() == (1,)
+    tables = {name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    assert tables == {'drs_file', 'drs_file_reject'}
@@ -0,0 +1,68 @@
+"""This module tests the normalized workspace model and store."""
+
+import pickle
+
+import pytest
+
+from anvil.etl.transformers.model import Workspace
+from anvil.etl.transformers.workspace_store import read_workspace_store, write_workspace_store
+from anvil.etl.utilities.node import Node
+
+
+def test_node():
+    """Should read and write items as attributes."""
+    node = Node({'workspace': {'name': 'ws'}})
+    assert node.workspace.name == 'ws'
+    assert isinstance(node['workspace'], Node)
+    node.consortium_name = 'CMG'
+    assert node['consortium_name'] == 'CMG'
+    with pytest.raises(AttributeError):
+        node.missing
+
+
+def test_workspace():
+    """Should keep fields in slots and unknown keys in extra."""
+    workspace = Workspace({'workspace': {'name': 'ws'}, 'consortium_name': 'CMG', 'accessLevel': 'READER'})
+    assert workspace.workspace.name == 'ws'
+    assert workspace['accessLevel'] == 'READER'
+    assert 'tasks' not in workspace
+    workspace['tasks'] = {'sequencing': []}
+    assert workspace.tasks == {'sequencing': []}
+    assert workspace.keys() == ['workspace', 'consortium_name', 'tasks', 'accessLevel']
+    with pytest.raises(KeyError):
+        workspace['patients']
+    assert dict(pickle.loads(pickle.dumps(workspace)).items()) == dict(workspace.items())
+
+
+def test_store(tmp_path):
+    """Should round trip a workspace, reading sections on first use."""
+    workspace = Workspace({'workspace': {'name': 'ws'}, 'consortium_name': 'CMG', 'accessLevel': 'READER'})
+    workspace.patients = {'p1': {'name': 'p1'}}
+    workspace.errors = {}
+    path = f"{tmp_path}/ws.sqlite"
+    write_workspace_store(path, workspace)
+
+    stored = read_workspace_store(path)
+    assert stored.keys() == workspace.keys()
+    assert 'patients' in stored
+    assert stored.patients == {'p1': {'name': 'p1'}}
+    assert stored.workspace.name == 'ws'
+    assert stored['accessLevel'] == 'READER'
+    assert dict(stored.items()) == dict(workspace.items())
+    assert read_workspace_store(f"{tmp_path}/missing.sqlite") is None
+
+
+def test_store_copies(tmp_path):
+    """Should read shared dicts back as copies and sets as lists."""
+    task = {'name': 't1'}
+    workspace = Workspace({'workspace': {'name': 'ws'}, 'consortium_name': 'CMG'})
+    workspace.tasks = {'sequencing': [task]}
+    workspace.patients = {'p1': {'name': 'p1', 'specimens': [{'name': 's1', 'tasks': [task]}], 'genders': {'female'}}}
+    path = f"{tmp_path}/ws.sqlite"
+    write_workspace_store(path, workspace)
+
+    stored = read_workspace_store(path)
+    stored_task = stored.tasks['sequencing'][0]
+    assert stored_task == stored.patients['p1']['specimens'][0]['tasks'][0]
+    assert stored_task is not stored.patients['p1']['specimens'][0]['tasks'][0]
+    assert stored.patients['p1']['genders'] == ['female']
@@ -0,0 +1,80 @@
+"""This module tests the staged ndjson writer."""
+
+import gzip
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from anvil.etl.utilities.ndjson import NDJSONWriter
+
+
+def _lines(path):
+    with open(path, encoding='utf-8') as input_stream:
+        return [json.loads(line) for line in input_stream]
+
+
+def test_commit(tmp_path):
+    """Should reopen evicted files in append mode and replace the previous files on commit."""
+    dir_path, staging_path = f"{tmp_path}/fhir/ws", f"{tmp_path}/staging/ws"
+    os.makedirs(dir_path)
+    with open(f"{dir_path}/stale.ndjson", 'w') as output_stream:
+        output_stream.write('{}\n')
+    with NDJSONWriter(dir_path, staging_path, max_open=1) as writer:
+        for i in range(3):
+            writer.write('public/a.ndjson', {'i': i})
+            writer.write('protected/b.ndjson', {'i': i})
+        assert not os.path.exists(f"{dir_path}/public")
+    assert writer.counts == {'public/a.ndjson': 3, 'protected/b.ndjson': 3}
+    assert _lines(f"{dir_path}/public/a.ndjson") == [{'i': 0}, {'i': 1}, {'i': 2}]
+    assert _lines(f"{dir_path}/protected/b.ndjson") == [{'i': 0}, {'i': 1}, {'i': 2}]
+    assert not os.path.exists(f"{dir_path}/stale.ndjson")
+    assert not os.path.exists(staging_path)
+
+
+def test_abort(tmp_path):
+    """Should leave the previous files in place and remove staged files on exception."""
+    dir_path, staging_path = f"{tmp_path}/fhir/ws", f"{tmp_path}/staging/ws"
+    os.makedirs(dir_path)
+    with open(f"{dir_path}/a.ndjson", 'w') as output_stream:
+        output_stream.write('{"i":0}\n')
+    with pytest.raises(ValueError):
+        with NDJSONWriter(dir_path, staging_path) as writer:
+            writer.write('a.ndjson', {'i': 1})
+            raise ValueError('interrupted')
+    assert _lines(f"{dir_path}/a.ndjson") == [{'i': 0}]
+    assert not os.path.exists(staging_path)
+
+
+def test_gzip(tmp_path):
+    """Should write .gz files, read as one stream after reopening."""
+    dir_path, staging_path = f"{tmp_path}/fhir/ws", f"{tmp_path}/staging/ws"
+    with NDJSONWriter(dir_path, staging_path, max_open=1, compress='gzip', compress_level=1) as writer:
+        for i in range(3):
+            writer.write('public/a.ndjson', {'i': i})
+            writer.write('protected/b.ndjson', {'i': i})
+    assert writer.counts == {'public/a.ndjson.gz': 3, 'protected/b.ndjson.gz': 3}
+    with gzip.open(f"{dir_path}/public/a.ndjson.gz", 'rt') as input_stream:
+        assert [json.loads(line) for line in input_stream] == [{'i': 0}, {'i': 1}, {'i': 2}]
+
+
+@pytest.mark.parametrize('compress', [None, 'gzip'])
+def test_encoding(tmp_path, compress):
+    """Should write utf-8 whatever the locale's encoding, here ascii."""
+    dir_path, staging_path = f"{tmp_path}/fhir/ws", f"{tmp_path}/staging/ws"
+    script = (
+        "import sys\n"
+        "from anvil.etl.utilities.ndjson import NDJSONWriter\n"
+        "with NDJSONWriter(sys.argv[1], sys.argv[2], compress=sys.argv[3] or None) as writer:\n"
+        "    writer.write('a.ndjson', {'name': 'M\\u00fcller'})\n"
+    )
+    # C locale without utf-8 mode or locale coercion
+    env = dict(os.environ, LC_ALL='C', LANG='C', PYTHONUTF8='0', PYTHONCOERCECLOCALE='0')
+    # the package root, anvil may not be installed
+    cwd = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    subprocess.run([sys.executable, '-c', script, dir_path, staging_path, compress or ''], env=env, cwd=cwd, check=True)
+    path = f"{dir_path}/a.ndjson{'.gz' if compress else ''}"
+    with (gzip.open(path) if compress else open(path, 'rb')) as input_stream:
+        assert json.loads(input_stream.read().decode('utf-8')) == {'name': 'Müller'}
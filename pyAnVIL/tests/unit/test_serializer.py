@@ -0,0 +1,39 @@
+"""This module tests the json serializer."""
+
+import json
+from datetime import datetime
+
+from anvil.etl.utilities import serializer
+from anvil.etl.utilities.entities import json_serial
+
+
+def test_same_as_json():
+    """Should write what compact, non ascii escaped json writes, whichever backend is installed."""
+    values = [
+        {'name': 'sample-1', 'attributes': {'size': 10, 'ratio': 0.25, 'tags': ['a', None, True]}},
+        {'long': 2 ** 70, 'text': 'café\x7f', 'created': datetime(2020, 1, 2, 3, 4, 5)},
+        {1: 'non str key'},
+        [],
+    ]
+    for value in values:
+        expected = json.dumps(value, separators=(',', ':'), ensure_ascii=False, default=json_serial)
+        assert serializer.dumps(value, default=json_serial) == expected
+        assert serializer.loads(expected) == json.loads(expected)
+        assert serializer.loads(expected.encode()) == json.loads(expected)
+    assert serializer.dumps({'b': 1, 'a': 2}, sort_keys=True) == '{"a":2,"b":1}'
+
+
+def test_floats():
+    """Should write floats that read back as the same value, formatting may differ by backend."""
+    value = {'small': 0.00001, 'large': 1e16, 'ratio': 0.1}
+    assert serializer.loads(serializer.dumps(value)) == value
+    assert json.loads(serializer.dumps(value)) == value
+
+
+def test_ensure_ascii():
+    """Should escape non-ascii text as json.dumps does by default, only if ensure_ascii."""
+    for value in [{'text': 'café', 'emoji': '\U0001f600', 'control': '\x7f'}, {'text': 'plain'}, {'long': 2 ** 70, 'text': 'Zürich'}]:
+        expected = json.dumps(value, separators=(',', ':'))
+        assert serializer.dumps(value, ensure_ascii=True) == expected
+        assert serializer.dumps(value, ensure_ascii=True).isascii()
+        assert serializer.loads(serializer.dumps(value)) == value
@@ -0,0 +1,66 @@
+"""This module tests reading terra workspaces."""
+
+import json
+
+from click.testing import CliRunner
+
+import anvil.etl.extractors.terra as terra
+from anvil.etl.utilities.entities import Entities
+
+
+class _Response:
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+def _entities(tmp_path):
+    """Return an entity cache with one workspace, its schema and a sample."""
+    entities = Entities(path=f"{tmp_path}/terra_entities.sqlite")
+    entities.put_many([
+        ('ws', 'workspace', {'consortium_name': 'CMG', 'workspace': {'name': 'ws'}}),
+        ('schema/ws', 'schema', {'sample': {'attributeNames': ['cram_path', 'sex']}}),
+        ('sample/ws/1', 'sample', {'name': '1', 'attributes': {'cram_path': 'gs://bucket/1.cram', 'sex': 'F'}}),
+    ])
+    entities.put_edges_many([
+        ('ws', 'schema/ws', 'workspace', 'schema'),
+        ('ws', 'sample/ws/1', 'workspace', 'sample'),
+    ])
+    entities.index()
+    return entities
+
+
+def test_get_workspaces(monkeypatch):
+    """Should filter workspaces and allow attribute access."""
+    monkeypatch.setattr(terra.FAPI, 'list_workspaces', lambda: _Response([
+        {'workspace': {'namespace': 'anvil-datastorage', 'name': 'AnVIL_CMG_A'}},
+        {'workspace': {'namespace': 'other', 'name': 'AnVIL_CMG_B'}},
+        {'workspace': {'namespace': 'anvil-datastorage', 'name': 'AnVIL_CCDG_C'}},
+    ]))
+    workspaces = terra.get_workspaces(namespaces=['anvil-datastorage'], name_pattern='AnVIL_CMG_.*')
+    assert [w.workspace.name for w in workspaces] == ['AnVIL_CMG_A']
+    assert workspaces[0].workspace.project_files == []
+
+
+def test_extract_bucket_fields(tmp_path):
+    """Should find attributes that reference bucket objects."""
+    assert list(terra.extract_bucket_fields(entities=_entities(tmp_path))) == [{
+        'consortium_name': 'CMG', 'workspace_name': 'ws', 'entity_name': 'sample',
+        'bucket_fields': ['cram_path'], 'buckets': ['bucket'],
+    }]
+
+
+def test_cat_and_schema(tmp_path):
+    """Should print workspaces with their children, and schema versions."""
+    _entities(tmp_path)
+    runner = CliRunner()
+    result = runner.invoke(terra.cat, obj={'output_path': str(tmp_path)})
+    assert result.exit_code == 0, result.output
+    workspace = json.loads(result.output)
+    assert workspace['children']['sample'] == [{'name': '1', 'attributes': {'cram_path': 'gs://bucket/1.cram', 'sex': 'F'}}]
+
+    result = runner.invoke(terra.schema, obj={'output_path': str(tmp_path)})
+    assert result.exit_code == 0, result.output
+    assert json.loads(result.output) == {'CMG': {'sample': {'version_count': 1, 'details': {'cram_path,sex': {'ws': {}}}}}}
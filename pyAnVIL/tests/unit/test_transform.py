@@ -0,0 +1,26 @@
+"""This module tests running transform steps for many workspaces."""
+
+import click
+import pytest
+
+# gen3 is a requirement, skip rather than fail collection where it isn't installed
+pytest.importorskip('gen3')
+
+from anvil.etl.transform import _raise_if_failed, _run_workspaces  # noqa: E402
+
+
+def _fail_b(output_path, consortium_name, workspace_name):
+    """Process worker that fails for workspace b."""
+    if workspace_name == 'b':
+        raise ValueError('broken')
+    return workspace_name
+
+
+def test_failed_workspaces(tmp_path):
+    """Should collect failures and report them as an error."""
+    results, failed = _run_workspaces(_fail_b, str(tmp_path), [('CMG', 'a'), ('CMG', 'b')], (), 1)
+    assert results == {('CMG', 'a'): 'a'}
+    assert failed == [('CMG', 'b')]
+    with pytest.raises(click.ClickException, match='CMG/b'):
+        _raise_if_failed(failed)
+    _raise_if_failed([])